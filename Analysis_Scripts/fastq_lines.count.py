@@ -1,3 +1,10 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Error_Analysis_Scripts'))
+from fastq_batches import fastq_batches
+
+
 def count_base_lines(fastq_file):
     """
     Counts the number of lines that contain base sequences in a FASTQ file.
@@ -9,15 +16,10 @@ def count_base_lines(fastq_file):
         int: Number of base sequence lines in the FASTQ file.
     """
     try:
-        with open(fastq_file, 'r') as file:
-            # Initialize the counter for base lines
-            base_line_count = 0
-            # Iterate over the file lines
-            for i, line in enumerate(file):
-                # Every 4th line starting from the second line contains base sequences
-                if i % 4 == 1:
-                    base_line_count += 1
-        return base_line_count
+        if not os.path.exists(fastq_file):
+            raise FileNotFoundError(fastq_file)
+        # Every record holds one base sequence line, so the records are counted batch by batch
+        return sum(batch['records'] for batch in fastq_batches(fastq_file))
     except FileNotFoundError:
         print(f"File not found: {fastq_file}")
         return 0
@@ -1,14 +1,18 @@
 import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Error_Analysis_Scripts'))
+from fastq_batches import fastq_batches
 
 
 def extract_lines(num, input_file, output_file):
     try:
-        with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
-            for _ in range(num * 4):
-                line = infile.readline()
-                if not line:
-                    break
-                outfile.write(line)
+        with open(output_file, 'wb') as outfile:
+            # The first batch holds the first num records, written out as the bytes they span
+            for batch in fastq_batches(input_file, num) if num > 0 else []:
+                outfile.write(batch['data'].tobytes())
+                break
         print(f"Successfully created {output_file} with the first {num} records from {input_file}.")
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -1,18 +1,24 @@
+import os
 import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Error_Analysis_Scripts'))
+from fastq_batches import fastq_batches, field_bytes, QUALITY
+
+
 def extract_quality_scores(fastq_file, num_lines=20000000):
     quality_scores = set()
-    line_count = 0
-
-    with open(fastq_file, 'r') as file:
-        for line in file:
-            line_count += 1
-            # Quality scores are on every 4th line in a FASTQ file
-            if line_count % 4 == 0:
-                for char in line.strip():
-                    quality_scores.add(char)
-            # Stop after reading the specified number of lines
-            if line_count >= num_lines:
-                break
+    records_left = num_lines // 4
+
+    # Quality scores are on every 4th line in a FASTQ file, read in batches of records
+    for batch in fastq_batches(fastq_file):
+        scores = field_bytes(batch, QUALITY)[:batch['lengths'][:records_left, QUALITY].sum()]
+        quality_scores.update(chr(score) for score in np.unique(scores))
+        records_left -= batch['records']
+        # Stop after reading the specified number of lines
+        if records_left <= 0:
+            break
 
     return quality_scores
 
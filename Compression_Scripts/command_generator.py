@@ -9,6 +9,26 @@ from path_generator import PathGenerator
 from compressor_paths import COMPRESSOR_PATHS
 import logging
 
+# Bytes per element of each quality stream type fastq_processor can write
+QUALITY_DTYPE_SIZES = {
+    "uint8": 1,
+    "int8": 1,
+    "int16": 2,
+    "int32": 4,
+    "float32": 4
+}
+
+# sz3 data-type flag per quality stream type, the sz3 command line only reads
+# float, double and 32/64-bit integer input, so the 8/16-bit streams have no flag
+SZ3_DATA_TYPE_FLAGS = {
+    "float32": "-f",
+    "int32": "-I 32"
+}
+
+# Jobs that can take .gz/BGZF input. SZ3 and BFQZIP read the fields the C++ splitter writes, Genozip reads
+# gzip itself and Spring does with -g. fqzcomp, Renano and Enano only read plain FASTQ.
+GZIP_INPUT_COMPRESSORS = {"SZ3", "BFQZIP", "GENOZIP", "SPRING"}
+
 
 class CommandGenerator:
     def __init__(self, config_path, path_generator):
@@ -85,15 +105,35 @@ class SZ3CommandGenerator(CommandGenerator):
         if decompressed_path.endswith('.bin.fastq'):
             decompressed_path = decompressed_path[:-6]
 
-        # Replace {Binary_length} in the command options
-        compression_options = job['options'][0].replace("{Binary_length}", str("$BINARY_LENGTH"))
-        decompression_options = job['options'][1].replace("{Binary_length}", str("$BINARY_LENGTH"))
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        data_type_flag = SZ3_DATA_TYPE_FLAGS.get(quality_dtype)
+        if not data_type_flag:
+            raise ValueError(f"SZ3 cannot read {quality_dtype} quality scores, use one of {list(SZ3_DATA_TYPE_FLAGS)}.")
+        gzip_inputs = [input_file for file_pair in self.config['input_file'] for input_file in file_pair
+                       if input_file.endswith('.gz')]
+        plain_only = sorted({job['name'] for job in self.config['jobs']
+                             if job['name'].upper() not in GZIP_INPUT_COMPRESSORS})
+        if gzip_inputs and plain_only:
+            logging.error(f"{', '.join(plain_only)} cannot read gzip input")
+            raise ValueError(f"{', '.join(plain_only)} cannot read gzip input {gzip_inputs[0]}, decompress it first "
+                             f"or only use {sorted(GZIP_INPUT_COMPRESSORS)}.")
+
+        # Replace {Binary_length} and {Data_type} in the command options
+        compression_options = self.apply_data_type(job['options'][0], data_type_flag).replace("{Binary_length}", str("$BINARY_LENGTH"))
+        decompression_options = self.apply_data_type(job['options'][1], data_type_flag).replace("{Binary_length}", str("$BINARY_LENGTH"))
 
         compression_command = f"{executable_path} {compression_options} -i {input_path} -z {output_path}"
         decompression_command = f"{executable_path} {decompression_options} -z {output_path} -o {decompressed_path}"
 
         return [compression_command, decompression_command]
 
+    @staticmethod
+    def apply_data_type(options, data_type_flag):
+        if "{Data_type}" in options:
+            return options.replace("{Data_type}", data_type_flag)
+        # Options without the placeholder hard-code the float flag
+        return " ".join(data_type_flag if token == "-f" else token for token in options.split(" "))
+
 
 class FQZCompCommandGenerator(CommandGenerator):
     def generate_commands(self, job_index, file_pair_index, file_index):
@@ -143,6 +183,8 @@ class SpringCommandGenerator(CommandGenerator):
                 command = f"{executable_path} {option} -i {output_path} -o {decompressed_path}"
             else:
                 command = f"{executable_path} {option} -i {input_path} -o {output_path}"
+                if input_path.endswith('.gz'):
+                    command += " -g"  # Spring only reads gzipped FASTQ when told so
             commands.append(command)
 
         return commands
@@ -328,6 +370,20 @@ class CommandGeneratorFactory:
             if field not in self.config:
                 logging.error(f"Configuration missing required field: {field}")
                 raise ValueError(f"Configuration missing required field: {field}")
+        # Checked up front, a job without commands would only fail once its script is rendered
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        uses_sz3 = any(job['name'].upper() == 'SZ3' for job in self.config['jobs'])
+        if uses_sz3 and quality_dtype not in SZ3_DATA_TYPE_FLAGS:
+            logging.error(f"SZ3 cannot read {quality_dtype} quality scores")
+            raise ValueError(f"SZ3 cannot read {quality_dtype} quality scores, use one of {list(SZ3_DATA_TYPE_FLAGS)}.")
+        gzip_inputs = [input_file for file_pair in self.config['input_file'] for input_file in file_pair
+                       if input_file.endswith('.gz')]
+        plain_only = sorted({job['name'] for job in self.config['jobs']
+                             if job['name'].upper() not in GZIP_INPUT_COMPRESSORS})
+        if gzip_inputs and plain_only:
+            logging.error(f"{', '.join(plain_only)} cannot read gzip input")
+            raise ValueError(f"{', '.join(plain_only)} cannot read gzip input {gzip_inputs[0]}, decompress it first "
+                             f"or only use {sorted(GZIP_INPUT_COMPRESSORS)}.")
 
     def generate_all_commands(self):
         all_commands_for_files = []
@@ -342,8 +398,10 @@ class CommandGeneratorFactory:
                             job_commands = generator.generate_commands(job_index, file_pair_index, file_index)
                             command_for_current_job.append(job_commands)
                         except Exception as e:
-                            logging.warning(
+                            # Every job needs its commands, the scripts index them by job and file
+                            logging.error(
                                 f"Failed to generate commands for job {job['name']} at index {job_index}: {e}")
+                            raise
                 else:
                     logging.info(f"No generator found for {job['name']}. Skipping...")
                 commands_for_current_file_pair.append(command_for_current_job)
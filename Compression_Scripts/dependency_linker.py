@@ -1,42 +1,174 @@
 import os
 import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+# Next to main.py, whichever directory a stage is started from
+DEFAULT_DEPENDENCY_FILE = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                       'job_dependencies.json'))
+
+# Runs kept per configuration, older ones are dropped when a run of the same configuration commits
+DEFAULT_RUNS_KEPT = 10
+
+
+# One run per configuration and invocation, the stages built by one main.py call share it
+_invocation_run_ids = {}
+
+
+def default_run_id(config_path):
+    # e.g. /home/me/SeqBench/Jobs/sample.json@20261018-142155-1234, concurrent invocations of the same
+    # configuration, or of same-named ones, never share a run
+    config_path = os.path.abspath(config_path)
+    if config_path not in _invocation_run_ids:
+        _invocation_run_ids[config_path] = f"{config_path}@{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    return _invocation_run_ids[config_path]
+
+
+def run_config_path(run_id):
+    # The configuration of a default run ID, None for run IDs given by the user
+    config_path, separator, _ = run_id.rpartition('@')
+    return config_path if separator else None
+
+
+def latest_run_id(config_path, dependency_file=DEFAULT_DEPENDENCY_FILE):
+    # The last run recorded for a configuration, None if it has none
+    if not os.path.exists(dependency_file):
+        return None
+    with open(dependency_file) as f:
+        runs = json.load(f).get('runs', {})
+    run_ids = [run_id for run_id in runs if run_config_path(run_id) == os.path.abspath(config_path)]
+    return run_ids[-1] if run_ids else None
+
 
 class DependencyLinker:
-    def __init__(self, dependency_file='./job_dependencies.json'):
-        self.dependency_file = dependency_file
+    """Job IDs by job name for one run, stored with the other runs' in a JSON file.
+
+    Mutations are kept as pending operations. A commit takes an exclusive lock, replays them onto the file's
+    current content and renames a complete new file into place, so concurrent runs, or a job of the same run,
+    never lose each other's updates and readers never see a partial file. Outside deferred_saves every
+    mutation is committed at once. Of the default runs of a configuration only the last runs_kept are kept.
+    """
+
+    def __init__(self, dependency_file=DEFAULT_DEPENDENCY_FILE, run_id='default', runs_kept=DEFAULT_RUNS_KEPT):
+        self.dependency_file = os.path.abspath(dependency_file)
+        self.lock_file = f"{self.dependency_file}.lock"
+        self.run_id = run_id
+        self.runs_kept = runs_kept
+        self.autosave = True
+        self.pending = []
         self.load_dependencies()
 
-    def load_dependencies(self):
+    @contextmanager
+    def locked(self):
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_runs(self):
+        if not os.path.exists(self.dependency_file):
+            return {}
+        with open(self.dependency_file, 'r') as f:
+            data = json.load(f)
+        # Files from before run IDs map job names straight to IDs, they become the default run
+        runs = data['runs'] if isinstance(data.get('runs'), dict) else {'default': data}
+        for dependencies in runs.values():
+            for job in dependencies:
+                if isinstance(dependencies[job], str):
+                    dependencies[job] = [dependencies[job]]
+        return runs
+
+    def write_runs(self, runs):
+        # Written under the lock, so one temporary file per process is enough. Created like open() would, with the
+        # umask applied, then given the mode of the file it replaces so the project group keeps its access.
+        temporary_path = f"{self.dependency_file}.{os.getpid()}.tmp"
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'runs': runs}, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
         if os.path.exists(self.dependency_file):
-            with open(self.dependency_file, 'r') as f:
-                self.dependencies = json.load(f)
-                for job in self.dependencies:
-                    if isinstance(self.dependencies[job], str):
-                        self.dependencies[job] = [self.dependencies[job]]
-        else:
-            self.dependencies = {}
-            self.save_dependencies()
+            os.chmod(temporary_path, os.stat(self.dependency_file).st_mode & 0o777)
+        os.replace(temporary_path, self.dependency_file)
+
+    def prune_runs(self, runs):
+        # Drops the oldest default runs of this run's configuration beyond runs_kept, never this run
+        config_path = run_config_path(self.run_id)
+        if config_path is None:
+            return
+        run_ids = [run_id for run_id in runs if run_config_path(run_id) == config_path and run_id != self.run_id]
+        for run_id in run_ids[:max(len(run_ids) - self.runs_kept + 1, 0)]:
+            del runs[run_id]
+
+    def load_dependencies(self):
+        self.dependencies = self.read_runs().get(self.run_id, {})
+        for operation in self.pending:
+            self.apply(self.dependencies, *operation)
 
     def save_dependencies(self):
-        with open(self.dependency_file, 'w') as f:
-            json.dump(self.dependencies, f, indent=4)
+        if not self.pending:
+            return
+        with self.locked():
+            runs = self.read_runs()
+            dependencies = runs.setdefault(self.run_id, {})
+            for operation in self.pending:
+                self.apply(dependencies, *operation)
+            self.prune_runs(runs)
+            self.write_runs(runs)
+        self.pending = []
+        self.dependencies = dependencies
+
+    @staticmethod
+    def apply(dependencies, operation, job_name, job_id=None):
+        if operation == 'add':
+            dependencies[job_name] = [job_id]  # Ensure the latest job ID overwrites any previous ID
+        elif operation == 'append':
+            dependencies.setdefault(job_name, []).append(job_id)
+        elif operation == 'clear' and job_name in dependencies:
+            dependencies[job_name] = []
+
+    def record(self, operation, job_name, job_id=None):
+        self.apply(self.dependencies, operation, job_name, job_id)
+        self.pending.append((operation, job_name, job_id))
+        if self.autosave:
+            self.save_dependencies()
+
+    @contextmanager
+    def deferred_saves(self):
+        # Batches the mutations made inside into one commit
+        autosave = self.autosave
+        self.autosave = False
+        try:
+            yield self
+        finally:
+            self.autosave = autosave
+            self.save_dependencies()
 
     def add_job_id(self, job_name, job_id):
-        self.dependencies[job_name] = [job_id]  # Ensure the latest job ID overwrites any previous ID
-        self.save_dependencies()
+        self.record('add', job_name, job_id)
 
     def append_job_id(self, job_name, job_id):
-        if job_name not in self.dependencies:
-            self.dependencies[job_name] = []
-        if isinstance(self.dependencies[job_name], str):
-            self.dependencies[job_name] = [self.dependencies[job_name]]
-        self.dependencies[job_name].append(job_id)
-        self.save_dependencies()
+        self.record('append', job_name, job_id)
+
+    def get_all_job_ids(self):
+        return sorted({job_id for job_ids in self.dependencies.values() for job_id in job_ids})
 
     def get_dependencies(self, job_name):
         return self.dependencies.get(job_name, [])
 
     def clear_dependencies(self, job_name):
         if job_name in self.dependencies:
-            self.dependencies[job_name] = []
-            self.save_dependencies()
+            self.record('clear', job_name)
+
+
+def create_dependency_linker(config, config_path, run_id=None):
+    # Each invocation records its jobs under a run of its own. To build on the jobs of an earlier run, e.g. to
+    # rerun the analysis of a finished compression, pass its run ID here or set "run_id" in the configuration;
+    # every invocation given the same run ID then shares its job IDs. "dependency_file" moves the store and
+    # "dependency_runs_kept" sets how many runs of the configuration it keeps.
+    return DependencyLinker(config.get('dependency_file', DEFAULT_DEPENDENCY_FILE),
+                            run_id or config.get('run_id') or default_run_id(config_path),
+                            config.get('dependency_runs_kept', DEFAULT_RUNS_KEPT))
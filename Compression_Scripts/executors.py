@@ -0,0 +1,209 @@
+import os
+import re
+import time
+import logging
+import threading
+import subprocess
+
+MEMORY_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_memory(value):
+    # Bytes of a PBS memory size such as 16gb, None stays None
+    if value is None:
+        return None
+    match = re.fullmatch(r'(\d+)\s*([kmgt]?)b?', str(value).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid memory size: {value}")
+    return int(match.group(1)) * MEMORY_UNITS[match.group(2)]
+
+
+def parse_pbs_directives(script_path):
+    """Read the #PBS directives of a rendered job script that the local executor honours."""
+    directives = {'cpus': 1, 'memory': None, 'dependencies': [], 'condition': 'afterok', 'array': None,
+                  'output_log': os.devnull, 'error_log': os.devnull, 'name': os.path.basename(script_path)}
+    with open(script_path) as f:
+        for line in f:
+            if not line.startswith('#PBS'):
+                continue
+            option, _, value = line[4:].strip().partition(' ')
+            value = value.strip()
+            if option == '-l':
+                nodes = re.search(r'nodes=(\d+)', value)
+                ppn = re.search(r'ppn=(\d+)', value)
+                ncpus = re.search(r'ncpus=(\d+)', value)
+                memory = re.search(r'mem=(\w+)', value)
+                if ppn or ncpus:
+                    directives['cpus'] = (int(nodes.group(1)) if nodes else 1) * int((ppn or ncpus).group(1))
+                if memory:
+                    directives['memory'] = parse_memory(memory.group(1))
+            elif option == '-W' and value.startswith('depend='):
+                condition, _, job_ids = value[len('depend='):].partition(':')
+                directives['condition'] = condition
+                directives['dependencies'] = [job_id for job_id in job_ids.split(':') if job_id]
+            elif option in ('-t', '-J'):
+                first, _, last = value.partition('-')
+                directives['array'] = range(int(first), int(last or first) + 1)
+            elif option == '-o':
+                directives['output_log'] = value
+            elif option == '-e':
+                directives['error_log'] = value
+            elif option == '-N':
+                directives['name'] = value
+    return directives
+
+
+class PBSExecutor:
+    """Submits job scripts with qsub, dependencies are checked against the cached scheduler state."""
+
+    def __init__(self, scheduler_state):
+        self.scheduler_state = scheduler_state
+
+    def submit(self, job_script_path):
+        result = subprocess.run(f"qsub {job_script_path}", check=True, shell=True, capture_output=True, text=True)
+        job_id = result.stdout.strip().split('.')[0]  # Get the job ID from the output
+        self.scheduler_state.record_submission(job_id)
+        return job_id
+
+    def active_jobs(self, job_ids):
+        return self.scheduler_state.active_jobs(job_ids)
+
+    def wait(self):
+        # The cluster runs the jobs after we exit
+        pass
+
+
+class LocalJob:
+    def __init__(self, job_id, script_path, directives, environment):
+        self.job_id = job_id
+        self.script_path = script_path
+        self.cpus = directives['cpus']
+        self.memory = directives['memory'] or 0
+        self.dependencies = directives['dependencies']
+        self.condition = directives['condition']
+        self.output_log = directives['output_log']
+        self.error_log = directives['error_log']
+        self.name = directives['name']
+        self.environment = environment
+        # Q queued, R running, C completed, F failed or never run because an afterok dependency failed
+        self.state = 'Q'
+
+
+class LocalExecutor:
+    """Runs the rendered job scripts on this machine, as soon as their dependencies allow and the CPU and
+    memory budgets have room for the cores and memory their #PBS -l lines request.
+
+    Job IDs look like PBS ones, arrays return 'local-<run>-<n>[]' and their elements 'local-<run>-<n>[i]',
+    so the dependency linker and job array code work unchanged.
+    """
+
+    def __init__(self, cpus=None, memory=None):
+        self.cpus = cpus or os.cpu_count() or 1
+        self.memory = memory
+        self.run_id = f"{int(time.time())}{os.getpid()}"
+        self.job_count = 0
+        self.jobs = {}
+        self.used_cpus = 0
+        self.used_memory = 0
+        self.condition = threading.Condition()
+
+    def submit(self, job_script_path):
+        directives = parse_pbs_directives(job_script_path)
+        environment = dict(os.environ, PBS_O_WORKDIR=os.getcwd())
+        with self.condition:
+            self.job_count += 1
+            job_id = f"local-{self.run_id}-{self.job_count}"
+            if directives['array'] is None:
+                self.jobs[job_id] = LocalJob(job_id, job_script_path, directives,
+                                             dict(environment, PBS_JOBID=job_id))
+            else:
+                for element_index in directives['array']:
+                    element_id = f"{job_id}[{element_index}]"
+                    # Like Torque, each element writes its own logs
+                    element_directives = dict(directives)
+                    for log in ('output_log', 'error_log'):
+                        if directives[log] != os.devnull:
+                            element_directives[log] = f"{directives[log]}-{element_index}"
+                    self.jobs[element_id] = LocalJob(element_id, job_script_path, element_directives,
+                                                     dict(environment, PBS_JOBID=element_id,
+                                                          PBS_ARRAYID=str(element_index),
+                                                          PBS_ARRAY_INDEX=str(element_index)))
+                job_id = f"{job_id}[]"
+            self.dispatch()
+        return job_id
+
+    def array_elements(self, job_id):
+        # A whole array, 'local-<run>-<n>[]', stands for its elements, like PBS Pro dependencies on arrays
+        if job_id.endswith('[]'):
+            return [job for element_id, job in self.jobs.items() if element_id.startswith(job_id[:-1])]
+        return [self.jobs[job_id]] if job_id in self.jobs else []
+
+    def active_jobs(self, job_ids):
+        # Failed jobs stay dependencies, so afterok jobs behind them are skipped rather than run on missing files
+        with self.condition:
+            return [str(job_id) for job_id in job_ids
+                    if any(job.state != 'C' for job in self.array_elements(str(job_id)))]
+
+    def fits(self, job):
+        # A job larger than the budget runs alone rather than never
+        cpus = min(job.cpus, self.cpus)
+        memory = min(job.memory, self.memory) if self.memory else 0
+        return (self.used_cpus + cpus <= self.cpus
+                and (not self.memory or self.used_memory + memory <= self.memory)), cpus, memory
+
+    def dispatch(self):
+        # Called with the condition held, starts every queued job that is ready and fits, in submission order
+        changed = True
+        while changed:
+            changed = False
+            for job in self.jobs.values():
+                if job.state != 'Q':
+                    continue
+                dependencies = [dependency for job_id in job.dependencies for dependency in self.array_elements(job_id)]
+                if any(dependency.state in ('Q', 'R') for dependency in dependencies):
+                    continue
+                if job.condition == 'afterok' and any(dependency.state == 'F' for dependency in dependencies):
+                    logging.warning(f"Not running {job.name} ({job.job_id}), a dependency failed")
+                    job.state = 'F'
+                    changed = True
+                    continue
+                fits, cpus, memory = self.fits(job)
+                if not fits:
+                    continue
+                job.state = 'R'
+                self.used_cpus += cpus
+                self.used_memory += memory
+                threading.Thread(target=self.run, args=(job, cpus, memory)).start()
+
+    def run(self, job, cpus, memory):
+        logging.info(f"Running {job.name} ({job.job_id}) on {cpus} cores")
+        try:
+            with open(job.output_log, 'w') as output, open(job.error_log, 'w') as error:
+                returncode = subprocess.run(['bash', job.script_path], stdout=output, stderr=error,
+                                            env=job.environment, cwd=job.environment['PBS_O_WORKDIR']).returncode
+        except OSError as e:
+            logging.error(f"Failed to run {job.name} ({job.job_id}): {e}")
+            returncode = -1
+        with self.condition:
+            job.state = 'C' if returncode == 0 else 'F'
+            if returncode != 0:
+                logging.error(f"{job.name} ({job.job_id}) exited with status {returncode}, see {job.error_log}")
+            self.used_cpus -= cpus
+            self.used_memory -= memory
+            self.dispatch()
+            self.condition.notify_all()
+
+    def wait(self):
+        with self.condition:
+            while any(job.state in ('Q', 'R') for job in self.jobs.values()):
+                self.condition.wait()
+        failed = [job.job_id for job in self.jobs.values() if job.state == 'F']
+        logging.info(f"Local jobs finished, {len(self.jobs) - len(failed)} completed and {len(failed)} failed")
+        return failed
+
+
+def create_executor(config, scheduler_state):
+    # "executor": "local" runs everything on this machine, the default submits to PBS
+    if config.get('executor', 'pbs') == 'local':
+        return LocalExecutor(config.get('local_cpus'), parse_memory(config.get('local_memory')))
+    return PBSExecutor(scheduler_state)
@@ -0,0 +1,660 @@
+#include "fastq_fields.h"
+
+#include <algorithm>
+#include <cctype>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <stdexcept>
+#include <unordered_map>
+#include <vector>
+
+QualityType parse_quality_type(const std::string& name) {
+    if (name == "uint8") return QualityType::UInt8;
+    if (name == "int8") return QualityType::Int8;
+    if (name == "int16") return QualityType::Int16;
+    if (name == "int32") return QualityType::Int32;
+    if (name == "float32") return QualityType::Float32;
+    throw std::invalid_argument("Unsupported quality score type: " + name);
+}
+
+std::size_t quality_type_size(QualityType type) {
+    switch (type) {
+        case QualityType::UInt8: return sizeof(std::uint8_t);
+        case QualityType::Int8: return sizeof(std::int8_t);
+        case QualityType::Int16: return sizeof(std::int16_t);
+        case QualityType::Int32: return sizeof(std::int32_t);
+        case QualityType::Float32: return sizeof(float);
+    }
+    throw std::invalid_argument("Unsupported quality score type");
+}
+
+namespace {
+
+template <typename T>
+void encode_as(const char* begin, const char* end, std::string& out) {
+    std::size_t offset = out.size();
+    out.resize(offset + (end - begin) * sizeof(T));
+    char* dst = &out[offset];
+    for (const char* c = begin; c < end; ++c, dst += sizeof(T)) {
+        T score = static_cast<T>(static_cast<T>(*c) - 33);
+        std::memcpy(dst, &score, sizeof(T));
+    }
+}
+
+// Highest score that still maps to a printable quality character ('~')
+const int max_phred_score = 93;
+
+template <typename T>
+char score_to_char(T score) {
+    long long int_score = static_cast<long long>(score);
+    if (int_score < 2) int_score = 2;   // Minimum value is 2
+    if (int_score > max_phred_score) int_score = max_phred_score;
+    return static_cast<char>(int_score + 33);
+}
+
+// Rounds half away from zero like std::lround for every score that survives the clamp (NaN becomes 2),
+// but as a clamp and truncation of score + 0.5 so the loop has no library call and vectorizes
+inline char score_to_char(float score) {
+    double rounded = static_cast<double>(score) + 0.5;
+    rounded = !(rounded >= 2.0) ? 2.0 : (rounded > max_phred_score ? max_phred_score : rounded);
+    return static_cast<char>(static_cast<int>(rounded) + 33);
+}
+
+template <typename T>
+void decode_as(const char* data, std::size_t count, char* out) {
+    for (std::size_t i = 0; i < count; ++i) {
+        T score;
+        std::memcpy(&score, data + i * sizeof(T), sizeof(T));
+        out[i] = score_to_char(score);
+    }
+}
+
+// 2-bit code of each base, -1 for characters that go into the run table
+struct BaseCodes {
+    signed char code[256];
+
+    BaseCodes() {
+        std::memset(code, -1, sizeof(code));
+        code[static_cast<unsigned char>('A')] = 0;
+        code[static_cast<unsigned char>('C')] = 1;
+        code[static_cast<unsigned char>('G')] = 2;
+        code[static_cast<unsigned char>('T')] = 3;
+    }
+};
+
+const BaseCodes base_codes;
+
+// The four bases of every packed byte
+struct PackedQuads {
+    char quad[256][4];
+
+    PackedQuads() {
+        const char code_bases[4] = {'A', 'C', 'G', 'T'};
+        for (int byte = 0; byte < 256; ++byte) {
+            for (int i = 0; i < 4; ++i) {
+                quad[byte][i] = code_bases[(byte >> (6 - 2 * i)) & 0x3];
+            }
+        }
+    }
+};
+
+const PackedQuads packed_quads;
+
+int base_code(char c) {
+    return base_codes.code[static_cast<unsigned char>(c)];
+}
+
+std::size_t varint_size(std::uint64_t value) {
+    std::size_t size = 1;
+    while (value >= 0x80) {
+        value >>= 7;
+        ++size;
+    }
+    return size;
+}
+
+void append_varint(std::uint64_t value, std::string& out) {
+    while (value >= 0x80) {
+        out.push_back(static_cast<char>((value & 0x7F) | 0x80));
+        value >>= 7;
+    }
+    out.push_back(static_cast<char>(value));
+}
+
+// Returns false if the stream ends before the first byte, throws if it ends inside the varint
+bool read_varint(std::istream& in, std::uint64_t& value, const char* stream_name) {
+    value = 0;
+    // Bytes are taken from the buffer directly, istream::get builds a sentry for every call
+    std::streambuf* buffer = in.rdbuf();
+    for (int shift = 0; shift < 64; shift += 7) {
+        int byte = buffer->sbumpc();
+        if (byte == std::char_traits<char>::eof()) {
+            in.setstate(std::ios::eofbit);
+            if (shift == 0) {
+                return false;
+            }
+            throw std::runtime_error(std::string("Truncated ") + stream_name);
+        }
+        value |= static_cast<std::uint64_t>(byte & 0x7F) << shift;
+        if ((byte & 0x80) == 0) {
+            return true;
+        }
+    }
+    throw std::runtime_error(std::string("Corrupt ") + stream_name);
+}
+
+std::uint64_t read_required_varint(std::istream& in, const char* stream_name) {
+    std::uint64_t value;
+    if (!read_varint(in, value, stream_name)) {
+        throw std::runtime_error(std::string("Truncated ") + stream_name);
+    }
+    return value;
+}
+
+// Reads a varint from a buffer that must hold all of it
+std::uint64_t read_buffer_varint(const char*& pos, const char* end, const char* stream_name) {
+    std::uint64_t value = 0;
+    for (int shift = 0; shift < 64 && pos < end; shift += 7) {
+        unsigned char byte = static_cast<unsigned char>(*pos++);
+        value |= static_cast<std::uint64_t>(byte & 0x7F) << shift;
+        if ((byte & 0x80) == 0) {
+            return value;
+        }
+    }
+    throw std::runtime_error(std::string("Corrupt ") + stream_name);
+}
+
+const char packed_base_stream[] = "packed base stream";
+const char header_stream[] = "header stream";
+const char separator_stream[] = "separator stream";
+
+enum SeparatorMode {
+    bare_separator = 0,
+    repeated_header_separator = 1,
+    verbatim_separators = 2
+};
+
+// True if separator is "+" followed by the header without its leading '@'
+bool repeats_header(const char* header, const char* header_end, const char* separator, const char* separator_end) {
+    return header < header_end && separator_end - separator == header_end - header && *separator == '+' &&
+           std::memcmp(separator + 1, header + 1, header_end - header - 1) == 0;
+}
+
+// Moves pos past the next line and returns the line's end
+const char* next_line_end(const char*& pos, const char* end) {
+    const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+    const char* line_end = newline == nullptr ? end : newline;
+    pos = newline == nullptr ? end : newline + 1;
+    return line_end;
+}
+
+// Numbers longer than this could overflow 64 bits
+const std::size_t max_numeric_digits = 18;
+
+struct HeaderToken {
+    const char* begin;
+    const char* end;
+    bool numeric;
+};
+
+// Cuts a header into maximal digit and non-digit runs. Digit runs with a leading zero stay strings
+// since their value alone would lose the zero.
+void tokenize_header(const char* begin, const char* end, std::vector<HeaderToken>& tokens) {
+    tokens.clear();
+    const char* pos = begin;
+    while (pos < end) {
+        bool digit = std::isdigit(static_cast<unsigned char>(*pos)) != 0;
+        const char* token_end = pos + 1;
+        while (token_end < end && (std::isdigit(static_cast<unsigned char>(*token_end)) != 0) == digit) {
+            ++token_end;
+        }
+        std::size_t length = token_end - pos;
+        bool numeric = digit && length <= max_numeric_digits && (*pos != '0' || length == 1);
+        tokens.push_back({pos, token_end, numeric});
+        pos = token_end;
+    }
+}
+
+std::uint64_t parse_number(const char* begin, const char* end) {
+    std::uint64_t value = 0;
+    for (const char* c = begin; c < end; ++c) {
+        value = value * 10 + static_cast<std::uint64_t>(*c - '0');
+    }
+    return value;
+}
+
+// Differences are taken modulo 2^64 and zigzag mapped so small steps either way stay small
+std::uint64_t zigzag_delta(std::uint64_t value, std::uint64_t previous) {
+    std::int64_t delta = static_cast<std::int64_t>(value - previous);
+    return (static_cast<std::uint64_t>(delta) << 1) ^ static_cast<std::uint64_t>(delta >> 63);
+}
+
+void append_number(std::uint64_t value, std::string& out) {
+    char digits[20];
+    char* digit = digits + sizeof(digits);
+    do {
+        *--digit = static_cast<char>('0' + value % 10);
+        value /= 10;
+    } while (value != 0);
+    out.append(digit, digits + sizeof(digits));
+}
+
+std::uint64_t apply_zigzag_delta(std::uint64_t previous, std::uint64_t zigzag) {
+    std::uint64_t delta = (zigzag >> 1) ^ (~(zigzag & 1) + 1);
+    return previous + delta;
+}
+
+// Returns the end of the run of identical non-ACGT characters starting at pos, or pos if there is none
+const char* run_end(const char* pos, const char* end) {
+    if (pos == end || base_code(*pos) >= 0) {
+        return pos;
+    }
+    const char* run = pos + 1;
+    while (run < end && *run == *pos) {
+        ++run;
+    }
+    return run;
+}
+
+} // namespace
+
+BaseEncoding parse_base_encoding(const std::string& name) {
+    if (name == "text") return BaseEncoding::Text;
+    if (name == "2bit") return BaseEncoding::TwoBit;
+    throw std::invalid_argument("Unsupported base encoding: " + name);
+}
+
+std::size_t packed_bases_size(const char* begin, const char* end) {
+    std::uint64_t length = end - begin;
+    std::uint64_t runs = 0;
+    std::size_t run_bytes = 0;
+    const char* previous_end = begin;
+    for (const char* pos = begin; pos < end;) {
+        const char* run = run_end(pos, end);
+        if (run == pos) {
+            ++pos;
+            continue;
+        }
+        ++runs;
+        run_bytes += varint_size(pos - previous_end) + varint_size(run - pos) + 1;
+        previous_end = pos = run;
+    }
+    return varint_size(length) + varint_size(runs) + run_bytes + (length + 3) / 4;
+}
+
+void pack_bases(const char* begin, const char* end, std::string& out) {
+    std::uint64_t runs = 0;
+    for (const char* pos = begin; pos < end;) {
+        const char* run = run_end(pos, end);
+        runs += run != pos;
+        pos = run == pos ? pos + 1 : run;
+    }
+
+    append_varint(end - begin, out);
+    append_varint(runs, out);
+    const char* previous_end = begin;
+    for (const char* pos = begin; runs > 0 && pos < end;) {
+        const char* run = run_end(pos, end);
+        if (run == pos) {
+            ++pos;
+            continue;
+        }
+        append_varint(pos - previous_end, out);
+        append_varint(run - pos, out);
+        out.push_back(*pos);
+        previous_end = pos = run;
+    }
+
+    std::size_t offset = out.size();
+    out.resize(offset + (end - begin + 3) / 4, '\0');
+    unsigned char* packed = reinterpret_cast<unsigned char*>(&out[offset]);
+    for (const char* pos = begin; pos < end; ++pos) {
+        std::size_t i = pos - begin;
+        int code = base_code(*pos);
+        packed[i / 4] |= static_cast<unsigned char>((code < 0 ? 0 : code) << (6 - 2 * (i % 4)));
+    }
+}
+
+bool unpack_bases(std::istream& in, std::string& bases) {
+    std::uint64_t length;
+    if (!read_varint(in, length, packed_base_stream)) {
+        return false;
+    }
+    std::uint64_t runs = read_required_varint(in, packed_base_stream);
+
+    // Runs are collected first since they precede the packed bytes they overwrite
+    struct Run {
+        std::uint64_t start;
+        std::uint64_t length;
+        char base;
+    };
+    std::vector<Run> run_table;
+    std::uint64_t position = 0;
+    for (std::uint64_t i = 0; i < runs; ++i) {
+        Run run;
+        run.start = position + read_required_varint(in, packed_base_stream);
+        run.length = read_required_varint(in, packed_base_stream);
+        int base = in.get();
+        if (base == std::char_traits<char>::eof()) {
+            throw std::runtime_error("Truncated packed base stream");
+        }
+        run.base = static_cast<char>(base);
+        if (run.start > length || run.length > length - run.start) {
+            throw std::runtime_error("Corrupt packed base stream");
+        }
+        run_table.push_back(run);
+        position = run.start + run.length;
+    }
+
+    // The packed bytes are read behind the bases and unpacked forwards, base i only ever overwrites
+    // bytes before length + i / 4, which have already been unpacked
+    std::size_t packed_size = (length + 3) / 4;
+    bases.resize(length + packed_size);
+    in.read(&bases[length], packed_size);
+    if (static_cast<std::uint64_t>(in.gcount()) != packed_size) {
+        throw std::runtime_error("Truncated packed base stream");
+    }
+    for (std::uint64_t i = 0; i < length; i += 4) {
+        const char* quad = packed_quads.quad[static_cast<unsigned char>(bases[length + i / 4])];
+        std::memcpy(&bases[i], quad, std::min<std::uint64_t>(4, length - i));
+    }
+    bases.resize(length);
+    for (const Run& run : run_table) {
+        std::fill_n(&bases[run.start], run.length, run.base);
+    }
+    return true;
+}
+
+HeaderEncoding parse_header_encoding(const std::string& name) {
+    if (name == "text") return HeaderEncoding::Text;
+    if (name == "tokenized") return HeaderEncoding::Tokenized;
+    throw std::invalid_argument("Unsupported header encoding: " + name);
+}
+
+void encode_headers(const char* begin, const char* end, std::string& out) {
+    if (begin == end) {
+        return;
+    }
+    std::vector<HeaderToken> layout;
+    const char* first_end = static_cast<const char*>(std::memchr(begin, '\n', end - begin));
+    tokenize_header(begin, first_end == nullptr ? end : first_end, layout);
+
+    std::string kinds;
+    std::string verbatim;
+    std::vector<std::string> columns(layout.size());
+    std::vector<std::uint64_t> previous(layout.size(), 0);
+    std::vector<std::unordered_map<std::string, std::uint64_t>> dictionaries(layout.size());
+    std::vector<HeaderToken> tokens;
+    std::string token;
+    std::uint64_t records = 0;
+
+    for (const char* pos = begin; pos < end; ++records) {
+        const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+        const char* line_end = newline == nullptr ? end : newline;
+        tokenize_header(pos, line_end, tokens);
+
+        bool matches = tokens.size() == layout.size();
+        for (std::size_t i = 0; matches && i < tokens.size(); ++i) {
+            matches = tokens[i].numeric == layout[i].numeric;
+        }
+        if (!matches) {
+            kinds.push_back(1);
+            append_varint(line_end - pos, verbatim);
+            verbatim.append(pos, line_end);
+        } else {
+            kinds.push_back(0);
+            for (std::size_t i = 0; i < tokens.size(); ++i) {
+                if (tokens[i].numeric) {
+                    std::uint64_t value = parse_number(tokens[i].begin, tokens[i].end);
+                    append_varint(zigzag_delta(value, previous[i]), columns[i]);
+                    previous[i] = value;
+                    continue;
+                }
+                token.assign(tokens[i].begin, tokens[i].end);
+                auto inserted = dictionaries[i].emplace(token, dictionaries[i].size());
+                append_varint(inserted.first->second, columns[i]);
+                // A new entry is spelled out right after its index
+                if (inserted.second) {
+                    append_varint(token.size(), columns[i]);
+                    columns[i].append(token);
+                }
+            }
+        }
+        pos = newline == nullptr ? end : newline + 1;
+    }
+
+    append_varint(records, out);
+    append_varint(layout.size(), out);
+    for (const HeaderToken& layout_token : layout) {
+        out.push_back(layout_token.numeric ? 1 : 0);
+    }
+    append_varint(kinds.size(), out);
+    out.append(kinds);
+    append_varint(verbatim.size(), out);
+    out.append(verbatim);
+    for (const std::string& column : columns) {
+        append_varint(column.size(), out);
+        out.append(column);
+    }
+}
+
+HeaderDecoder::HeaderDecoder(std::istream& input) : input_(input) {}
+
+bool HeaderDecoder::read_block() {
+    std::uint64_t records;
+    if (!read_varint(input_, records, header_stream)) {
+        return false;
+    }
+    std::uint64_t token_count = read_required_varint(input_, header_stream);
+    std::string types(token_count, '\0');
+    input_.read(&types[0], types.size());
+    if (static_cast<std::uint64_t>(input_.gcount()) != types.size()) {
+        throw std::runtime_error("Truncated header stream");
+    }
+
+    // Columns are read whole first since block_ may move while it grows
+    std::vector<std::size_t> column_sizes;
+    block_.clear();
+    for (std::uint64_t i = 0; i < token_count + 2; ++i) {
+        std::uint64_t size = read_required_varint(input_, header_stream);
+        std::size_t offset = block_.size();
+        block_.resize(offset + size);
+        input_.read(&block_[offset], size);
+        if (static_cast<std::uint64_t>(input_.gcount()) != size) {
+            throw std::runtime_error("Truncated header stream");
+        }
+        column_sizes.push_back(size);
+    }
+
+    positions_.clear();
+    ends_.clear();
+    const char* column = block_.data();
+    for (std::size_t size : column_sizes) {
+        positions_.push_back(column);
+        ends_.push_back(column + size);
+        column += size;
+    }
+    numeric_.assign(token_count, false);
+    for (std::uint64_t i = 0; i < token_count; ++i) {
+        numeric_[i] = types[i] != 0;
+    }
+    previous_.assign(token_count, 0);
+    dictionaries_.assign(token_count, std::vector<std::string>());
+    remaining_ = records;
+    return true;
+}
+
+bool HeaderDecoder::next(std::string& header) {
+    while (remaining_ == 0) {
+        if (!read_block()) {
+            return false;
+        }
+    }
+    --remaining_;
+    header.clear();
+
+    if (positions_[0] == ends_[0]) {
+        throw std::runtime_error("Corrupt header stream");
+    }
+    if (*positions_[0]++ != 0) {
+        std::uint64_t length = read_buffer_varint(positions_[1], ends_[1], header_stream);
+        if (length > static_cast<std::uint64_t>(ends_[1] - positions_[1])) {
+            throw std::runtime_error("Corrupt header stream");
+        }
+        header.assign(positions_[1], length);
+        positions_[1] += length;
+        return true;
+    }
+
+    for (std::size_t i = 0; i < numeric_.size(); ++i) {
+        const char*& pos = positions_[i + 2];
+        const char* end = ends_[i + 2];
+        if (numeric_[i]) {
+            previous_[i] = apply_zigzag_delta(previous_[i], read_buffer_varint(pos, end, header_stream));
+            append_number(previous_[i], header);
+            continue;
+        }
+        std::vector<std::string>& dictionary = dictionaries_[i];
+        std::uint64_t index = read_buffer_varint(pos, end, header_stream);
+        if (index == dictionary.size()) {
+            std::uint64_t length = read_buffer_varint(pos, end, header_stream);
+            if (length > static_cast<std::uint64_t>(end - pos)) {
+                throw std::runtime_error("Corrupt header stream");
+            }
+            dictionary.emplace_back(pos, length);
+            pos += length;
+        } else if (index > dictionary.size()) {
+            throw std::runtime_error("Corrupt header stream");
+        }
+        header.append(dictionary[index]);
+    }
+    return true;
+}
+
+SeparatorEncoding parse_separator_encoding(const std::string& name) {
+    if (name == "text") return SeparatorEncoding::Text;
+    if (name == "elided") return SeparatorEncoding::Elided;
+    throw std::invalid_argument("Unsupported separator encoding: " + name);
+}
+
+void encode_separators(const char* headers, const char* headers_end,
+                       const char* separators, const char* separators_end, std::string& out) {
+    if (separators == separators_end) {
+        return;
+    }
+    bool bare = true;
+    bool repeated = true;
+    std::uint64_t records = 0;
+    for (const char* pos = separators; pos < separators_end; ++records) {
+        const char* header = headers;
+        const char* header_end = next_line_end(headers, headers_end);
+        const char* separator = pos;
+        const char* separator_end = next_line_end(pos, separators_end);
+        bare = bare && separator_end - separator == 1 && *separator == '+';
+        repeated = repeated && repeats_header(header, header_end, separator, separator_end);
+    }
+
+    append_varint(records, out);
+    if (bare || repeated) {
+        out.push_back(bare ? bare_separator : repeated_header_separator);
+        return;
+    }
+    out.push_back(verbatim_separators);
+    append_varint(separators_end - separators, out);
+    out.append(separators, separators_end);
+}
+
+SeparatorDecoder::SeparatorDecoder(std::istream& input) : input_(input) {}
+
+bool SeparatorDecoder::read_block() {
+    if (!read_varint(input_, remaining_, separator_stream)) {
+        return false;
+    }
+    mode_ = input_.get();
+    if (mode_ == std::char_traits<char>::eof()) {
+        throw std::runtime_error("Truncated separator stream");
+    }
+    if (mode_ != bare_separator && mode_ != repeated_header_separator && mode_ != verbatim_separators) {
+        throw std::runtime_error("Corrupt separator stream");
+    }
+    lines_.clear();
+    position_ = 0;
+    if (mode_ == verbatim_separators) {
+        lines_.resize(read_required_varint(input_, separator_stream));
+        input_.read(&lines_[0], lines_.size());
+        if (static_cast<std::size_t>(input_.gcount()) != lines_.size()) {
+            throw std::runtime_error("Truncated separator stream");
+        }
+    }
+    return true;
+}
+
+bool SeparatorDecoder::next(const std::string& header, std::string& separator) {
+    while (remaining_ == 0) {
+        if (!read_block()) {
+            return false;
+        }
+    }
+    --remaining_;
+
+    if (mode_ == bare_separator) {
+        separator.assign(1, '+');
+    } else if (mode_ == repeated_header_separator) {
+        separator.assign(1, '+');
+        if (!header.empty()) {
+            separator.append(header, 1, std::string::npos);
+        }
+    } else {
+        if (position_ >= lines_.size()) {
+            throw std::runtime_error("Corrupt separator stream");
+        }
+        const char* pos = lines_.data() + position_;
+        const char* line = pos;
+        const char* line_end = next_line_end(pos, lines_.data() + lines_.size());
+        separator.assign(line, line_end);
+        position_ = pos - lines_.data();
+    }
+    return true;
+}
+
+void write_field_index_entry(std::ostream& out, const FieldIndexEntry& entry) {
+    std::uint64_t row[5] = {entry.records, entry.offsets[0], entry.offsets[1], entry.offsets[2], entry.offsets[3]};
+    out.write(reinterpret_cast<const char*>(row), sizeof(row));
+}
+
+std::vector<FieldIndexEntry> read_field_index(const std::string& path) {
+    std::ifstream file(path, std::ios::binary);
+    if (!file.is_open()) {
+        throw std::runtime_error("Unable to open index file: " + path);
+    }
+    std::vector<FieldIndexEntry> entries;
+    std::uint64_t row[5];
+    while (file.read(reinterpret_cast<char*>(row), sizeof(row))) {
+        entries.push_back({row[0], {row[1], row[2], row[3], row[4]}});
+    }
+    if (file.gcount() != 0) {
+        throw std::runtime_error("Truncated index file: " + path);
+    }
+    return entries;
+}
+
+void encode_quality_scores(const char* begin, const char* end, QualityType type, std::string& out) {
+    switch (type) {
+        case QualityType::UInt8: encode_as<std::uint8_t>(begin, end, out); break;
+        case QualityType::Int8: encode_as<std::int8_t>(begin, end, out); break;
+        case QualityType::Int16: encode_as<std::int16_t>(begin, end, out); break;
+        case QualityType::Int32: encode_as<std::int32_t>(begin, end, out); break;
+        case QualityType::Float32: encode_as<float>(begin, end, out); break;
+    }
+}
+
+void decode_quality_scores(const char* data, std::size_t count, QualityType type, char* out) {
+    switch (type) {
+        case QualityType::UInt8: decode_as<std::uint8_t>(data, count, out); break;
+        case QualityType::Int8: decode_as<std::int8_t>(data, count, out); break;
+        case QualityType::Int16: decode_as<std::int16_t>(data, count, out); break;
+        case QualityType::Int32: decode_as<std::int32_t>(data, count, out); break;
+        case QualityType::Float32: decode_as<float>(data, count, out); break;
+    }
+}
@@ -0,0 +1,143 @@
+#ifndef SEQBENCH_FASTQ_FIELDS_H
+#define SEQBENCH_FASTQ_FIELDS_H
+
+#include <cstddef>
+#include <cstdint>
+#include <istream>
+#include <ostream>
+#include <string>
+#include <vector>
+
+// Element type of the binary quality score stream shared by the splitter, SZ3 and the reconstructor
+enum class QualityType {
+    UInt8,
+    Int8,
+    Int16,
+    Int32,
+    Float32
+};
+
+// Accepts "uint8", "int8", "int16", "int32" and "float32"
+QualityType parse_quality_type(const std::string& name);
+
+std::size_t quality_type_size(QualityType type);
+
+// Appends one element per quality character (phred score = character - 33) to out
+void encode_quality_scores(const char* begin, const char* end, QualityType type, std::string& out);
+
+// Converts count elements back to quality characters, rounding floats and clamping scores to [2, 93]
+void decode_quality_scores(const char* data, std::size_t count, QualityType type, char* out);
+
+// Layout of the DNA base field
+enum class BaseEncoding {
+    Text,   // One line of bases per record
+    TwoBit  // Packed 2-bit bases plus a run table for N and other non-ACGT characters
+};
+
+// Accepts "text" and "2bit"
+BaseEncoding parse_base_encoding(const std::string& name);
+
+// Upper bound on packed bytes per base, reached only by runs of alternating non-ACGT characters
+const std::size_t max_packed_bytes_per_base = 4;
+
+// A packed record is the varint base count, the varint run count, one (gap, length, character)
+// entry per run of identical non-ACGT characters with varint gap and length, then four bases per byte
+// with the first base in the high bits. Bases inside runs are packed as A.
+std::size_t packed_bases_size(const char* begin, const char* end);
+
+// Appends the packed form of the bases in [begin, end) to out
+void pack_bases(const char* begin, const char* end, std::string& out);
+
+// Reads the next packed record into bases, returns false at the end of the stream
+bool unpack_bases(std::istream& in, std::string& bases);
+
+// Layout of the base identifier field
+enum class HeaderEncoding {
+    Text,      // One header line per record
+    Tokenized  // Blocks of columns of header tokens
+};
+
+// Accepts "text" and "tokenized"
+HeaderEncoding parse_header_encoding(const std::string& name);
+
+// Appends the header lines in [begin, end), each ending in a newline, to out as one tokenized block.
+// Headers are cut into digit and non-digit tokens. Records with the token layout of the block's first
+// header store numeric tokens as zigzag varint deltas against the previous header and other tokens
+// as indices into a per-column dictionary, any other record is kept verbatim. A block is the
+// varint record count, the varint token count, one type byte per token (1 numeric, 0 string)
+// and then 2 + token count columns, each its varint byte length followed by its bytes:
+// one kind byte per record (0 tokenized, 1 verbatim), the verbatim headers and one column per token.
+void encode_headers(const char* begin, const char* end, std::string& out);
+
+// Reads the headers of a tokenized stream back one at a time
+class HeaderDecoder {
+public:
+    explicit HeaderDecoder(std::istream& input);
+
+    // Sets header to the next header without its newline, returns false at the end of the stream
+    bool next(std::string& header);
+
+private:
+    bool read_block();
+
+    std::istream& input_;
+    std::string block_;
+    std::uint64_t remaining_ = 0;
+    std::vector<bool> numeric_;
+    // Read position and end of every column within block_
+    std::vector<const char*> positions_;
+    std::vector<const char*> ends_;
+    std::vector<std::uint64_t> previous_;
+    std::vector<std::vector<std::string>> dictionaries_;
+};
+
+// Layout of the quality identifier ('+' separator) field
+enum class SeparatorEncoding {
+    Text,   // One separator line per record
+    Elided  // Blocks that store a uniform separator as a flag
+};
+
+// Accepts "text" and "elided"
+SeparatorEncoding parse_separator_encoding(const std::string& name);
+
+// Appends one block for the separator lines in [separators, separators_end) to out, the header lines
+// of the same records are in [headers, headers_end). Every line ends in a newline. A block is the
+// varint record count and a mode byte: 0 when every separator is "+", 1 when every separator is
+// "+" followed by its header without the '@', otherwise 2 followed by the varint byte length and
+// the separator lines themselves.
+void encode_separators(const char* headers, const char* headers_end,
+                       const char* separators, const char* separators_end, std::string& out);
+
+// Regenerates separator lines from an elided stream and the headers they belong to
+class SeparatorDecoder {
+public:
+    explicit SeparatorDecoder(std::istream& input);
+
+    // Sets separator to the next separator without its newline, returns false at the end of the stream
+    bool next(const std::string& header, std::string& separator);
+
+private:
+    bool read_block();
+
+    std::istream& input_;
+    std::uint64_t remaining_ = 0;
+    int mode_ = 0;
+    std::string lines_;
+    std::size_t position_ = 0;
+};
+
+// One block of a split: records written together by one flush or worker chunk and where each of the
+// four field files (base identifiers, DNA bases, quality identifiers, quality scores) has them start.
+// Blocks are self-contained in every encoding, so reconstruction can start at any of them.
+struct FieldIndexEntry {
+    std::uint64_t records;
+    std::uint64_t offsets[4];
+};
+
+// The index file is one row of five little-endian uint64 values per block, in the order above
+void write_field_index_entry(std::ostream& out, const FieldIndexEntry& entry);
+
+std::vector<FieldIndexEntry> read_field_index(const std::string& path);
+
+
+#endif //SEQBENCH_FASTQ_FIELDS_H
@@ -0,0 +1,350 @@
+#include "fastq_io.h"
+
+#include <algorithm>
+#include <cstring>
+#include <stdexcept>
+#include <thread>
+#include <zlib.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+namespace {
+
+const std::size_t gzip_read_bytes = static_cast<std::size_t>(1) * 1024 * 1024;
+const std::size_t gzip_out_bytes = static_cast<std::size_t>(4) * 1024 * 1024;
+
+// BGZF blocks are at most 64KB, this many per thread are inflated per batch
+const int bgzf_blocks_per_thread = 64;
+
+// FASTQ from a typical gzip file is rarely more than this many times its compressed size
+const std::uint64_t gzip_expansion_hint = 8;
+
+std::uint16_t read_le16(const unsigned char* p) {
+    return static_cast<std::uint16_t>(p[0] | (p[1] << 8));
+}
+
+std::uint32_t read_le32(const unsigned char* p) {
+    return static_cast<std::uint32_t>(p[0]) | (static_cast<std::uint32_t>(p[1]) << 8) |
+           (static_cast<std::uint32_t>(p[2]) << 16) | (static_cast<std::uint32_t>(p[3]) << 24);
+}
+
+// Total size of the BGZF block described by a gzip header, or 0 if the header has no BC subfield
+std::size_t bgzf_block_size(const unsigned char* header, std::size_t extra_length) {
+    const unsigned char* extra = header + 12;
+    std::size_t pos = 0;
+    while (pos + 4 <= extra_length) {
+        std::uint16_t subfield_length = read_le16(extra + pos + 2);
+        if (extra[pos] == 'B' && extra[pos + 1] == 'C' && subfield_length == 2 && pos + 6 <= extra_length) {
+            return static_cast<std::size_t>(read_le16(extra + pos + 4)) + 1;
+        }
+        pos += 4 + subfield_length;
+    }
+    return 0;
+}
+
+struct BgzfBlock {
+    std::vector<unsigned char> data;
+    std::size_t header_length;
+    std::size_t output_offset;
+    std::uint32_t output_size;
+};
+
+void inflate_bgzf_blocks(std::vector<BgzfBlock>& blocks, std::size_t first, std::size_t last, char* out, bool& ok) {
+    for (std::size_t i = first; i < last; ++i) {
+        BgzfBlock& block = blocks[i];
+        z_stream stream;
+        std::memset(&stream, 0, sizeof(stream));
+        if (inflateInit2(&stream, -15) != Z_OK) {
+            ok = false;
+            return;
+        }
+        stream.next_in = block.data.data() + block.header_length;
+        stream.avail_in = static_cast<uInt>(block.data.size() - block.header_length - 8);
+        stream.next_out = reinterpret_cast<Bytef*>(out + block.output_offset);
+        stream.avail_out = block.output_size;
+        int status = inflate(&stream, Z_FINISH);
+        inflateEnd(&stream);
+
+        std::uint32_t crc = static_cast<std::uint32_t>(
+                crc32(0L, reinterpret_cast<const Bytef*>(out + block.output_offset), block.output_size));
+        if (status != Z_STREAM_END || stream.avail_out != 0 ||
+            crc != read_le32(block.data.data() + block.data.size() - 8)) {
+            ok = false;
+            return;
+        }
+    }
+}
+
+const char* next_line(const char* pos, const char* end) {
+    const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+    return newline == nullptr ? end : newline + 1;
+}
+
+} // namespace
+
+MappedFile::MappedFile(const std::string& path) {
+    int fd = open(path.c_str(), O_RDONLY);
+    if (fd < 0) {
+        throw std::runtime_error("Unable to open input file: " + path);
+    }
+
+    struct stat st;
+    if (fstat(fd, &st) != 0) {
+        close(fd);
+        throw std::runtime_error("Unable to stat input file: " + path);
+    }
+    size_ = static_cast<std::size_t>(st.st_size);
+
+    // mmap rejects empty mappings, an empty file is simply an empty range
+    if (size_ > 0) {
+        void* addr = mmap(nullptr, size_, PROT_READ, MAP_PRIVATE, fd, 0);
+        if (addr == MAP_FAILED) {
+            close(fd);
+            throw std::runtime_error("Unable to memory-map input file: " + path);
+        }
+        madvise(addr, size_, MADV_SEQUENTIAL);
+        data_ = static_cast<const char*>(addr);
+    }
+    close(fd);
+}
+
+MappedFile::~MappedFile() {
+    if (data_ != nullptr) {
+        munmap(const_cast<char*>(data_), size_);
+    }
+}
+
+void MappedFile::release(const char* range_begin, const char* range_end) const {
+    const std::size_t page = static_cast<std::size_t>(sysconf(_SC_PAGESIZE));
+    std::size_t first = ((range_begin - data_) + page - 1) / page * page;
+    std::size_t last = (range_end - data_) / page * page;
+    if (data_ != nullptr && first < last) {
+        madvise(const_cast<char*>(data_) + first, last - first, MADV_DONTNEED);
+    }
+}
+
+GzipStreamBuf::GzipStreamBuf(const std::string& path, int threads)
+        : file_(path, std::ios::binary), threads_(std::max(threads, 1)), bgzf_(false) {
+    if (!file_.is_open()) {
+        throw std::runtime_error("Unable to open input file: " + path);
+    }
+
+    unsigned char header[18];
+    file_.read(reinterpret_cast<char*>(header), sizeof(header));
+    std::size_t header_read = static_cast<std::size_t>(file_.gcount());
+    bgzf_ = header_read == sizeof(header) && (header[3] & 4) != 0 &&
+            bgzf_block_size(header, std::min<std::size_t>(read_le16(header + 10), 6)) > 0;
+    file_.clear();
+    file_.seekg(0);
+
+    if (!bgzf_) {
+        stream_.reset(new z_stream_s());
+        std::memset(stream_.get(), 0, sizeof(z_stream_s));
+        // 16 + MAX_WBITS makes zlib expect a gzip header and trailer
+        if (inflateInit2(stream_.get(), 16 + MAX_WBITS) != Z_OK) {
+            throw std::runtime_error("Unable to initialise gzip decoder for: " + path);
+        }
+        in_.resize(gzip_read_bytes);
+    }
+    setg(nullptr, nullptr, nullptr);
+}
+
+GzipStreamBuf::~GzipStreamBuf() {
+    if (stream_) {
+        inflateEnd(stream_.get());
+    }
+}
+
+GzipStreamBuf::int_type GzipStreamBuf::underflow() {
+    if (gptr() < egptr()) {
+        return traits_type::to_int_type(*gptr());
+    }
+    bool filled = bgzf_ ? fill_bgzf() : fill_gzip();
+    if (!filled) {
+        return traits_type::eof();
+    }
+    setg(out_.data(), out_.data(), out_.data() + out_.size());
+    return traits_type::to_int_type(*gptr());
+}
+
+bool GzipStreamBuf::fill_bgzf() {
+    // Read the next batch of whole blocks, each block states its compressed and inflated size
+    std::vector<BgzfBlock> blocks;
+    std::size_t output_size = 0;
+    while (!finished_ && blocks.size() < static_cast<std::size_t>(threads_ * bgzf_blocks_per_thread)) {
+        unsigned char fixed[12];
+        file_.read(reinterpret_cast<char*>(fixed), sizeof(fixed));
+        if (file_.gcount() == 0) {
+            finished_ = true;
+            break;
+        }
+        if (file_.gcount() != sizeof(fixed) || fixed[0] != 0x1f || fixed[1] != 0x8b || (fixed[3] & 4) == 0) {
+            throw std::runtime_error("Malformed BGZF block header");
+        }
+
+        BgzfBlock block;
+        std::size_t extra_length = read_le16(fixed + 10);
+        block.header_length = 12 + extra_length;
+        block.data.resize(block.header_length);
+        std::memcpy(block.data.data(), fixed, sizeof(fixed));
+        file_.read(reinterpret_cast<char*>(block.data.data() + 12), extra_length);
+
+        std::size_t block_size = bgzf_block_size(block.data.data(), extra_length);
+        if (block_size < block.header_length + 8) {
+            throw std::runtime_error("Malformed BGZF block header");
+        }
+        block.data.resize(block_size);
+        file_.read(reinterpret_cast<char*>(block.data.data() + block.header_length), block_size - block.header_length);
+        if (static_cast<std::size_t>(file_.gcount()) != block_size - block.header_length) {
+            throw std::runtime_error("Truncated BGZF block");
+        }
+
+        block.output_offset = output_size;
+        block.output_size = read_le32(block.data.data() + block_size - 4);
+        output_size += block.output_size;
+        blocks.push_back(std::move(block));
+    }
+    if (output_size == 0) {
+        return finished_ ? false : fill_bgzf();
+    }
+
+    out_.resize(output_size);
+    std::size_t per_thread = (blocks.size() + threads_ - 1) / threads_;
+    std::vector<char> ok(threads_, 1);
+    std::vector<std::thread> thread_pool;
+    for (int t = 0; t < threads_; ++t) {
+        std::size_t first = std::min(blocks.size(), t * per_thread);
+        std::size_t last = std::min(blocks.size(), first + per_thread);
+        thread_pool.emplace_back([&blocks, first, last, this, &ok, t]() {
+            bool thread_ok = true;
+            inflate_bgzf_blocks(blocks, first, last, out_.data(), thread_ok);
+            ok[t] = thread_ok;
+        });
+    }
+    for (auto& t : thread_pool) {
+        t.join();
+    }
+    if (std::find(ok.begin(), ok.end(), 0) != ok.end()) {
+        throw std::runtime_error("Corrupt BGZF block");
+    }
+    return true;
+}
+
+bool GzipStreamBuf::fill_gzip() {
+    out_.resize(gzip_out_bytes);
+    z_stream_s* stream = stream_.get();
+    stream->next_out = reinterpret_cast<Bytef*>(out_.data());
+    stream->avail_out = static_cast<uInt>(out_.size());
+
+    while (stream->avail_out == out_.size() && !finished_) {
+        if (stream->avail_in == 0) {
+            file_.read(in_.data(), in_.size());
+            stream->next_in = reinterpret_cast<Bytef*>(in_.data());
+            stream->avail_in = static_cast<uInt>(file_.gcount());
+            if (stream->avail_in == 0) {
+                if (in_member_) {
+                    throw std::runtime_error("Truncated gzip stream");
+                }
+                finished_ = true;
+                break;
+            }
+        }
+
+        int status = inflate(stream, Z_NO_FLUSH);
+        if (status == Z_STREAM_END) {
+            in_member_ = false;
+            // Concatenated members are decoded as one stream, anything else after a member ends the file
+            if (stream->avail_in == 0) {
+                file_.read(in_.data(), in_.size());
+                stream->next_in = reinterpret_cast<Bytef*>(in_.data());
+                stream->avail_in = static_cast<uInt>(file_.gcount());
+            }
+            if (stream->avail_in >= 2 && stream->next_in[0] == 0x1f && stream->next_in[1] == 0x8b) {
+                inflateReset(stream);
+                in_member_ = true;
+            } else {
+                finished_ = true;
+            }
+        } else if (status != Z_OK && status != Z_BUF_ERROR) {
+            throw std::runtime_error("Corrupt gzip stream");
+        }
+    }
+
+    out_.resize(out_.size() - stream->avail_out);
+    return !out_.empty();
+}
+
+MemoryStreamBuf::MemoryStreamBuf(const char* begin, const char* end) {
+    // The get area is never written through, std::streambuf just has no const interface
+    setg(const_cast<char*>(begin), const_cast<char*>(begin), const_cast<char*>(end));
+}
+
+MemoryInputStream::MemoryInputStream(const char* begin, const char* end)
+        : std::istream(nullptr), buf_(begin, end) {
+    rdbuf(&buf_);
+}
+
+GzipInputStream::GzipInputStream(const std::string& path, int threads)
+        : std::istream(nullptr), buf_(path, threads) {
+    rdbuf(&buf_);
+    // Let decoding errors such as a truncated file propagate instead of reading as end of file
+    exceptions(std::ios::badbit);
+}
+
+bool is_regular_file(const std::string& path) {
+    struct stat st;
+    return stat(path.c_str(), &st) == 0 && S_ISREG(st.st_mode);
+}
+
+bool is_gzip_file(const std::string& path) {
+    if (!is_regular_file(path)) {
+        return false;
+    }
+    std::ifstream file(path, std::ios::binary);
+    unsigned char magic[2] = {0, 0};
+    file.read(reinterpret_cast<char*>(magic), sizeof(magic));
+    return file.gcount() == 2 && magic[0] == 0x1f && magic[1] == 0x8b;
+}
+
+std::unique_ptr<std::istream> open_input_stream(const std::string& path, int threads) {
+    std::unique_ptr<std::istream> stream;
+    if (is_gzip_file(path)) {
+        stream.reset(new GzipInputStream(path, threads));
+    } else {
+        stream.reset(new std::ifstream(path, std::ios::binary));
+        if (!static_cast<std::ifstream*>(stream.get())->is_open()) {
+            throw std::runtime_error("Unable to open input file: " + path);
+        }
+    }
+    return stream;
+}
+
+std::uint64_t input_size_hint(const std::string& path) {
+    struct stat st;
+    if (stat(path.c_str(), &st) != 0) {
+        return 0;
+    }
+    std::uint64_t size = static_cast<std::uint64_t>(st.st_size);
+    return is_gzip_file(path) ? size * gzip_expansion_hint : size;
+}
+
+const char* find_record_start(const char* begin, const char* pos, const char* end) {
+    if (pos <= begin) {
+        return begin;
+    }
+    // Move to the beginning of the next line unless pos already is one
+    const char* line = pos[-1] == '\n' ? pos : next_line(pos, end);
+
+    while (line < end) {
+        if (*line == '@') {
+            const char* third = next_line(next_line(line, end), end);
+            if (third < end && *third == '+') {
+                return line;
+            }
+        }
+        line = next_line(line, end);
+    }
+    return end;
+}
@@ -0,0 +1,104 @@
+#ifndef SEQBENCH_FASTQ_IO_H
+#define SEQBENCH_FASTQ_IO_H
+
+#include <cstddef>
+#include <cstdint>
+#include <fstream>
+#include <istream>
+#include <memory>
+#include <streambuf>
+#include <string>
+#include <vector>
+
+struct z_stream_s;
+
+// Read-only memory mapping of a whole file
+class MappedFile {
+public:
+    explicit MappedFile(const std::string& path);
+    ~MappedFile();
+
+    MappedFile(const MappedFile&) = delete;
+    MappedFile& operator=(const MappedFile&) = delete;
+
+    const char* begin() const { return data_; }
+    const char* end() const { return data_ + size_; }
+    std::size_t size() const { return size_; }
+
+    // Drops the pages of a range that has been fully consumed from the resident set
+    void release(const char* range_begin, const char* range_end) const;
+
+private:
+    const char* data_ = nullptr;
+    std::size_t size_ = 0;
+};
+
+// Decompressing read buffer for gzip files, concatenated members and BGZF included.
+// BGZF blocks carry their own sizes, so batches of blocks are inflated in parallel.
+class GzipStreamBuf : public std::streambuf {
+public:
+    GzipStreamBuf(const std::string& path, int threads);
+    ~GzipStreamBuf() override;
+
+    GzipStreamBuf(const GzipStreamBuf&) = delete;
+    GzipStreamBuf& operator=(const GzipStreamBuf&) = delete;
+
+protected:
+    int_type underflow() override;
+
+private:
+    bool fill_bgzf();
+    bool fill_gzip();
+
+    std::ifstream file_;
+    int threads_;
+    bool bgzf_;
+    bool finished_ = false;
+    bool in_member_ = true;
+    std::vector<char> in_;
+    std::vector<char> out_;
+    std::unique_ptr<z_stream_s> stream_;
+};
+
+class GzipInputStream : public std::istream {
+public:
+    GzipInputStream(const std::string& path, int threads);
+
+private:
+    GzipStreamBuf buf_;
+};
+
+// Read-only stream over a range of memory, such as a slice of a MappedFile
+class MemoryStreamBuf : public std::streambuf {
+public:
+    MemoryStreamBuf(const char* begin, const char* end);
+};
+
+class MemoryInputStream : public std::istream {
+public:
+    MemoryInputStream(const char* begin, const char* end);
+
+private:
+    MemoryStreamBuf buf_;
+};
+
+// True for regular files, false for pipes, FIFOs and other streams that can't be mapped or probed
+bool is_regular_file(const std::string& path);
+
+// True if the file is a regular file starting with the gzip magic bytes.
+// Pipes are never probed, reading the magic bytes would consume them.
+bool is_gzip_file(const std::string& path);
+
+// Opens a plain or gzip/BGZF compressed file for sequential reading
+std::unique_ptr<std::istream> open_input_stream(const std::string& path, int threads = 1);
+
+// Rough number of bytes open_input_stream will yield, exact for plain files and 0 for pipes
+std::uint64_t input_size_hint(const std::string& path);
+
+// Returns the start of the first FASTQ record at or after pos, or end if there is none.
+// A line is a record start when it begins with '@' and the line two below it begins with '+',
+// which a quality line starting with '@' can never satisfy.
+const char* find_record_start(const char* begin, const char* pos, const char* end);
+
+
+#endif //SEQBENCH_FASTQ_IO_H
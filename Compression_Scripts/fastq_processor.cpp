@@ -3,92 +3,493 @@
 #include <string>
 #include <stdexcept>
 #include <vector>
-#include <sstream>
 #include <cstdint>
+#include <cstring>
+#include <algorithm>
+#include <thread>
+#include <memory>
+#include <map>
+#include "fastq_io.h"
+#include "fastq_fields.h"
+#include "field_compression.h"
 
-void process_fastq(const std::string& input_path,
-                   const std::string& base_identifiers_path,
-                   const std::string& dna_bases_path,
-                   const std::string& quality_identifiers_path,
-                   const std::string& quality_scores_path,
-                   std::uint64_t buffer_size = static_cast<std::uint64_t>(10) * 1024 * 1024 * 1024) { // 10GB buffer size
+namespace {
 
-    std::ifstream infile(input_path);
-    std::ofstream base_identifiers_file(base_identifiers_path);
-    std::ofstream dna_bases_file(dna_bases_path);
-    std::ofstream quality_identifiers_file(quality_identifiers_path);
-    std::ofstream quality_scores_file(quality_scores_path, std::ios::binary);
+// Upper bound on the input bytes handed to each worker per round of the parallel splitter
+const std::size_t parallel_chunk_bytes = static_cast<std::size_t>(64) * 1024 * 1024;
 
-    if (!infile.is_open() || !base_identifiers_file.is_open() ||
-        !dna_bases_file.is_open() || !quality_identifiers_file.is_open() ||
-        !quality_scores_file.is_open()) {
-        throw std::runtime_error("Unable to open input or output files.");
+struct SplitOptions {
+    QualityType quality_type;
+    BaseEncoding base_encoding;
+    HeaderEncoding header_encoding;
+    SeparatorEncoding separator_encoding;
+    FieldCompression field_compression;
+    int compression_level;
+    std::string index_path;  // Empty for no record offset index
+};
+
+// Identifier lines are copied byte for byte, every quality character becomes one quality element.
+// Tokenized headers, elided separators and a compressed copy of the three text fields are each at most
+// about as large as the fields they are made from.
+std::uint64_t max_bytes_per_input_byte(const SplitOptions& options) {
+    std::uint64_t base_bytes = options.base_encoding == BaseEncoding::Text ? 1 : max_packed_bytes_per_base;
+    std::uint64_t header_bytes = options.header_encoding == HeaderEncoding::Text ? 1 : 2;
+    std::uint64_t separator_bytes = options.separator_encoding == SeparatorEncoding::Text ? 1 : 2;
+    std::uint64_t text_bytes = header_bytes + separator_bytes + base_bytes;
+    std::uint64_t compressed_bytes = options.field_compression == FieldCompression::None ? 0 : text_bytes;
+    return text_bytes + compressed_bytes + quality_type_size(options.quality_type);
+}
+
+struct FieldChunk {
+    std::string base_identifiers;
+    std::string dna_bases;
+    std::string quality_identifiers;
+    std::string quality_scores;
+    std::uint64_t records = 0;
+
+    // Tokenized form of base_identifiers, filled by encode_fields
+    std::string tokenized_base_identifiers;
+    bool headers_tokenized = false;
+
+    // Elided form of quality_identifiers, filled by encode_fields
+    std::string elided_quality_identifiers;
+    bool separators_elided = false;
+
+    // Compressed copies of the three text fields, filled by encode_fields
+    std::string compressed_base_identifiers;
+    std::string compressed_dna_bases;
+    std::string compressed_quality_identifiers;
+
+    void clear() {
+        // clear() keeps the capacity, so buffers are allocated once and reused between flushes
+        base_identifiers.clear();
+        dna_bases.clear();
+        quality_identifiers.clear();
+        quality_scores.clear();
+        records = 0;
+        tokenized_base_identifiers.clear();
+        headers_tokenized = false;
+        elided_quality_identifiers.clear();
+        separators_elided = false;
+        compressed_base_identifiers.clear();
+        compressed_dna_bases.clear();
+        compressed_quality_identifiers.clear();
+    }
+
+    // The base identifier field as it is written out
+    const std::string& stored_base_identifiers() const {
+        return headers_tokenized ? tokenized_base_identifiers : base_identifiers;
+    }
+
+    // The quality identifier field as it is written out
+    const std::string& stored_quality_identifiers() const {
+        return separators_elided ? elided_quality_identifiers : quality_identifiers;
+    }
+};
+
+// Turns the split buffers into their stored form: tokenized headers, elided separators and
+// compressed text fields
+void encode_fields(FieldChunk& chunk, const SplitOptions& options) {
+    // Separators are compared against the plain headers, so they are encoded first
+    if (options.separator_encoding == SeparatorEncoding::Elided) {
+        chunk.elided_quality_identifiers.clear();
+        encode_separators(chunk.base_identifiers.data(), chunk.base_identifiers.data() + chunk.base_identifiers.size(),
+                          chunk.quality_identifiers.data(),
+                          chunk.quality_identifiers.data() + chunk.quality_identifiers.size(),
+                          chunk.elided_quality_identifiers);
+        chunk.separators_elided = true;
+    }
+    if (options.header_encoding == HeaderEncoding::Tokenized) {
+        chunk.tokenized_base_identifiers.clear();
+        encode_headers(chunk.base_identifiers.data(), chunk.base_identifiers.data() + chunk.base_identifiers.size(),
+                       chunk.tokenized_base_identifiers);
+        chunk.headers_tokenized = true;
+    }
+    if (options.field_compression == FieldCompression::None) {
+        return;
+    }
+    compress_block(chunk.stored_base_identifiers(), options.field_compression, options.compression_level,
+                   chunk.compressed_base_identifiers);
+    compress_block(chunk.dna_bases, options.field_compression, options.compression_level,
+                   chunk.compressed_dna_bases);
+    compress_block(chunk.stored_quality_identifiers(), options.field_compression, options.compression_level,
+                   chunk.compressed_quality_identifiers);
+}
+
+// Output files of a split, with field compression each text field also gets a compressed copy next to it
+struct FieldFiles {
+    std::ofstream base_identifiers;
+    std::ofstream dna_bases;
+    std::ofstream quality_identifiers;
+    std::ofstream quality_scores;
+    std::ofstream compressed_base_identifiers;
+    std::ofstream compressed_dna_bases;
+    std::ofstream compressed_quality_identifiers;
+    std::ofstream index;
+    bool compressed;
+    bool indexed;
+    FieldIndexEntry next_block{0, {0, 0, 0, 0}};
+
+    // Bytes stored per text field, counted from the compressed copies when there are any
+    std::uint64_t base_identifiers_size = 0;
+    std::uint64_t dna_bases_size = 0;
+    std::uint64_t quality_identifiers_size = 0;
+
+    FieldFiles(const std::string& base_identifiers_path,
+               const std::string& dna_bases_path,
+               const std::string& quality_identifiers_path,
+               const std::string& quality_scores_path,
+               const SplitOptions& options)
+            : base_identifiers(base_identifiers_path, std::ios::binary),
+              dna_bases(dna_bases_path, std::ios::binary),
+              quality_identifiers(quality_identifiers_path, std::ios::binary),
+              quality_scores(quality_scores_path, std::ios::binary),
+              compressed(options.field_compression != FieldCompression::None),
+              indexed(!options.index_path.empty()) {
+        if (indexed) {
+            index.open(options.index_path, std::ios::binary);
+        }
+        if (compressed) {
+            std::string extension = field_compression_extension(options.field_compression);
+            compressed_base_identifiers.open(base_identifiers_path + extension, std::ios::binary);
+            compressed_dna_bases.open(dna_bases_path + extension, std::ios::binary);
+            compressed_quality_identifiers.open(quality_identifiers_path + extension, std::ios::binary);
+        }
+        if (!base_identifiers.is_open() || !dna_bases.is_open() ||
+            !quality_identifiers.is_open() || !quality_scores.is_open() ||
+            (compressed && (!compressed_base_identifiers.is_open() || !compressed_dna_bases.is_open() ||
+                            !compressed_quality_identifiers.is_open())) ||
+            (indexed && !index.is_open())) {
+            throw std::runtime_error("Unable to open input or output files.");
+        }
+    }
+
+    void write(const FieldChunk& chunk) {
+        const std::string& stored_base_identifiers = chunk.stored_base_identifiers();
+        const std::string& stored_quality_identifiers = chunk.stored_quality_identifiers();
+        if (indexed && chunk.records > 0) {
+            next_block.records = chunk.records;
+            write_field_index_entry(index, next_block);
+            next_block.offsets[0] += stored_base_identifiers.size();
+            next_block.offsets[1] += chunk.dna_bases.size();
+            next_block.offsets[2] += stored_quality_identifiers.size();
+            next_block.offsets[3] += chunk.quality_scores.size();
+        }
+        base_identifiers.write(stored_base_identifiers.data(), stored_base_identifiers.size());
+        dna_bases.write(chunk.dna_bases.data(), chunk.dna_bases.size());
+        quality_identifiers.write(stored_quality_identifiers.data(), stored_quality_identifiers.size());
+        quality_scores.write(chunk.quality_scores.data(), chunk.quality_scores.size());
+        if (!compressed) {
+            base_identifiers_size += stored_base_identifiers.size();
+            dna_bases_size += chunk.dna_bases.size();
+            quality_identifiers_size += stored_quality_identifiers.size();
+            return;
+        }
+        compressed_base_identifiers.write(chunk.compressed_base_identifiers.data(),
+                                          chunk.compressed_base_identifiers.size());
+        compressed_dna_bases.write(chunk.compressed_dna_bases.data(), chunk.compressed_dna_bases.size());
+        compressed_quality_identifiers.write(chunk.compressed_quality_identifiers.data(),
+                                             chunk.compressed_quality_identifiers.size());
+        base_identifiers_size += chunk.compressed_base_identifiers.size();
+        dna_bases_size += chunk.compressed_dna_bases.size();
+        quality_identifiers_size += chunk.compressed_quality_identifiers.size();
+    }
+
+    void close() {
+        base_identifiers.close();
+        dna_bases.close();
+        quality_identifiers.close();
+        quality_scores.close();
+        if (compressed) {
+            compressed_base_identifiers.close();
+            compressed_dna_bases.close();
+            compressed_quality_identifiers.close();
+        }
+        if (indexed) {
+            index.close();
+        }
+        if (base_identifiers.fail() || dna_bases.fail() || quality_identifiers.fail() || quality_scores.fail() ||
+            compressed_base_identifiers.fail() || compressed_dna_bases.fail() || compressed_quality_identifiers.fail() ||
+            index.fail()) {
+            throw std::runtime_error("Failed to write output files.");
+        }
+    }
+
+    std::map<std::string, std::uint64_t> field_sizes() const {
+        return {{"base_identifiers", base_identifiers_size},
+                {"dna_bases", dna_bases_size},
+                {"quality_identifiers", quality_identifiers_size}};
+    }
+};
+
+// One FASTQ record as four [begin, end) line ranges without their newlines
+struct RecordLines {
+    const char* begin[4];
+    const char* end[4];
+};
+
+// Bytes a record adds to each of the four field buffers
+void record_field_bytes(const RecordLines& record, const SplitOptions& options, std::uint64_t sizes[4]) {
+    for (int i = 0; i < 3; ++i) {
+        sizes[i] = (record.end[i] - record.begin[i]) + 1;
+    }
+    if (options.base_encoding == BaseEncoding::TwoBit) {
+        sizes[1] = packed_bases_size(record.begin[1], record.end[1]);
+    }
+    sizes[3] = (record.end[3] - record.begin[3]) * quality_type_size(options.quality_type);
+}
+
+void append_record(FieldChunk& chunk, const RecordLines& record, const SplitOptions& options) {
+    chunk.base_identifiers.append(record.begin[0], record.end[0]).push_back('\n');
+    if (options.base_encoding == BaseEncoding::TwoBit) {
+        pack_bases(record.begin[1], record.end[1], chunk.dna_bases);
+    } else {
+        chunk.dna_bases.append(record.begin[1], record.end[1]).push_back('\n');
     }
+    chunk.quality_identifiers.append(record.begin[2], record.end[2]).push_back('\n');
+    encode_quality_scores(record.begin[3], record.end[3], options.quality_type, chunk.quality_scores);
+    ++chunk.records;
+}
 
-    std::ostringstream base_identifiers_buffer;
-    std::ostringstream dna_bases_buffer;
-    std::ostringstream quality_identifiers_buffer;
-    std::vector<float> quality_scores_buffer;
+// True if the record can be appended without growing any buffer past its reserved capacity
+bool record_fits(const FieldChunk& chunk, const RecordLines& record, const SplitOptions& options) {
+    std::uint64_t sizes[4];
+    record_field_bytes(record, options, sizes);
+    return chunk.base_identifiers.size() + sizes[0] <= chunk.base_identifiers.capacity() &&
+           chunk.dna_bases.size() + sizes[1] <= chunk.dna_bases.capacity() &&
+           chunk.quality_identifiers.size() + sizes[2] <= chunk.quality_identifiers.capacity() &&
+           chunk.quality_scores.size() + sizes[3] <= chunk.quality_scores.capacity();
+}
 
-    // std::uint64_t quality_scores_count = 0;
-    // std::uint64_t max_quality_scores_count = (9ULL * 1024 * 1024 * 1024) / sizeof(float); // 9GB buffer for quality scores
+// Splits budget bytes across the four buffers in proportion to the bytes a record adds to each,
+// leaving room for the encoded copies of the text fields when those are on
+void reserve_fields(FieldChunk& chunk, const RecordLines& record, const SplitOptions& options, std::uint64_t budget) {
+    std::uint64_t sizes[4];
+    record_field_bytes(record, options, sizes);
+    std::uint64_t tokenized_bytes = options.header_encoding == HeaderEncoding::Text ? 0 : sizes[0];
+    std::uint64_t elided_bytes = options.separator_encoding == SeparatorEncoding::Text ? 0 : sizes[2];
+    std::uint64_t text_bytes = sizes[0] + tokenized_bytes + sizes[1] + sizes[2] + elided_bytes;
+    std::uint64_t compressed_bytes = options.field_compression == FieldCompression::None ? 0 : text_bytes;
+    std::uint64_t total = std::max<std::uint64_t>(text_bytes + compressed_bytes + sizes[3], 1);
 
-    std::string base_identifier, dna_bases, quality_identifier, quality_scores;
-    int lines_read = 0;
-    const int max_lines = 500000;
+    chunk.base_identifiers.reserve(budget * sizes[0] / total);
+    chunk.dna_bases.reserve(budget * sizes[1] / total);
+    chunk.quality_identifiers.reserve(budget * sizes[2] / total);
+    chunk.quality_scores.reserve(budget * sizes[3] / total);
+}
 
-    while (std::getline(infile, base_identifier) &&
-           std::getline(infile, dna_bases) &&
-           std::getline(infile, quality_identifier) &&
-           std::getline(infile, quality_scores)) {
+// Reads one line starting at pos, the trailing newline is not part of [line, line_end)
+bool read_line(const char*& pos, const char* end, const char*& line, const char*& line_end) {
+    if (pos >= end) {
+        return false;
+    }
+    line = pos;
+    const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+    line_end = newline == nullptr ? end : newline;
+    pos = newline == nullptr ? end : newline + 1;
+    return true;
+}
 
-        base_identifiers_buffer << base_identifier << "\n";
-        dna_bases_buffer << dna_bases << "\n";
-        quality_identifiers_buffer << quality_identifier << "\n";
+bool read_record(const char*& pos, const char* end, RecordLines& record) {
+    return read_line(pos, end, record.begin[0], record.end[0]) &&
+           read_line(pos, end, record.begin[1], record.end[1]) &&
+           read_line(pos, end, record.begin[2], record.end[2]) &&
+           read_line(pos, end, record.begin[3], record.end[3]);
+}
 
-        for (char c : quality_scores) {
-            float quality_score = static_cast<float>(c) - 33;
-            quality_scores_buffer.push_back(quality_score);
+// Splits the records in [begin, end) into the four fields and encodes them for storage,
+// an incomplete trailing record is dropped
+void split_chunk(const char* begin, const char* end, const SplitOptions& options, FieldChunk& chunk) {
+    // Size the buffers exactly with a cheap line-length pass so no buffer reallocates while appending
+    std::uint64_t field_bytes[4] = {0, 0, 0, 0};
+    std::uint64_t sizes[4];
+    const char* pos = begin;
+    RecordLines record;
+    while (read_record(pos, end, record)) {
+        record_field_bytes(record, options, sizes);
+        for (int i = 0; i < 4; ++i) {
+            field_bytes[i] += sizes[i];
         }
+    }
+    chunk.clear();
+    chunk.base_identifiers.reserve(field_bytes[0]);
+    chunk.dna_bases.reserve(field_bytes[1]);
+    chunk.quality_identifiers.reserve(field_bytes[2]);
+    chunk.quality_scores.reserve(field_bytes[3]);
+
+    pos = begin;
+    while (read_record(pos, end, record)) {
+        append_record(chunk, record, options);
+    }
+    encode_fields(chunk, options);
+}
 
-        lines_read += 4; // Each record is 4 lines
+// Splits the records of [begin, end) round by round, one chunk per thread and round.
+// Unless at_eof, the tail after the last record start that can be verified is left alone
+// and its position returned so the caller can carry it into the next window.
+const char* split_window(const char* begin, const char* end, bool at_eof, std::size_t chunk_bytes,
+                         const SplitOptions& options, std::vector<FieldChunk>& chunks, FieldFiles& files,
+                         const MappedFile* mapped) {
+    const char* round_begin = begin;
+    while (round_begin < end) {
+        // Cut the next round into one chunk per thread, every cut lands on a record start
+        std::vector<const char*> bounds{round_begin};
+        for (std::size_t i = 0; i < chunks.size() && bounds.back() < end; ++i) {
+            std::size_t remaining = end - bounds.back();
+            if (remaining <= chunk_bytes && !at_eof) {
+                break;
+            }
+            const char* cut = remaining > chunk_bytes ? bounds.back() + chunk_bytes : end;
+            const char* record_start = find_record_start(begin, cut, end);
+            if (record_start == end && !at_eof) {
+                break;
+            }
+            bounds.push_back(record_start);
+        }
+        if (bounds.size() == 1) {
+            break;
+        }
 
-        if (lines_read >= max_lines) {
-            base_identifiers_file << base_identifiers_buffer.str();
-            dna_bases_file << dna_bases_buffer.str();
-            quality_identifiers_file << quality_identifiers_buffer.str();
-            quality_scores_file.write(reinterpret_cast<const char*>(quality_scores_buffer.data()), quality_scores_buffer.size() * sizeof(float));
+        std::size_t chunk_count = bounds.size() - 1;
+        std::vector<std::thread> thread_pool;
+        for (std::size_t i = 0; i < chunk_count; ++i) {
+            thread_pool.emplace_back(split_chunk, bounds[i], bounds[i + 1], std::cref(options), std::ref(chunks[i]));
+        }
 
-            base_identifiers_buffer.str("");
-            base_identifiers_buffer.clear();
-            dna_bases_buffer.str("");
-            dna_bases_buffer.clear();
-            quality_identifiers_buffer.str("");
-            quality_identifiers_buffer.clear();
-            quality_scores_buffer.clear();
+        // Write chunks in input order, later chunks keep parsing while earlier ones are written
+        for (std::size_t i = 0; i < chunk_count; ++i) {
+            thread_pool[i].join();
+            files.write(chunks[i]);
+        }
 
-            lines_read = 0;
-            // quality_scores_count = 0;
+        if (mapped != nullptr) {
+            mapped->release(round_begin, bounds.back());
         }
+        round_begin = bounds.back();
     }
+    return round_begin;
+}
 
-    // Write any remaining data
-    if (!quality_scores_buffer.empty()) {
-        quality_scores_file.write(reinterpret_cast<const char*>(quality_scores_buffer.data()), quality_scores_buffer.size() * sizeof(float));
+std::map<std::string, std::uint64_t> process_fastq_parallel(const std::string& input_path,
+                                                            const std::string& base_identifiers_path,
+                                                            const std::string& dna_bases_path,
+                                                            const std::string& quality_identifiers_path,
+                                                            const std::string& quality_scores_path,
+                                                            std::uint64_t buffer_size,
+                                                            int threads,
+                                                            const SplitOptions& options) {
+    FieldFiles files(base_identifiers_path, dna_bases_path, quality_identifiers_path, quality_scores_path, options);
+
+    // Each worker's buffers hold at most max_bytes_per_input_byte times its chunk, so this keeps
+    // all output buffers together within buffer_size (a single record larger than a chunk is the exception)
+    std::size_t chunk_bytes = static_cast<std::size_t>(std::min<std::uint64_t>(
+            parallel_chunk_bytes, std::max<std::uint64_t>(buffer_size / threads / max_bytes_per_input_byte(options), 1)));
+    std::vector<FieldChunk> chunks(threads);
+
+    if (is_regular_file(input_path) && !is_gzip_file(input_path)) {
+        MappedFile input(input_path);
+        split_window(input.begin(), input.end(), true, chunk_bytes, options, chunks, files, &input);
+        files.close();
+        return files.field_sizes();
+    }
+
+    // Compressed or piped input is decoded into a window of a round plus one chunk, the unsplit tail moves to the front
+    std::unique_ptr<std::istream> input = open_input_stream(input_path, threads);
+    std::string window;
+    std::size_t window_bytes = chunk_bytes * (threads + 1);
+    bool at_eof = false;
+    while (!at_eof) {
+        std::size_t filled = window.size();
+        window.resize(std::max(window_bytes, filled + chunk_bytes));
+        input->read(&window[filled], window.size() - filled);
+        window.resize(filled + static_cast<std::size_t>(input->gcount()));
+        at_eof = !*input;
+
+        const char* rest = split_window(window.data(), window.data() + window.size(), at_eof, chunk_bytes,
+                                        options, chunks, files, nullptr);
+        window.erase(0, rest - window.data());
     }
-    if (base_identifiers_buffer.tellp() > 0) {
-        base_identifiers_file << base_identifiers_buffer.str();
+
+    files.close();
+    return files.field_sizes();
+}
+
+} // namespace
+
+// Returns the bytes stored per non-quality field, compressed sizes when field_compression is not "none"
+std::map<std::string, std::uint64_t> process_fastq(const std::string& input_path,
+                                                   const std::string& base_identifiers_path,
+                                                   const std::string& dna_bases_path,
+                                                   const std::string& quality_identifiers_path,
+                                                   const std::string& quality_scores_path,
+                                                   std::uint64_t buffer_size = static_cast<std::uint64_t>(10) * 1024 * 1024 * 1024, // 10GB buffer size
+                                                   int threads = 1,
+                                                   const std::string& quality_dtype = "float32",
+                                                   const std::string& base_encoding = "text",
+                                                   const std::string& field_compression = "none",
+                                                   int compression_level = -1,
+                                                   const std::string& header_encoding = "text",
+                                                   const std::string& separator_encoding = "text",
+                                                   const std::string& index_path = "") {
+
+    FieldCompression compression = parse_field_compression(field_compression);
+    SplitOptions options{parse_quality_type(quality_dtype), parse_base_encoding(base_encoding),
+                         parse_header_encoding(header_encoding), parse_separator_encoding(separator_encoding),
+                         compression,
+                         compression_level < 0 ? default_compression_level(compression) : compression_level,
+                         index_path};
+
+    if (threads > 1) {
+        return process_fastq_parallel(input_path, base_identifiers_path, dna_bases_path,
+                                      quality_identifiers_path, quality_scores_path, buffer_size, threads, options);
     }
-    if (dna_bases_buffer.tellp() > 0) {
-        dna_bases_file << dna_bases_buffer.str();
+
+    std::unique_ptr<std::istream> input = open_input_stream(input_path);
+    std::istream& infile = *input;
+    FieldFiles files(base_identifiers_path, dna_bases_path, quality_identifiers_path, quality_scores_path, options);
+
+    // No need to reserve more than the whole input could ever expand to
+    std::uint64_t input_size = input_size_hint(input_path);
+    std::uint64_t budget = std::max<std::uint64_t>(std::min(buffer_size, input_size * max_bytes_per_input_byte(options)), 1);
+    // Indexed blocks are kept to the parallel chunk size so reconstruction has blocks to spread over threads,
+    // a pipe has no size to go by so it is flushed at the same size
+    if (!options.index_path.empty() || input_size == 0) {
+        budget = std::min<std::uint64_t>(budget, parallel_chunk_bytes * max_bytes_per_input_byte(options));
     }
-    if (quality_identifiers_buffer.tellp() > 0) {
-        quality_identifiers_file << quality_identifiers_buffer.str();
+
+    FieldChunk buffers;
+    bool buffers_reserved = false;
+    std::string lines[4];
+    RecordLines record;
+
+    while (std::getline(infile, lines[0]) &&
+           std::getline(infile, lines[1]) &&
+           std::getline(infile, lines[2]) &&
+           std::getline(infile, lines[3])) {
+
+        for (int i = 0; i < 4; ++i) {
+            record.begin[i] = lines[i].data();
+            record.end[i] = lines[i].data() + lines[i].size();
+        }
+
+        if (!buffers_reserved) {
+            reserve_fields(buffers, record, options, budget);
+            buffers_reserved = true;
+        }
+
+        // Flush before any buffer would outgrow its share of buffer_size
+        if (!record_fits(buffers, record, options)) {
+            encode_fields(buffers, options);
+            files.write(buffers);
+            buffers.clear();
+        }
+        append_record(buffers, record, options);
     }
 
-    infile.close();
-    base_identifiers_file.close();
-    dna_bases_file.close();
-    quality_identifiers_file.close();
-    quality_scores_file.close();
+    // Write any remaining data
+    encode_fields(buffers, options);
+    files.write(buffers);
+
+    files.close();
+    return files.field_sizes();
 }
@@ -1,19 +1,94 @@
 #include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
 #include <cstdint>
+#include <map>
+#include <string>
+#include "fastq_profiler.h"
 
 // Declare the function from the other file
-void process_fastq(const std::string& input_path,
-                   const std::string& base_identifiers_path,
-                   const std::string& dna_bases_path,
-                   const std::string& quality_identifiers_path,
-                   const std::string& quality_scores_path,
-                   std::uint64_t buffer_size);
+std::map<std::string, std::uint64_t> process_fastq(const std::string& input_path,
+                                                   const std::string& base_identifiers_path,
+                                                   const std::string& dna_bases_path,
+                                                   const std::string& quality_identifiers_path,
+                                                   const std::string& quality_scores_path,
+                                                   std::uint64_t buffer_size,
+                                                   int threads,
+                                                   const std::string& quality_dtype,
+                                                   const std::string& base_encoding,
+                                                   const std::string& field_compression,
+                                                   int compression_level,
+                                                   const std::string& header_encoding,
+                                                   const std::string& separator_encoding,
+                                                   const std::string& index_path);
 
 namespace py = pybind11;
 
+// The profile as plain Python values, ready to be cached as JSON
+py::dict fastq_profile_to_dict(const FastqProfile& profile) {
+    std::string alphabet;
+    for (int phred = 0; phred < profile_phred_values; ++phred) {
+        if (profile.quality_counts[phred] > 0) {
+            alphabet.push_back(static_cast<char>(phred + 33));
+        }
+    }
+    std::vector<double> cycle_quality_mean(profile.cycle_count.size());
+    for (std::size_t i = 0; i < cycle_quality_mean.size(); ++i) {
+        cycle_quality_mean[i] = static_cast<double>(profile.cycle_quality_sum[i]) / profile.cycle_count[i];
+    }
+    py::dict read_lengths;
+    for (const auto& length : profile.read_lengths) {
+        read_lengths[py::str(std::to_string(length.first))] = length.second;
+    }
+    py::dict quality_entropy;
+    for (int order = 0; order <= profile.quality_order; ++order) {
+        quality_entropy[py::str(std::to_string(order))] = profile.quality_entropy(order);
+    }
+    py::dict base_entropy;
+    for (int order = 0; order <= profile.base_order; ++order) {
+        base_entropy[py::str(std::to_string(order))] = profile.base_entropy(order);
+    }
+
+    py::dict result;
+    result["reads"] = profile.reads;
+    result["bytes"] = profile.bytes;
+    result["bases"] = profile.bases;
+    result["min_read_length"] = profile.read_lengths.empty() ? 0 : profile.read_lengths.begin()->first;
+    result["max_read_length"] = profile.read_lengths.empty() ? 0 : profile.read_lengths.rbegin()->first;
+    result["read_lengths"] = read_lengths;
+    result["quality_alphabet"] = alphabet;
+    result["quality_counts"] = profile.quality_counts;
+    result["cycle_quality_mean"] = cycle_quality_mean;
+    result["quality_entropy"] = quality_entropy;
+    result["base_entropy"] = base_entropy;
+    result["n_fraction"] = profile.bases == 0 ? 0.0 : static_cast<double>(profile.n_bases) / profile.bases;
+    return result;
+}
+
 PYBIND11_MODULE(fastq_processor, m) {
-m.def("process_fastq", &process_fastq, "A function to process FASTQ files and split contents into four separate files.",
+m.def("process_fastq", &process_fastq, "A function to process FASTQ files and split contents into four separate files. "
+"Returns the stored size in bytes of the base_identifiers, dna_bases and quality_identifiers fields.",
 py::arg("input_path"), py::arg("base_identifiers_path"), py::arg("dna_bases_path"),
 py::arg("quality_identifiers_path"), py::arg("quality_scores_path"),
-py::arg("buffer_size") = static_cast<std::uint64_t>(10) * 1024 * 1024 * 1024); // Default to 10GB
+py::arg("buffer_size") = static_cast<std::uint64_t>(10) * 1024 * 1024 * 1024, // Default to 10GB
+py::arg("threads") = 1, // threads > 1 memory-maps the input and splits chunks in parallel
+py::arg("quality_dtype") = "float32", // Element type of the quality stream: uint8, int8, int16, int32 or float32
+py::arg("base_encoding") = "text", // "text" writes one line of bases per record, "2bit" packs four bases per byte
+py::arg("field_compression") = "none", // "zlib" or "lzma" also writes <field>.gz / <field>.xz for the three text fields
+py::arg("compression_level") = -1, // -1 uses 9 for zlib and 6 for lzma
+py::arg("header_encoding") = "text", // "tokenized" stores headers as delta and dictionary coded token columns
+py::arg("separator_encoding") = "text", // "elided" stores uniform '+' lines as a flag per block
+py::arg("index_path") = ""); // Writes a record offset index per block there, used by the parallel reconstructor
+m.def("profile_fastq", [](const std::string& input_path, int threads, int quality_order, int base_order) {
+    FastqProfile profile(quality_order, base_order);
+    {
+        py::gil_scoped_release release;
+        profile = profile_fastq(input_path, threads, quality_order, base_order);
+    }
+    return fastq_profile_to_dict(profile);
+}, "Profile a FASTQ file in one multi-threaded pass: read count, length distribution, quality alphabet, "
+"per-cycle quality means, order-0 to order-k entropies of quality scores and bases, and the fraction of N bases. "
+"Read lengths and entropy orders are string keys so the result can be cached as JSON.",
+py::arg("input_path"), py::arg("threads") = 1,
+py::arg("quality_order") = 2, // Previous quality scores conditioning the highest order entropy, at most 2
+py::arg("base_order") = 4); // Previous bases conditioning the highest order entropy, at most 6
 }
@@ -17,10 +17,18 @@ base_identifiers_path = ""
 dna_bases_path = ""
 quality_identifiers_path = ""
 quality_scores_path = ""
+field_index_path = ""
 output_path = ""
+threads = 8
 
 start = time.time()
-fastq_processor.process_fastq(input_path, base_identifiers_path, dna_bases_path, quality_identifiers_path, quality_scores_path)
+field_sizes = fastq_processor.process_fastq(input_path, base_identifiers_path, dna_bases_path, quality_identifiers_path,
+                                            quality_scores_path, threads=threads, base_encoding="2bit",
+                                            field_compression="zlib", header_encoding="tokenized",
+                                            separator_encoding="elided",
+                                            index_path=field_index_path)
 end = time.time()
 
+print(f"Compressed field sizes: {field_sizes}")
+
 print(f"FASTQ file processing completed successfully in {end - start} seconds")
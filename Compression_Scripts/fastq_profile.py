@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import math
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
+
+
+def load_profile(profile_path, input_path):
+    # The cached profile of the input, or None when it's missing or the input changed since it was written
+    try:
+        with open(profile_path) as f:
+            profile = json.load(f)
+        stat = os.stat(input_path)
+    except (OSError, ValueError):
+        return None
+    if profile.get('input_size') != stat.st_size or profile.get('input_mtime') != stat.st_mtime:
+        return None
+    return profile
+
+
+def get_profile(path_generator, file_pair_index, file_index, threads=1):
+    """Profile an input FASTQ with fastq_processor.profile_fastq, reusing the JSON cached next to its fields."""
+    input_path = path_generator.get_input_file_path(0, file_pair_index, file_index)
+    profile_path = path_generator.get_profile_path(0, file_pair_index, file_index)
+    profile = load_profile(profile_path, input_path)
+    if profile is not None:
+        return profile
+
+    import fastq_processor
+    stat = os.stat(input_path)
+    profile = fastq_processor.profile_fastq(input_path, threads)
+    profile['input_size'] = stat.st_size
+    profile['input_mtime'] = stat.st_mtime
+    temporary_path = f"{profile_path}.part"
+    with open(temporary_path, 'w') as f:
+        json.dump(profile, f, indent=4)
+    os.replace(temporary_path, profile_path)
+    logging.info(f"Profiled {input_path}: {profile['reads']} reads, quality alphabet "
+                 f"{profile['quality_alphabet']}, saved to {profile_path}")
+    return profile
+
+
+def get_cached_profile(path_generator, file_pair_index, file_index):
+    # Later phases only read the profile the compression phase wrote
+    input_path = path_generator.get_input_file_path(0, file_pair_index, file_index)
+    return load_profile(path_generator.get_profile_path(0, file_pair_index, file_index), input_path)
+
+
+def sz3_error_bound(options, quality_range):
+    # Absolute error bound of SZ3 options, None for error bound modes other than ABS and REL
+    tokens = options.split()
+    if '-M' not in tokens or tokens.index('-M') + 2 >= len(tokens):
+        return None
+    mode = tokens[tokens.index('-M') + 1].upper()
+    try:
+        value = float(tokens[tokens.index('-M') + 2])
+    except ValueError:
+        return None
+    if mode == 'ABS':
+        return value
+    if mode == 'REL':
+        return value * quality_range
+    return None
+
+
+def redundant_job_indices(config, profile):
+    """Map the index of each job the profile shows to be pointless to the reason it is.
+
+    Reconstructed quality scores are rounded to integers, so every SZ3 bound below 0.5 restores the input
+    exactly. Of those lossless-equivalent bounds only the loosest, which compresses best, is kept.
+    """
+    if profile is None:
+        return {}
+    alphabet = [ord(c) - 33 for c in profile['quality_alphabet']]
+    quality_range = max(alphabet) - min(alphabet) if alphabet else 0
+
+    lossless_equivalent = []
+    for job_index, job in enumerate(config['jobs']):
+        if job['name'].upper() != 'SZ3':
+            continue
+        bound = sz3_error_bound(job['options'][0], quality_range)
+        if bound is not None and (bound < 0.5 or quality_range == 0):
+            lossless_equivalent.append((bound, job_index))
+
+    redundant = {}
+    if lossless_equivalent:
+        _, kept = max(lossless_equivalent, key=lambda entry: (entry[0], -entry[1]))
+        for bound, job_index in lossless_equivalent:
+            if job_index != kept:
+                redundant[job_index] = (f"its error bound {bound:g} restores the quality scores exactly, "
+                                        f"like the looser bound of job {kept}")
+    return redundant
+
+
+def sized_nodes_ppn(config, profile):
+    # Nodes and processors per node for an input, no more cores than bytes_per_core bytes of records each
+    nodes = config.get('nodes', 1)
+    ppn = config.get('ppn', 8)
+    if profile is None:
+        return nodes, ppn
+    bytes_per_core = config.get('bytes_per_core', 256 * 1024 ** 2)
+    cores = max(1, math.ceil(profile['bytes'] / bytes_per_core))
+    if cores >= nodes * ppn:
+        return nodes, ppn
+    return 1, min(ppn, cores)
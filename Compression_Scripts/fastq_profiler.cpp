@@ -0,0 +1,273 @@
+#include <algorithm>
+#include <cmath>
+#include <cstring>
+#include <exception>
+#include <memory>
+#include <stdexcept>
+#include <thread>
+#include "fastq_io.h"
+#include "fastq_profiler.h"
+
+namespace {
+
+// Upper bound on the input bytes profiled by each worker per round
+const std::size_t profile_chunk_bytes = static_cast<std::size_t>(64) * 1024 * 1024;
+
+std::size_t context_count(int symbols, int order) {
+    std::size_t contexts = 1;
+    for (int i = 0; i < order; ++i) {
+        contexts *= static_cast<std::size_t>(symbols) + 1;
+    }
+    return contexts;
+}
+
+int base_symbol(char base) {
+    switch (base) {
+        case 'A': case 'a': return 0;
+        case 'C': case 'c': return 1;
+        case 'G': case 'g': return 2;
+        case 'T': case 't': return 3;
+        default: return 4;
+    }
+}
+
+// Conditional entropy of the symbols given their contexts, lower orders sum the contexts sharing the
+// most recent order symbols, which sit in the lowest digits of the context index
+double conditional_entropy(const std::vector<std::uint64_t>& counts, int symbols, int order) {
+    std::size_t contexts = context_count(symbols, order);
+    std::vector<std::uint64_t> joint(contexts * symbols, 0);
+    for (std::size_t i = 0; i < counts.size(); ++i) {
+        joint[(i / symbols) % contexts * symbols + i % symbols] += counts[i];
+    }
+    double total = 0;
+    for (std::uint64_t count : joint) {
+        total += static_cast<double>(count);
+    }
+    if (total == 0) {
+        return 0;
+    }
+    double entropy = 0;
+    for (std::size_t context = 0; context < contexts; ++context) {
+        double context_total = 0;
+        for (int s = 0; s < symbols; ++s) {
+            context_total += static_cast<double>(joint[context * symbols + s]);
+        }
+        for (int s = 0; s < symbols; ++s) {
+            double count = static_cast<double>(joint[context * symbols + s]);
+            if (count > 0) {
+                entropy -= count / total * std::log2(count / context_total);
+            }
+        }
+    }
+    return entropy;
+}
+
+const char* next_line(const char* pos, const char* end, const char*& line_end) {
+    const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+    line_end = newline == nullptr ? end : newline;
+    if (line_end > pos && line_end[-1] == '\r') {
+        line_end--;
+    }
+    return newline == nullptr ? end : newline + 1;
+}
+
+void profile_record(FastqProfile& profile, const char* bases, const char* bases_end,
+                    const char* quality, const char* quality_end) {
+    std::size_t length = bases_end - bases;
+    if (static_cast<std::size_t>(quality_end - quality) != length) {
+        throw std::invalid_argument("Every record must have as many quality scores as bases");
+    }
+    profile.reads++;
+    profile.bases += length;
+    profile.read_lengths[length]++;
+    if (profile.cycle_count.size() < length) {
+        profile.cycle_count.resize(length, 0);
+        profile.cycle_quality_sum.resize(length, 0);
+    }
+
+    std::size_t quality_contexts = context_count(profile_phred_values, profile.quality_order);
+    std::size_t base_contexts = context_count(profile_base_symbols, profile.base_order);
+    std::size_t quality_context = 0;
+    std::size_t base_context = 0;
+    for (std::size_t i = 0; i < length; ++i) {
+        unsigned phred = static_cast<unsigned char>(quality[i]) - 33u;
+        if (phred >= static_cast<unsigned>(profile_phred_values)) {
+            throw std::invalid_argument("Quality characters must lie between '!' and '~'");
+        }
+        profile.quality_counts[phred]++;
+        profile.cycle_quality_sum[i] += phred;
+        profile.cycle_count[i]++;
+        profile.quality_context_counts[quality_context * profile_phred_values + phred]++;
+        quality_context = (quality_context * (profile_phred_values + 1) + phred + 1) % quality_contexts;
+
+        int base = base_symbol(bases[i]);
+        profile.base_counts[base]++;
+        profile.n_bases += bases[i] == 'N' || bases[i] == 'n';
+        profile.base_context_counts[base_context * profile_base_symbols + base]++;
+        base_context = (base_context * (profile_base_symbols + 1) + base + 1) % base_contexts;
+    }
+}
+
+// Profiles the whole records of [begin, end) and returns where the first incomplete one starts
+const char* profile_chunk(const char* begin, const char* end, FastqProfile& profile) {
+    const char* pos = begin;
+    while (pos < end) {
+        const char* record = pos;
+        const char* line_end;
+        const char* bases;
+        const char* bases_end;
+        const char* quality;
+        const char* quality_end;
+        pos = next_line(pos, end, line_end);
+        bases = pos;
+        pos = next_line(pos, end, bases_end);
+        pos = next_line(pos, end, line_end);
+        quality = pos;
+        if (quality >= end) {
+            return record;
+        }
+        pos = next_line(pos, end, quality_end);
+        profile_record(profile, bases, bases_end, quality, quality_end);
+        profile.bytes += pos - record;
+    }
+    return end;
+}
+
+// Profiles [begin, end) round by round, one chunk per thread. Unless at_eof, the tail after the last
+// verifiable record start is left for the next window and its position returned.
+const char* profile_window(const char* begin, const char* end, bool at_eof, std::vector<FastqProfile>& partials) {
+    const char* round_begin = begin;
+    while (round_begin < end) {
+        std::vector<const char*> bounds{round_begin};
+        for (std::size_t i = 0; i < partials.size() && bounds.back() < end; ++i) {
+            std::size_t remaining = end - bounds.back();
+            if (remaining <= profile_chunk_bytes && !at_eof) {
+                break;
+            }
+            const char* cut = remaining > profile_chunk_bytes ? bounds.back() + profile_chunk_bytes : end;
+            const char* record_start = find_record_start(begin, cut, end);
+            if (record_start == end && !at_eof) {
+                break;
+            }
+            bounds.push_back(record_start);
+        }
+        if (bounds.size() == 1) {
+            break;
+        }
+
+        std::vector<std::thread> thread_pool;
+        std::vector<std::exception_ptr> errors(bounds.size() - 1);
+        std::vector<const char*> rests(bounds.size() - 1);
+        for (std::size_t i = 0; i + 1 < bounds.size(); ++i) {
+            thread_pool.emplace_back([&, i]() {
+                try {
+                    rests[i] = profile_chunk(bounds[i], bounds[i + 1], partials[i]);
+                } catch (...) {
+                    errors[i] = std::current_exception();
+                }
+            });
+        }
+        for (auto& t : thread_pool) {
+            t.join();
+        }
+        for (std::size_t i = 0; i < errors.size(); ++i) {
+            if (errors[i]) {
+                std::rethrow_exception(errors[i]);
+            }
+            // Chunks end on record starts, only the end of the file can cut a record short
+            if (rests[i] != bounds[i + 1]) {
+                throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+            }
+        }
+        round_begin = bounds.back();
+    }
+    return round_begin;
+}
+
+} // namespace
+
+FastqProfile::FastqProfile(int quality_order, int base_order)
+    : quality_order(quality_order), base_order(base_order),
+      quality_counts(profile_phred_values, 0), base_counts(profile_base_symbols, 0),
+      quality_context_counts(context_count(profile_phred_values, quality_order) * profile_phred_values, 0),
+      base_context_counts(context_count(profile_base_symbols, base_order) * profile_base_symbols, 0) {}
+
+void FastqProfile::merge(const FastqProfile& other) {
+    reads += other.reads;
+    bytes += other.bytes;
+    bases += other.bases;
+    n_bases += other.n_bases;
+    for (const auto& length : other.read_lengths) {
+        read_lengths[length.first] += length.second;
+    }
+    for (std::size_t i = 0; i < quality_counts.size(); ++i) {
+        quality_counts[i] += other.quality_counts[i];
+    }
+    for (std::size_t i = 0; i < base_counts.size(); ++i) {
+        base_counts[i] += other.base_counts[i];
+    }
+    if (cycle_count.size() < other.cycle_count.size()) {
+        cycle_count.resize(other.cycle_count.size(), 0);
+        cycle_quality_sum.resize(other.cycle_count.size(), 0);
+    }
+    for (std::size_t i = 0; i < other.cycle_count.size(); ++i) {
+        cycle_count[i] += other.cycle_count[i];
+        cycle_quality_sum[i] += other.cycle_quality_sum[i];
+    }
+    for (std::size_t i = 0; i < quality_context_counts.size(); ++i) {
+        quality_context_counts[i] += other.quality_context_counts[i];
+    }
+    for (std::size_t i = 0; i < base_context_counts.size(); ++i) {
+        base_context_counts[i] += other.base_context_counts[i];
+    }
+}
+
+double FastqProfile::quality_entropy(int order) const {
+    if (order < 0 || order > quality_order) {
+        throw std::invalid_argument("The quality entropy order must lie between 0 and the profiled order");
+    }
+    return conditional_entropy(quality_context_counts, profile_phred_values, order);
+}
+
+double FastqProfile::base_entropy(int order) const {
+    if (order < 0 || order > base_order) {
+        throw std::invalid_argument("The base entropy order must lie between 0 and the profiled order");
+    }
+    return conditional_entropy(base_context_counts, profile_base_symbols, order);
+}
+
+FastqProfile profile_fastq(const std::string& input_path, int threads, int quality_order, int base_order) {
+    if (quality_order < 0 || quality_order > max_quality_order || base_order < 0 || base_order > max_base_order) {
+        throw std::invalid_argument("Context orders must lie between 0 and " + std::to_string(max_quality_order) +
+                                    " for quality scores and " + std::to_string(max_base_order) + " for bases");
+    }
+    threads = std::max(threads, 1);
+    std::vector<FastqProfile> partials(threads, FastqProfile(quality_order, base_order));
+
+    if (is_regular_file(input_path) && !is_gzip_file(input_path)) {
+        MappedFile input(input_path);
+        profile_window(input.begin(), input.end(), true, partials);
+    } else {
+        // Compressed or piped input is decoded into a window of a round plus one chunk
+        std::unique_ptr<std::istream> input = open_input_stream(input_path, threads);
+        std::string window;
+        std::size_t window_bytes = profile_chunk_bytes * (threads + 1);
+        bool at_eof = false;
+        while (!at_eof) {
+            std::size_t filled = window.size();
+            window.resize(std::max(window_bytes, filled + profile_chunk_bytes));
+            input->read(&window[filled], window.size() - filled);
+            window.resize(filled + static_cast<std::size_t>(input->gcount()));
+            at_eof = !*input;
+
+            const char* rest = profile_window(window.data(), window.data() + window.size(), at_eof, partials);
+            window.erase(0, rest - window.data());
+        }
+    }
+
+    FastqProfile profile(quality_order, base_order);
+    for (const FastqProfile& partial : partials) {
+        profile.merge(partial);
+    }
+    return profile;
+}
@@ -0,0 +1,53 @@
+#ifndef SEQBENCH_FASTQ_PROFILER_H
+#define SEQBENCH_FASTQ_PROFILER_H
+
+#include <cstdint>
+#include <map>
+#include <string>
+#include <vector>
+
+// Phred values 0 to 93, written as the characters '!' to '~'
+const int profile_phred_values = 94;
+
+// A, C, G, T and every other base character, N included
+const int profile_base_symbols = 5;
+
+// Highest context orders, the context tables of higher orders would take hundreds of MB per thread
+const int max_quality_order = 2;
+const int max_base_order = 6;
+
+// Statistics of a FASTQ file gathered in one pass, merged from one partial profile per thread
+struct FastqProfile {
+    FastqProfile(int quality_order, int base_order);
+
+    void merge(const FastqProfile& other);
+
+    // Empirical entropy in bits per symbol, order 0 or conditioned on the previous order symbols of the read
+    double quality_entropy(int order) const;
+    double base_entropy(int order) const;
+
+    int quality_order;
+    int base_order;
+    std::uint64_t reads = 0;
+    // Bytes of the uncompressed records
+    std::uint64_t bytes = 0;
+    std::uint64_t bases = 0;
+    std::uint64_t n_bases = 0;
+    // Read length to number of reads
+    std::map<std::uint64_t, std::uint64_t> read_lengths;
+    std::vector<std::uint64_t> quality_counts;
+    std::vector<std::uint64_t> base_counts;
+    // Sum of the phred scores and number of scores per read position
+    std::vector<std::uint64_t> cycle_quality_sum;
+    std::vector<std::uint64_t> cycle_count;
+    // Symbol counts per context of the previous quality_order / base_order symbols, with a start symbol
+    // standing in for the positions before the read
+    std::vector<std::uint64_t> quality_context_counts;
+    std::vector<std::uint64_t> base_context_counts;
+};
+
+// Profiles a plain, gzip/BGZF or piped FASTQ file, the records are split between threads
+FastqProfile profile_fastq(const std::string& input_path, int threads, int quality_order, int base_order);
+
+
+#endif //SEQBENCH_FASTQ_PROFILER_H
@@ -4,54 +4,245 @@
 #include <stdexcept>
 #include <vector>
 #include <cstdint>
-#include <cmath>
+#include <memory>
+#include <thread>
+#include <exception>
+#include <algorithm>
+#include "fastq_fields.h"
+#include "fastq_io.h"
+
+namespace {
+
+// The sequential path hands its output to the file in blocks of about this size
+const std::size_t output_block_bytes = static_cast<std::size_t>(64) * 1024 * 1024;
+
+struct ReconstructOptions {
+    QualityType quality_type;
+    BaseEncoding base_encoding;
+    HeaderEncoding header_encoding;
+    SeparatorEncoding separator_encoding;
+};
+
+// Sequential readers over the four fields, either whole files or one indexed block of them
+struct FieldReaders {
+    std::istream& base_identifiers;
+    std::istream& dna_bases;
+    std::istream& quality_identifiers;
+    std::istream& quality_scores;
+    HeaderDecoder header_decoder;
+    SeparatorDecoder separator_decoder;
+
+    FieldReaders(std::istream& base_identifiers_input,
+                 std::istream& dna_bases_input,
+                 std::istream& quality_identifiers_input,
+                 std::istream& quality_scores_input)
+            : base_identifiers(base_identifiers_input),
+              dna_bases(dna_bases_input),
+              quality_identifiers(quality_identifiers_input),
+              quality_scores(quality_scores_input),
+              header_decoder(base_identifiers_input),
+              separator_decoder(quality_identifiers_input) {}
+};
+
+// Per-thread record buffers, reused so reconstruction does not allocate per record
+struct RecordBuffers {
+    std::string base_identifier;
+    std::string dna_bases;
+    std::string quality_identifier;
+    std::string quality_scores;
+};
+
+bool read_bases(std::istream& input, BaseEncoding encoding, std::string& bases) {
+    if (encoding == BaseEncoding::TwoBit) {
+        return unpack_bases(input, bases);
+    }
+    return static_cast<bool>(std::getline(input, bases));
+}
+
+bool read_header(std::istream& input, HeaderDecoder& decoder, HeaderEncoding encoding, std::string& header) {
+    if (encoding == HeaderEncoding::Tokenized) {
+        return decoder.next(header);
+    }
+    return static_cast<bool>(std::getline(input, header));
+}
+
+bool read_separator(std::istream& input, SeparatorDecoder& decoder, SeparatorEncoding encoding,
+                    const std::string& header, std::string& separator) {
+    if (encoding == SeparatorEncoding::Elided) {
+        return decoder.next(header, separator);
+    }
+    return static_cast<bool>(std::getline(input, separator));
+}
+
+// Appends the next record to out, returns false once any of the text fields runs out
+bool reconstruct_record(FieldReaders& readers, const ReconstructOptions& options, RecordBuffers& record,
+                        std::string& out) {
+    if (!read_header(readers.base_identifiers, readers.header_decoder, options.header_encoding,
+                     record.base_identifier) ||
+        !read_bases(readers.dna_bases, options.base_encoding, record.dna_bases) ||
+        !read_separator(readers.quality_identifiers, readers.separator_decoder, options.separator_encoding,
+                        record.base_identifier, record.quality_identifier)) {
+        return false;
+    }
+
+    // Read the quality scores corresponding to the dna_bases length, missing scores read as zero
+    std::size_t length = record.dna_bases.size();
+    record.quality_scores.resize(length * quality_type_size(options.quality_type));
+    readers.quality_scores.read(&record.quality_scores[0], record.quality_scores.size());
+    std::size_t read = static_cast<std::size_t>(readers.quality_scores.gcount());
+    std::fill(record.quality_scores.begin() + read, record.quality_scores.end(), '\0');
+
+    out.append(record.base_identifier).push_back('\n');
+    out.append(record.dna_bases).push_back('\n');
+    out.append(record.quality_identifier).push_back('\n');
+
+    // Scores are converted in one pass straight into the output block
+    std::size_t offset = out.size();
+    out.resize(offset + length + 1);
+    decode_quality_scores(record.quality_scores.data(), length, options.quality_type, &out[offset]);
+    out.back() = '\n';
+    return true;
+}
+
+void reconstruct_sequential(const std::string& base_identifiers_path,
+                            const std::string& dna_bases_path,
+                            const std::string& quality_identifiers_path,
+                            const std::string& quality_scores_path,
+                            std::ofstream& output_file,
+                            const ReconstructOptions& options) {
+    // Any of the field files may be gzip or BGZF compressed
+    std::unique_ptr<std::istream> base_identifiers_input = open_input_stream(base_identifiers_path);
+    std::unique_ptr<std::istream> dna_bases_input = open_input_stream(dna_bases_path);
+    std::unique_ptr<std::istream> quality_identifiers_input = open_input_stream(quality_identifiers_path);
+    std::unique_ptr<std::istream> quality_scores_input = open_input_stream(quality_scores_path);
+    FieldReaders readers(*base_identifiers_input, *dna_bases_input, *quality_identifiers_input,
+                         *quality_scores_input);
+
+    RecordBuffers record;
+    std::string out;
+    out.reserve(output_block_bytes);
+    while (reconstruct_record(readers, options, record, out)) {
+        if (out.size() >= output_block_bytes) {
+            output_file.write(out.data(), out.size());
+            out.clear();
+        }
+    }
+    output_file.write(out.data(), out.size());
+}
+
+// Reconstructs the records of one indexed block of the memory-mapped field files into out
+void reconstruct_block(const std::vector<const MappedFile*>& fields, const std::vector<FieldIndexEntry>& index,
+                       std::size_t block, const ReconstructOptions& options, std::string& out) {
+    const char* begin[4];
+    const char* end[4];
+    for (int i = 0; i < 4; ++i) {
+        std::uint64_t block_end = block + 1 < index.size() ? index[block + 1].offsets[i] : fields[i]->size();
+        if (index[block].offsets[i] > block_end || block_end > fields[i]->size()) {
+            throw std::runtime_error("Index does not match the field files.");
+        }
+        begin[i] = fields[i]->begin() + index[block].offsets[i];
+        end[i] = fields[i]->begin() + block_end;
+    }
+    MemoryInputStream base_identifiers(begin[0], end[0]);
+    MemoryInputStream dna_bases(begin[1], end[1]);
+    MemoryInputStream quality_identifiers(begin[2], end[2]);
+    MemoryInputStream quality_scores(begin[3], end[3]);
+    FieldReaders readers(base_identifiers, dna_bases, quality_identifiers, quality_scores);
+
+    // Exact for plain headers and separators, tokenized headers may still grow the block once
+    std::uint64_t bases = (end[3] - begin[3]) / quality_type_size(options.quality_type);
+    out.clear();
+    out.reserve(2 * bases + (end[0] - begin[0]) + (end[2] - begin[2]) + 4 * index[block].records);
+
+    RecordBuffers record;
+    for (std::uint64_t i = 0; i < index[block].records; ++i) {
+        if (!reconstruct_record(readers, options, record, out)) {
+            throw std::runtime_error("Index does not match the field files.");
+        }
+    }
+}
+
+void reconstruct_parallel(const std::string& base_identifiers_path,
+                          const std::string& dna_bases_path,
+                          const std::string& quality_identifiers_path,
+                          const std::string& quality_scores_path,
+                          std::ofstream& output_file,
+                          const std::vector<FieldIndexEntry>& index,
+                          int threads,
+                          const ReconstructOptions& options) {
+    MappedFile base_identifiers(base_identifiers_path);
+    MappedFile dna_bases(dna_bases_path);
+    MappedFile quality_identifiers(quality_identifiers_path);
+    MappedFile quality_scores(quality_scores_path);
+    std::vector<const MappedFile*> fields{&base_identifiers, &dna_bases, &quality_identifiers, &quality_scores};
+
+    // Rounds of one block per thread, written in order while later blocks are still being decoded
+    std::vector<std::string> outputs(threads);
+    std::vector<std::exception_ptr> errors(threads);
+    for (std::size_t first = 0; first < index.size(); first += threads) {
+        std::size_t count = std::min<std::size_t>(threads, index.size() - first);
+        std::vector<std::thread> thread_pool;
+        for (std::size_t i = 0; i < count; ++i) {
+            thread_pool.emplace_back([&, i]() {
+                try {
+                    reconstruct_block(fields, index, first + i, options, outputs[i]);
+                } catch (...) {
+                    errors[i] = std::current_exception();
+                }
+            });
+        }
+        for (std::size_t i = 0; i < count; ++i) {
+            thread_pool[i].join();
+        }
+        for (std::size_t i = 0; i < count; ++i) {
+            if (errors[i]) {
+                std::rethrow_exception(errors[i]);
+            }
+            output_file.write(outputs[i].data(), outputs[i].size());
+        }
+    }
+}
+
+bool is_mappable_field(const std::string& path) {
+    return is_regular_file(path) && !is_gzip_file(path);
+}
+
+} // namespace
 
 void fastq_reconstructor(const std::string& base_identifiers_path,
                          const std::string& dna_bases_path,
                          const std::string& quality_identifiers_path,
                          const std::string& quality_scores_path,
-                         const std::string& output_path) {
-    std::ifstream base_identifiers_file(base_identifiers_path);
-    std::ifstream dna_bases_file(dna_bases_path);
-    std::ifstream quality_identifiers_file(quality_identifiers_path);
-    std::ifstream quality_scores_file(quality_scores_path, std::ios::binary);
-    std::ofstream output_file(output_path);
-
-    if (!base_identifiers_file.is_open() || !dna_bases_file.is_open() ||
-        !quality_identifiers_file.is_open() || !quality_scores_file.is_open() ||
-        !output_file.is_open()) {
+                         const std::string& output_path,
+                         const std::string& quality_dtype = "float32",
+                         const std::string& base_encoding = "text",
+                         const std::string& header_encoding = "text",
+                         const std::string& separator_encoding = "text",
+                         int threads = 1,
+                         const std::string& index_path = "") {
+    ReconstructOptions options{parse_quality_type(quality_dtype), parse_base_encoding(base_encoding),
+                               parse_header_encoding(header_encoding), parse_separator_encoding(separator_encoding)};
+
+    std::ofstream output_file(output_path, std::ios::binary);
+    if (!output_file.is_open()) {
         throw std::runtime_error("Unable to open input or output files.");
     }
 
-    std::string base_identifier, dna_bases, quality_identifier;
-    while (std::getline(base_identifiers_file, base_identifier) &&
-           std::getline(dna_bases_file, dna_bases) &&
-           std::getline(quality_identifiers_file, quality_identifier)) {
-
-        // Write the base identifier to the output file
-        output_file << base_identifier << "\n";
-        // Write the dna bases to the output file
-        output_file << dna_bases << "\n";
-        // Write the quality identifier to the output file
-        output_file << quality_identifier << "\n";
-
-        // Read the quality scores corresponding to the dna_bases length
-        std::vector<float> quality_scores(dna_bases.size());
-        quality_scores_file.read(reinterpret_cast<char*>(quality_scores.data()), quality_scores.size() * sizeof(float));
-
-        // Convert the float quality scores back to characters and write to output file
-        for (float score : quality_scores) {
-            int int_score = std::round(score);  // Round to nearest integer
-            if (int_score < 2) int_score = 2;   // Minimum value is 2
-            char qual_char = static_cast<char>(int_score + 33); // Convert to char
-            output_file << qual_char;
-        }
-        output_file << "\n";
+    // Blocks can only be mapped and decoded independently when the field files are stored uncompressed,
+    // a quality stream arriving over a FIFO is read sequentially
+    bool parallel = threads > 1 && !index_path.empty() &&
+                    is_mappable_field(base_identifiers_path) && is_mappable_field(dna_bases_path) &&
+                    is_mappable_field(quality_identifiers_path) && is_mappable_field(quality_scores_path);
+    if (parallel) {
+        reconstruct_parallel(base_identifiers_path, dna_bases_path, quality_identifiers_path, quality_scores_path,
+                             output_file, read_field_index(index_path), threads, options);
+    } else {
+        reconstruct_sequential(base_identifiers_path, dna_bases_path, quality_identifiers_path, quality_scores_path,
+                               output_file, options);
     }
 
-    base_identifiers_file.close();
-    dna_bases_file.close();
-    quality_identifiers_file.close();
-    quality_scores_file.close();
     output_file.close();
+    if (output_file.fail()) {
+        throw std::runtime_error("Failed to write output files.");
+    }
 }
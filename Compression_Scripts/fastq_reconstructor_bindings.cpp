@@ -4,10 +4,24 @@ void fastq_reconstructor(const std::string& base_identifiers_path,
                          const std::string& dna_bases_path,
                          const std::string& quality_identifiers_path,
                          const std::string& quality_scores_path,
-                         const std::string& output_path);
+                         const std::string& output_path,
+                         const std::string& quality_dtype,
+                         const std::string& base_encoding,
+                         const std::string& header_encoding,
+                         const std::string& separator_encoding,
+                         int threads,
+                         const std::string& index_path);
 
 namespace py = pybind11;
 
 PYBIND11_MODULE(fastq_reconstructor, m) {
-m.def("fastq_reconstructor", &fastq_reconstructor, "A function to reconstruct FASTQ files from parts");
+m.def("fastq_reconstructor", &fastq_reconstructor, "A function to reconstruct FASTQ files from parts",
+py::arg("base_identifiers_path"), py::arg("dna_bases_path"), py::arg("quality_identifiers_path"),
+py::arg("quality_scores_path"), py::arg("output_path"),
+py::arg("quality_dtype") = "float32", // Must match the quality_dtype the file was split with
+py::arg("base_encoding") = "text", // Must match the base_encoding the file was split with
+py::arg("header_encoding") = "text", // Must match the header_encoding the file was split with
+py::arg("separator_encoding") = "text", // Must match the separator_encoding the file was split with
+py::arg("threads") = 1, // threads > 1 with an index_path decodes indexed blocks in parallel
+py::arg("index_path") = ""); // Record offset index written by process_fastq
 }
@@ -0,0 +1,95 @@
+#include "field_compression.h"
+
+#include <algorithm>
+#include <cstdint>
+#include <limits>
+#include <stdexcept>
+#include <lzma.h>
+#include <zlib.h>
+
+FieldCompression parse_field_compression(const std::string& name) {
+    if (name == "none") return FieldCompression::None;
+    if (name == "zlib") return FieldCompression::Zlib;
+    if (name == "lzma") return FieldCompression::Lzma;
+    throw std::invalid_argument("Unsupported field compression: " + name);
+}
+
+std::string field_compression_extension(FieldCompression compression) {
+    switch (compression) {
+        case FieldCompression::None: return "";
+        case FieldCompression::Zlib: return ".gz";
+        case FieldCompression::Lzma: return ".xz";
+    }
+    throw std::invalid_argument("Unsupported field compression");
+}
+
+int default_compression_level(FieldCompression compression) {
+    return compression == FieldCompression::Lzma ? 6 : 9;
+}
+
+namespace {
+
+void compress_zlib(const std::string& data, int level, std::string& out) {
+    z_stream stream{};
+    // 15 + 16 selects the largest window with a gzip header and trailer
+    if (deflateInit2(&stream, level, Z_DEFLATED, 15 + 16, 8, Z_DEFAULT_STRATEGY) != Z_OK) {
+        throw std::invalid_argument("Invalid zlib compression level: " + std::to_string(level));
+    }
+    out.resize(deflateBound(&stream, data.size()));
+
+    // zlib counts in 32-bit unsigned ints, so larger blocks are fed in pieces
+    const std::size_t max_piece = std::numeric_limits<uInt>::max();
+    std::size_t consumed = 0;
+    int status = Z_OK;
+    while (status != Z_STREAM_END) {
+        if (stream.avail_in == 0 && consumed < data.size()) {
+            std::size_t piece = std::min(max_piece, data.size() - consumed);
+            stream.next_in = reinterpret_cast<Bytef*>(const_cast<char*>(data.data() + consumed));
+            stream.avail_in = static_cast<uInt>(piece);
+            consumed += piece;
+        }
+        if (stream.total_out == out.size()) {
+            out.resize(out.size() * 2 + 64);
+        }
+        stream.next_out = reinterpret_cast<Bytef*>(&out[stream.total_out]);
+        stream.avail_out = static_cast<uInt>(std::min(max_piece, out.size() - stream.total_out));
+
+        status = deflate(&stream, consumed == data.size() ? Z_FINISH : Z_NO_FLUSH);
+        if (status == Z_STREAM_ERROR) {
+            deflateEnd(&stream);
+            throw std::runtime_error("zlib compression failed");
+        }
+    }
+    out.resize(stream.total_out);
+    deflateEnd(&stream);
+}
+
+void compress_lzma(const std::string& data, int level, std::string& out) {
+    if (level < 0 || level > 9) {
+        throw std::invalid_argument("Invalid lzma compression level: " + std::to_string(level));
+    }
+    out.resize(lzma_stream_buffer_bound(data.size()));
+    std::size_t out_pos = 0;
+    lzma_ret status = lzma_easy_buffer_encode(static_cast<std::uint32_t>(level), LZMA_CHECK_CRC64, nullptr,
+                                              reinterpret_cast<const std::uint8_t*>(data.data()), data.size(),
+                                              reinterpret_cast<std::uint8_t*>(&out[0]), &out_pos, out.size());
+    if (status != LZMA_OK) {
+        throw std::runtime_error("lzma compression failed");
+    }
+    out.resize(out_pos);
+}
+
+} // namespace
+
+void compress_block(const std::string& data, FieldCompression compression, int level, std::string& out) {
+    out.clear();
+    // An empty block adds nothing, so empty fields give empty files
+    if (data.empty()) {
+        return;
+    }
+    switch (compression) {
+        case FieldCompression::None: out = data; break;
+        case FieldCompression::Zlib: compress_zlib(data, level, out); break;
+        case FieldCompression::Lzma: compress_lzma(data, level, out); break;
+    }
+}
@@ -0,0 +1,27 @@
+#ifndef SEQBENCH_FIELD_COMPRESSION_H
+#define SEQBENCH_FIELD_COMPRESSION_H
+
+#include <string>
+
+// General-purpose codec applied to the non-quality fields while they are split
+enum class FieldCompression {
+    None,
+    Zlib,  // gzip members, readable by gzip -d and open_input_stream
+    Lzma   // xz streams, readable by xz -d
+};
+
+// Accepts "none", "zlib" and "lzma"
+FieldCompression parse_field_compression(const std::string& name);
+
+// Suffix appended to a field path for its compressed copy, empty for None
+std::string field_compression_extension(FieldCompression compression);
+
+// zlib uses the level of gzip -9, lzma the xz default preset (preset 9 needs ~700MB per thread)
+int default_compression_level(FieldCompression compression);
+
+// Replaces out with data compressed as one self-contained gzip member or xz stream.
+// Compressed blocks concatenate into a valid file, so blocks can be compressed independently.
+void compress_block(const std::string& data, FieldCompression compression, int level, std::string& out);
+
+
+#endif //SEQBENCH_FIELD_COMPRESSION_H
@@ -4,47 +4,85 @@ import sys
 import subprocess
 import logging
 from jinja2 import Template
-from command_generator import CommandGeneratorFactory
-from dependency_linker import DependencyLinker
+from command_generator import CommandGeneratorFactory, QUALITY_DTYPE_SIZES
+from dependency_linker import create_dependency_linker
+from scheduler_state import SchedulerState
+from executors import create_executor
+from fastq_profile import get_profile, redundant_job_indices, sized_nodes_ppn
 
 sys.path.append('../')
 sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
 import fastq_processor
 
 
-
-
-def check_job_status_depend(job_id):
-    check_command = f"qstat -f {job_id}"
-    try:
-        result = subprocess.run(check_command, check=True, shell=True, capture_output=True, text=True)
-        output = result.stdout
-        if "job_state = R" in output:
-            return True  # Running or other states
-        elif "job_state = H" in output:
-            return True
-        elif "job_state = Q" in output:
-            return True
-        else:
-            return False
-    except subprocess.CalledProcessError as e:
-        return False
-
-
 class JobGenerator:
     def __init__(self, config_name,
                  template_path,
                  fast_split_template,
-                 fast_reconstruct_template):
+                 fast_reconstruct_template,
+                 scheduler_state=None,
+                 array_template=None,
+                 executor=None,
+                 run_id=None):
         self.factory = CommandGeneratorFactory(config_name)
         self.config = self.factory.config
         self.path_generator = self.factory.path_generator
         self.template_path = template_path
-        self.dependency_linker = DependencyLinker()
+        self.dependency_linker = create_dependency_linker(self.config, self.factory.config_path, run_id)
+        # One qstat call answers the dependency checks of every job, see scheduler_state.py
+        self.scheduler_state = scheduler_state or SchedulerState(self.config.get('scheduler_state_ttl', 30))
+        self.scheduler_state.track(self.dependency_linker.get_all_job_ids())
+        # Submits to PBS or runs the scripts locally, see executors.py
+        self.executor = executor or create_executor(self.config, self.scheduler_state)
         self.all_commands = self.factory.generate_all_commands()
         self.fast_split_template = fast_split_template
         self.fast_reconstruct_template = fast_reconstruct_template
+        self.array_template = array_template or os.path.join(os.path.dirname(template_path), 'compression_array.sh')
         self.conda_path = ''
+        # Streaming runs split, SZ3 and reconstruction in one job, the decompressed quality stream goes through a FIFO
+        self.streaming = self.config.get('streaming', False)
+        # Profiled inputs skip redundant jobs and request cores by their size, see profile_inputs
+        self.profiling = self.config.get('profile', False)
+        self.profiles = {}
+        self.redundant_jobs = {}
+        self.input_sizes = {}
+        # Compression jobs sharing their dependencies and resources are submitted as one job array
+        self.job_arrays = self.config.get('job_arrays', False)
+        self.array_count = 0
+
+    def profile_inputs(self):
+        threads = self.config.get('profile_threads', os.cpu_count() or 1)
+        for file_pair_index, file_pair in enumerate(self.config['input_file']):
+            for file_index in range(len(file_pair)):
+                profile = get_profile(self.path_generator, file_pair_index, file_index, threads)
+                redundant = redundant_job_indices(self.config, profile)
+                for job_index, reason in sorted(redundant.items()):
+                    logging.info(f"Skipping job {job_index} on input {file_pair_index}_{file_index}: {reason}")
+                self.profiles[(file_pair_index, file_index)] = profile
+                self.redundant_jobs[(file_pair_index, file_index)] = redundant
+
+    def is_redundant(self, job_index, file_pair_index, file_index):
+        return job_index in self.redundant_jobs.get((file_pair_index, file_index), {})
+
+    def get_input_size(self, file_pair_index, file_index):
+        # Uncompressed size of a .gz input, which ratios are taken against. The profile decompresses it once and is
+        # cached next to the fields, rather than every compression job decompressing it again. None for plain input.
+        input_path = self.path_generator.get_input_file_path(0, file_pair_index, file_index)
+        if not input_path.endswith('.gz'):
+            return None
+        if (file_pair_index, file_index) not in self.input_sizes:
+            threads = self.config.get('profile_threads', os.cpu_count() or 1)
+            profile = (self.profiles.get((file_pair_index, file_index))
+                       or get_profile(self.path_generator, file_pair_index, file_index, threads))
+            self.input_sizes[(file_pair_index, file_index)] = profile['bytes']
+        return self.input_sizes[(file_pair_index, file_index)]
+
+    def get_nodes_ppn(self, file_pair_index, file_index):
+        return sized_nodes_ppn(self.config, self.profiles.get((file_pair_index, file_index)))
+
+    def get_dependency_line(self, dependencies):
+        active_dependencies = self.executor.active_jobs(dependencies)
+        return f"#PBS -W depend=afterok:{':'.join(active_dependencies)}\n" if active_dependencies else ""
 
     def create_compression_metrics_csv(self, file_pair_index, file_index):
         metrics_path = self.path_generator.get_compression_metric_path(file_pair_index, file_index)
@@ -57,7 +95,7 @@ class JobGenerator:
         logging.info(f"Created CSV file for compression metrics: {metrics_path}")
 
     def create_job_script(self, job_name, commands, job_index, file_pair_index, file_index,
-                          dependencies=None):
+                          dependencies=None, split_script='', reconstruct_script=''):
         if not dependencies:
             dependencies = []
         job_script_path = self.path_generator.get_script_path(job_index, file_pair_index, file_index)
@@ -86,20 +124,23 @@ class JobGenerator:
         compressor_name = self.path_generator.get_compressor_name(job_index, file_pair_index, file_index)
         if referenced:
             compressor_name += '_referenced'
-        nodes = self.config.get('nodes', 1)  # Default to 1 node if not specified
-        ppn = self.config.get('ppn', 8)  # Default to 8 processor per node if not specified
+        nodes, ppn = self.get_nodes_ppn(file_pair_index, file_index)
         conda_path = self.config.get('conda_path', self.conda_path)
         walltime = self.config.get('walltime', "24:00:00")
         email = self.config.get('email', "default@gamil.com")
         node_size = self.config.get('node_size', 'normal')
         compressor = self.config['jobs'][job_index]['name'].upper()
-        active_dependencies = []
-        for dep in dependencies:
-            job_status = check_job_status_depend(dep)
-            if job_status:
-                active_dependencies.append(dep)
-
-        dependency_line = f"#PBS -W depend=afterok:{':'.join(active_dependencies)}\n" if active_dependencies else ""
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        field_size_path = self.path_generator.get_field_size_path(job_index, file_pair_index, file_index)
+        decompressed_quality_path = ''
+        if reconstruct_script:
+            decompressed_quality_path = self.path_generator.get_decompressed_quality_path(job_index, file_pair_index,
+                                                                                          file_index)
+        stream_metrics_script = ''
+        if self.path_generator.uses_stream_error_analysis(job_index):
+            stream_metrics_script = os.path.join(self.path_generator.project_base_dir, 'Error_Analysis_Scripts',
+                                                 'stream_metrics.py')
+        dependency_line = self.get_dependency_line(dependencies)
         job_name = f"compression_{file_pair_index}_{job_index}_{file_index}"
 
         job_script_content = template.render(
@@ -117,10 +158,27 @@ class JobGenerator:
             compression_command=compression_command,
             decompression_command=decompression_command,
             input_path=input_path,
+            input_size=self.get_input_size(file_pair_index, file_index),
             binary_input_file=binary_input_file,
+            quality_dtype_size=QUALITY_DTYPE_SIZES[quality_dtype],
+            field_size_path=field_size_path,
             compressed_output_path=compressed_output_path,
             metrics_csv_path=metrics_csv_path,
             compressor_name=compressor_name,
+            split_script=split_script,
+            reconstruct_script=reconstruct_script,
+            decompressed_quality_path=decompressed_quality_path,
+            stream_metrics_script=stream_metrics_script,
+            decompressed_output_path=self.path_generator.get_decompressed_output_path(job_index, file_pair_index,
+                                                                                      file_index),
+            original_file=self.path_generator.get_input_file_path(0, file_pair_index, file_index),
+            histogram_path=self.path_generator.get_error_analysis_histogram_path(job_index, file_pair_index,
+                                                                                 file_index),
+            position_error_path=self.path_generator.get_error_analysis_position_error_path(job_index,
+                                                                                           file_pair_index,
+                                                                                           file_index),
+            error_analysis_job_name=f"error_analysis_{file_pair_index}_{job_index}_{file_index}",
+            error_analysis_csv_path=self.path_generator.get_error_analysis_metric_path(file_pair_index, file_index),
             dependency_line=dependency_line
         )
 
@@ -131,10 +189,8 @@ class JobGenerator:
         return job_script_path
 
     def submit_job(self, job_script_path, job_name, use_append=False):
-        submit_command = f"qsub {job_script_path}"  # Change this if using a different scheduler like `sbatch` for SLURM
         try:
-            result = subprocess.run(submit_command, check=True, shell=True, capture_output=True, text=True)
-            job_id = result.stdout.strip().split('.')[0]  # Get the job ID from the output
+            job_id = self.executor.submit(job_script_path)
             if use_append:
                 self.dependency_linker.append_job_id(job_name, job_id)
             else:
@@ -145,90 +201,149 @@ class JobGenerator:
             logging.error(f"Failed to submit job: {job_script_path}, Error: {e}")
             return None
 
-    def generate_and_submit_pre_processing_jobs(self):
-        preprocessing_job_ids = []
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for file_index in range(len(file_pair)):
-                job_name = f"pre_processing_{file_pair_index}_{file_index}"
-                input_path = self.path_generator.get_input_file_path(0, file_pair_index, file_index)
-                output_bases_id_path = self.path_generator.get_bases_id_path(0, file_pair_index, file_index)
-                output_bases_path = self.path_generator.get_dna_bases_path(0, file_pair_index, file_index)
-                output_quality_id_path = self.path_generator.get_quality_id_path(0, file_pair_index, file_index)
-                output_quality_path = self.path_generator.get_quality_scores_path(0, file_pair_index, file_index)
-                output_log = self.path_generator.get_output_log_path(0, file_pair_index, file_index, 'fastq_split')
-                error_log = self.path_generator.get_error_log_path(0, file_pair_index, file_index, 'fastq_split')
-                nodes = self.config.get('nodes', 1)  # Default to 1 node if not specified
-                ppn = self.config.get('ppn', 8)  # Default to 8 processor per node if not specified
-                conda_path = self.config.get('conda_path', self.conda_path)
-                walltime = self.config.get('walltime', "24:00:00")
-                email = self.config.get('email', "default@gamil.com")
-                node_size = self.config.get('node_size', 'normal')
-                build_pre_processing_cpp_path = self.path_generator.get_build_pre_processing_cpp_path()
-
-                with open(self.fast_split_template) as f:
-                    template = Template(f.read())
-
-                job_script_content = template.render(
-                    job_name=job_name,
-                    nodes=nodes,
-                    ppn=ppn,
-                    node_size=node_size,
-                    walltime=walltime,
-                    input_path=input_path,
-                    output_bases_id_path=output_bases_id_path,
-                    output_bases_path=output_bases_path,
-                    output_quality_id_path=output_quality_id_path,
-                    output_quality_path=output_quality_path,
-                    get_build_pre_processing_cpp_path=build_pre_processing_cpp_path,
-                    output_log=output_log,
-                    error_log=error_log,
-                    conda_path=conda_path,
-                    email=email
-                )
-
-                script_path = self.path_generator.get_pre_processing_script_path(0, file_pair_index, file_index)
-                with open(script_path, 'w') as script_file:
-                    script_file.write(job_script_content)
-
-                logging.info(f"Created preprocessing job script: {script_path}")
-                job_id = self.submit_job(script_path, job_name)
-                if job_id:
-                    preprocessing_job_ids.append(job_id)
-                    for job_index, job in enumerate(self.config['jobs']):
-                        if job['name'].upper() == "SZ3":
-                            dependent_job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-                            self.dependency_linker.add_job_id(dependent_job_name, job_id)
-        return preprocessing_job_ids
-
-    def generate_and_submit_reconstruct_jobs(self, job_name, job_index, file_pair_index, file_index, dependencies,
-                                             ):
+    def submit_job_array(self, elements, dependencies, nodes, ppn):
+        array_index = self.array_count
+        self.array_count += 1
+        job_name = f"compression_array_{array_index}"
+        array_elements = []
+        for element in elements:
+            with open(element['script_path']) as f:
+                script = f.read().rstrip('\n')
+            array_elements.append({
+                'script': script,
+                'output_log': self.path_generator.get_output_log_path(element['job_index'], element['file_pair_index'],
+                                                                      element['file_index']),
+                'error_log': self.path_generator.get_error_log_path(element['job_index'], element['file_pair_index'],
+                                                                    element['file_index'])})
+
+        with open(self.array_template) as f:
+            template = Template(f.read())
+
+        scheduler = self.config.get('scheduler', 'torque')
+        job_script_content = template.render(
+            job_name=job_name,
+            nodes=nodes,
+            ppn=ppn,
+            node_size=self.config.get('node_size', 'normal'),
+            walltime=self.config.get('walltime', "24:00:00"),
+            email=self.config.get('email', "default@gamil.com"),
+            output_log=self.path_generator.get_array_output_log_path(array_index),
+            error_log=self.path_generator.get_array_error_log_path(array_index),
+            scheduler=scheduler,
+            last_index=len(elements) - 1,
+            elements=array_elements,
+            dependency_line=f"#PBS -W depend=afterok:{':'.join(dependencies)}\n" if dependencies else ""
+        )
+
+        script_path = self.path_generator.get_array_script_path(array_index)
+        with open(script_path, 'w') as f:
+            f.write(job_script_content)
+        logging.info(f"Created job array script: {script_path} with {len(elements)} elements")
+
+        array_id = self.submit_job(script_path, job_name)
+        if not array_id:
+            return [None] * len(elements)
+        element_ids = []
+        for element_index, element in enumerate(elements):
+            # Torque elements are jobs of their own, e.g. 123[4], which later stages depend on one by one.
+            # PBS Pro rejects dependencies on subjobs, there they wait on the whole array, 123[].
+            element_id = array_id
+            if len(elements) > 1 and scheduler != 'pbspro':
+                element_id = array_id.replace('[]', f'[{element_index}]')
+            element_ids.append(element_id)
+            self.scheduler_state.record_submission(element_id)
+            self.dependency_linker.add_job_id(element['job_name'], element_id)
+            if element['is_sz3']:
+                self.dependency_linker.add_job_id(f"compression_{element['file_pair_index']}_{element['job_index']}_"
+                                                  f"{element['file_index']}", element_id)
+        return element_ids
+
+    def create_pre_processing_script(self, file_pair_index, file_index):
+        job_name = f"pre_processing_{file_pair_index}_{file_index}"
+        input_path = self.path_generator.get_input_file_path(0, file_pair_index, file_index)
+        output_bases_id_path = self.path_generator.get_bases_id_path(0, file_pair_index, file_index)
+        output_bases_path = self.path_generator.get_dna_bases_path(0, file_pair_index, file_index)
+        output_quality_id_path = self.path_generator.get_quality_id_path(0, file_pair_index, file_index)
+        output_quality_path = self.path_generator.get_quality_scores_path(0, file_pair_index, file_index)
+        output_log = self.path_generator.get_output_log_path(0, file_pair_index, file_index, 'fastq_split')
+        error_log = self.path_generator.get_error_log_path(0, file_pair_index, file_index, 'fastq_split')
+        nodes, ppn = self.get_nodes_ppn(file_pair_index, file_index)
+        conda_path = self.config.get('conda_path', self.conda_path)
+        walltime = self.config.get('walltime', "24:00:00")
+        email = self.config.get('email', "default@gamil.com")
+        node_size = self.config.get('node_size', 'normal')
+        buffer_size = self.config.get('split_buffer_size', 10 * 1024 ** 3)  # Bytes of output buffered in memory
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        base_encoding = self.config.get('base_encoding', '2bit')
+        header_encoding = self.config.get('header_encoding', 'tokenized')
+        separator_encoding = self.config.get('separator_encoding', 'elided')
+        field_compression = self.config.get('field_compression', 'zlib')  # zlib, lzma or none
+        compression_level = self.config.get('field_compression_level', -1)  # -1 uses the codec default
+        field_size_path = self.path_generator.get_field_size_path(0, file_pair_index, file_index)
+        field_index_path = self.path_generator.get_field_index_path(0, file_pair_index, file_index)
+        build_pre_processing_cpp_path = self.path_generator.get_build_pre_processing_cpp_path()
+
+        with open(self.fast_split_template) as f:
+            template = Template(f.read())
+
+        job_script_content = template.render(
+            job_name=job_name,
+            nodes=nodes,
+            ppn=ppn,
+            node_size=node_size,
+            walltime=walltime,
+            input_path=input_path,
+            output_bases_id_path=output_bases_id_path,
+            output_bases_path=output_bases_path,
+            output_quality_id_path=output_quality_id_path,
+            output_quality_path=output_quality_path,
+            get_build_pre_processing_cpp_path=build_pre_processing_cpp_path,
+            output_log=output_log,
+            error_log=error_log,
+            conda_path=conda_path,
+            email=email,
+            buffer_size=buffer_size,
+            quality_dtype=quality_dtype,
+            base_encoding=base_encoding,
+            header_encoding=header_encoding,
+            separator_encoding=separator_encoding,
+            field_compression=field_compression,
+            compression_level=compression_level,
+            field_size_path=field_size_path,
+            field_index_path=field_index_path,
+            threads=nodes * ppn
+        )
+
+        script_path = self.path_generator.get_pre_processing_script_path(0, file_pair_index, file_index)
+        with open(script_path, 'w') as script_file:
+            script_file.write(job_script_content)
+
+        logging.info(f"Created preprocessing job script: {script_path}")
+        return script_path
+
+    def create_reconstruct_script(self, job_index, file_pair_index, file_index, dependency_line=""):
         build_fastq_reconstruct_cpp_path = self.path_generator.get_build_fastq_reconstruct_cpp_path()
         job_name = f"fastq_reconstruct_{file_pair_index}_{file_index}"
         output_bases_id_path = self.path_generator.get_bases_id_path(job_index, file_pair_index, file_index)
         output_bases_path = self.path_generator.get_dna_bases_path(job_index, file_pair_index, file_index)
         output_quality_id_path = self.path_generator.get_quality_id_path(job_index, file_pair_index, file_index)
-        output_quality_path = self.path_generator.get_decompressed_output_path(job_index, file_pair_index, file_index)
-        if output_quality_path.endswith('.bin.fastq'):
-            output_quality_path = output_quality_path[:-6]
+        output_quality_path = self.path_generator.get_decompressed_quality_path(job_index, file_pair_index,
+                                                                                file_index)
 
         output_path = self.path_generator.get_decompressed_output_path(job_index, file_pair_index, file_index)
         # output_path = output_path.replace('{Binary_length}', str(bianry_length))
         output_log = self.path_generator.get_output_log_path(0, file_pair_index, file_index, 'fastq_reconstruct')
         error_log = self.path_generator.get_error_log_path(0, file_pair_index, file_index, 'fastq_reconstruct')
-        nodes = self.config.get('nodes', 1)  # Default to 1 node if not specified
-        ppn = self.config.get('ppn', 8)  # Default to 8 processor per node if not specified
+        nodes, ppn = self.get_nodes_ppn(file_pair_index, file_index)
         conda_path = self.config.get('conda_path', self.conda_path)
         walltime = self.config.get('walltime', "24:00:00")
         email = self.config.get('email', "default@gamil.com")
         node_size = self.config.get('node_size', 'normal')
-
-        active_dependencies = []
-        for dep in dependencies:
-            job_status = check_job_status_depend(dep)
-            if job_status:
-                active_dependencies.append(dep)
-
-        dependency_line = f"#PBS -W depend=afterok:{':'.join(active_dependencies)}\n" if active_dependencies else ""
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        base_encoding = self.config.get('base_encoding', '2bit')
+        header_encoding = self.config.get('header_encoding', 'tokenized')
+        separator_encoding = self.config.get('separator_encoding', 'elided')
+        field_index_path = self.path_generator.get_field_index_path(job_index, file_pair_index, file_index)
 
         with open(self.fast_reconstruct_template) as f:
             template = Template(f.read())
@@ -244,6 +359,12 @@ class JobGenerator:
             output_quality_id_path=output_quality_id_path,
             output_quality_path=output_quality_path,
             output_path=output_path,
+            quality_dtype=quality_dtype,
+            base_encoding=base_encoding,
+            header_encoding=header_encoding,
+            separator_encoding=separator_encoding,
+            field_index_path=field_index_path,
+            threads=nodes * ppn,
             get_build_pre_processing_cpp_path=build_fastq_reconstruct_cpp_path,
             output_log=output_log,
             error_log=error_log,
@@ -257,59 +378,12 @@ class JobGenerator:
             script_file.write(job_script_content)
 
         logging.info(f"Created reconstruction job script: {script_path}")
-        job_id = self.submit_job(script_path, job_name)
-        dependent_job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-        self.dependency_linker.add_job_id(dependent_job_name, job_id)
-        return job_id
-
-    def generate_and_submit_jobs(self):
-        # Step 1: Create CSV files for each input file
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for file_index in range(len(file_pair)):
-                self.create_compression_metrics_csv(file_pair_index, file_index)
-
-        # Step 2: FastQ split for SZ3
-        preprocessing_jobs = []
-        for job_index, job in enumerate(self.config['jobs']):
-            if job['name'].upper() == "SZ3":
-                preprocessing_job_ids = self.generate_and_submit_pre_processing_jobs()
-                break
-
-        # Step 3: Create and submit job scripts with dependencies
-        previous_job_ids = []
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for job_index in range(len(self.config['jobs'])):
-                for file_index in range(len(file_pair)):
-                    job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-                    if self.config['jobs'][job_index]['name'].upper() == 'SZ3':
-                        previous_job_ids = self.dependency_linker.get_dependencies(job_name)
-
-                    job_script_path = self.create_job_script(
-                        job_name,
-                        self.all_commands[file_pair_index][job_index][file_index],
-                        job_index,
-                        file_pair_index,
-                        file_index,
-                        dependencies=previous_job_ids
-                    )
-                    job_id = self.submit_job(job_script_path, job_name)
-                    if job_id:
-                        self.dependency_linker.add_job_id(job_name, job_id)
-                        previous_job_ids = []
-
-        # Step 4: FastQ reconstruct for SZ3
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for job_index in range(len(self.config['jobs'])):
-                for file_index in range(len(file_pair)):
-                    if self.config['jobs'][job_index]['name'].upper() == 'SZ3':
-                        job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-                        dependencies = self.dependency_linker.get_dependencies(job_name)
-                        self.generate_and_submit_reconstruct_jobs(job_name, job_index, file_pair_index, file_index,
-                                                                  dependencies)
+        return script_path
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname=s - %(message=s')
-    config_name = "../Jobs/sample.json"
-    job_generator = JobGenerator(config_name)
-    job_generator.generate_and_submit_jobs()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # The compression stage alone, submitted through the same task graph as main.py
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from workflow import run_seqbench
+    run_seqbench("../Jobs/sample.json", ['Compression'])
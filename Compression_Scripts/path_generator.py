@@ -43,6 +43,9 @@ class PathGenerator:
         return self.get_full_path(input_files[file_index])
 
     def replace_extension(self, file_name, new_extension):
+        # gzip/BGZF inputs are read directly by the C++ kernels, sample.fastq.gz -> sample<new_extension>
+        if file_name.endswith('.gz'):
+            file_name = file_name[:-len('.gz')]
         base_name, file_ext = os.path.splitext(file_name)
         if file_ext in ['.fastq', '.fq', '.fnq']:
             return base_name + new_extension
@@ -54,7 +57,9 @@ class PathGenerator:
         base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
         self.ensure_directory_exists(base_dir)
         base_file_name = os.path.basename(input_file_path)
-        base_name = self.replace_extension(base_file_name, '_base_id.fastq')
+        # Tokenized headers are a binary column stream rather than one header per line
+        extension = '_base_id.tok' if self.config.get('header_encoding', 'tokenized') == 'tokenized' else '_base_id.fastq'
+        base_name = self.replace_extension(base_file_name, extension)
         return os.path.join(base_dir, base_name)
 
     def get_dna_bases_path(self, job_index, file_pair_index, file_index):
@@ -62,7 +67,9 @@ class PathGenerator:
         base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
         self.ensure_directory_exists(base_dir)
         base_file_name = os.path.basename(input_file_path)
-        base_name = self.replace_extension(base_file_name, '_dna_bases.fastq')
+        # The 2bit encoding is a packed binary stream rather than one line of bases per record
+        extension = '_dna_bases.2bit' if self.config.get('base_encoding', '2bit') == '2bit' else '_dna_bases.fastq'
+        base_name = self.replace_extension(base_file_name, extension)
         return os.path.join(base_dir, base_name)
 
     def get_quality_id_path(self, job_index, file_pair_index, file_index):
@@ -70,7 +77,35 @@ class PathGenerator:
         base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
         self.ensure_directory_exists(base_dir)
         base_file_name = os.path.basename(input_file_path)
-        base_name = self.replace_extension(base_file_name, '_quality_id.fastq')
+        # Elided separators are a binary block stream rather than one '+' line per record
+        extension = '_quality_id.sep' if self.config.get('separator_encoding', 'elided') == 'elided' else '_quality_id.fastq'
+        base_name = self.replace_extension(base_file_name, extension)
+        return os.path.join(base_dir, base_name)
+
+    def get_field_size_path(self, job_index, file_pair_index, file_index):
+        input_file_path = self.get_input_file_path(job_index, file_pair_index, file_index)
+        base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
+        self.ensure_directory_exists(base_dir)
+        base_file_name = os.path.basename(input_file_path)
+        base_name = self.replace_extension(base_file_name, '_field_size.json')
+        return os.path.join(base_dir, base_name)
+
+    def get_profile_path(self, job_index, file_pair_index, file_index):
+        input_file_path = self.get_input_file_path(job_index, file_pair_index, file_index)
+        base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
+        self.ensure_directory_exists(base_dir)
+        base_file_name = os.path.basename(input_file_path)
+        # Statistics of the input from fastq_processor.profile_fastq, see fastq_profile.py
+        base_name = self.replace_extension(base_file_name, '_profile.json')
+        return os.path.join(base_dir, base_name)
+
+    def get_field_index_path(self, job_index, file_pair_index, file_index):
+        input_file_path = self.get_input_file_path(job_index, file_pair_index, file_index)
+        base_dir = os.path.join(os.path.dirname(input_file_path), "FASTQ_fields")
+        self.ensure_directory_exists(base_dir)
+        base_file_name = os.path.basename(input_file_path)
+        # Record offsets of each field block, lets the reconstruction decode blocks in parallel
+        base_name = self.replace_extension(base_file_name, '_field_index.bin')
         return os.path.join(base_dir, base_name)
 
     def get_quality_scores_path(self, job_index, file_pair_index, file_index):
@@ -135,6 +170,13 @@ class PathGenerator:
             decompressed_file_name = f"{os.path.basename(compressed_path)}.fastq"
         return os.path.join(decompressed_output_dir, decompressed_file_name)
 
+    def get_decompressed_quality_path(self, job_index, file_pair_index, file_index):
+        # SZ3 decompresses the binary quality stream, which the reconstruction turns into the .bin.fastq
+        decompressed_quality_path = self.get_decompressed_output_path(job_index, file_pair_index, file_index)
+        if decompressed_quality_path.endswith('.bin.fastq'):
+            decompressed_quality_path = decompressed_quality_path[:-6]
+        return decompressed_quality_path
+
     def get_reconstruct_fastq_path(self, job_index, file_pair_index, file_index):
         decompressed_bin = self.get_decompressed_output_path(job_index, file_pair_index, file_index)
         return decompressed_bin  # No need to add .fastq again, it's already in the decompressed path
@@ -163,6 +205,21 @@ class PathGenerator:
         self.ensure_directory_exists(scripts_dir)
         return os.path.join(scripts_dir, f"job_{file_pair_index}_{job_index}_{file_index}.sh")
 
+    def get_array_script_path(self, array_index):
+        scripts_dir = os.path.join(self.project_base_dir, 'Compression_Scripts/Logs/JobScripts')
+        self.ensure_directory_exists(scripts_dir)
+        return os.path.join(scripts_dir, f"compression_array_{array_index}.sh")
+
+    def get_array_output_log_path(self, array_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Compression_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"compression_array_{array_index}_output.log")
+
+    def get_array_error_log_path(self, array_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Compression_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"compression_array_{array_index}_error.log")
+
     def get_pre_processing_script_path(self, job_index, file_pair_index, file_index):
         scripts_dir = os.path.join(self.project_base_dir, 'Compression_Scripts/Logs/JobScripts')
         self.ensure_directory_exists(scripts_dir)
@@ -198,6 +255,14 @@ class PathGenerator:
         formatted_options = options.replace(" ", "_")
         return f"{compressor_name}_{formatted_options}"
 
+    def uses_stream_error_analysis(self, job_index):
+        # Jobs whose decompressed FASTQ is scored as it is written, inside the compression job. SZ3 is scored on
+        # its binary streams, and lossless checks, read ID joins and paired outputs need the whole files.
+        job = self.config['jobs'][job_index]
+        return (job.get('stream_error_analysis', self.config.get('stream_error_analysis', False))
+                and job['name'].upper() != 'SZ3' and not job.get('lossless', False)
+                and not job.get('reorders_reads', False) and not job.get('pair_compression', False))
+
     # ------------------------------------------------------------------------------------------
     # Post-Hoc Path
     # ------------------------------------------------------------------------------------------
@@ -319,11 +384,45 @@ class PathGenerator:
         self.ensure_directory_exists(metrics_dir)
         return os.path.join(metrics_dir, metrics_filename)
 
+    def get_error_analysis_quick_look_metric_path(self, file_pair_index, file_index):
+        input_files = self.config['input_file'][file_pair_index]
+        input_file_path = self.get_full_path(input_files[file_index])
+        base_filename = os.path.basename(input_file_path)
+        metrics_filename = f"quick_look_metrics_{base_filename}.csv"
+        metrics_dir = os.path.abspath(os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'metrics'))
+        self.ensure_directory_exists(metrics_dir)
+        return os.path.join(metrics_dir, metrics_filename)
+
+    def get_error_analysis_histogram_path(self, job_index, file_pair_index, file_index):
+        histogram_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'histograms')
+        self.ensure_directory_exists(histogram_dir)
+        return os.path.join(histogram_dir, f"joint_histogram_{file_pair_index}_{job_index}_{file_index}.npy")
+
+    def get_error_analysis_position_error_path(self, job_index, file_pair_index, file_index):
+        histogram_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'histograms')
+        self.ensure_directory_exists(histogram_dir)
+        return os.path.join(histogram_dir, f"position_error_{file_pair_index}_{job_index}_{file_index}.npy")
+
+    def get_error_analysis_verification_path(self, job_index, file_pair_index, file_index):
+        verification_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'verification')
+        self.ensure_directory_exists(verification_dir)
+        return os.path.join(verification_dir, f"verification_{file_pair_index}_{job_index}_{file_index}.json")
+
     def get_error_analysis_script_path(self, job_index, file_pair_index, file_index):
         scripts_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'JobScripts')
         self.ensure_directory_exists(scripts_dir)
         return os.path.join(scripts_dir, f"error_analysis_{file_pair_index}_{job_index}_{file_index}.sh")
 
+    def get_error_analysis_quick_look_script_path(self, job_index, file_pair_index, file_index):
+        scripts_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'JobScripts')
+        self.ensure_directory_exists(scripts_dir)
+        return os.path.join(scripts_dir, f"quick_look_{file_pair_index}_{job_index}_{file_index}.sh")
+
+    def get_error_analysis_selection_script_path(self, file_pair_index, file_index):
+        scripts_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'Logs', 'JobScripts')
+        self.ensure_directory_exists(scripts_dir)
+        return os.path.join(scripts_dir, f"pareto_selection_{file_pair_index}_{file_index}.sh")
+
     def get_build_cpp_path(self):
         build_path = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts', 'build')
         return build_path
@@ -338,6 +437,26 @@ class PathGenerator:
         self.ensure_directory_exists(logs_dir)
         return os.path.join(logs_dir, f"error_analysis_{file_pair_index}_{job_index}_{file_index}_error.log")
 
+    def get_error_analysis_quick_look_output_log_path(self, job_index, file_pair_index, file_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"quick_look_{file_pair_index}_{job_index}_{file_index}_output.log")
+
+    def get_error_analysis_quick_look_error_log_path(self, job_index, file_pair_index, file_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"quick_look_{file_pair_index}_{job_index}_{file_index}_error.log")
+
+    def get_error_analysis_selection_output_log_path(self, file_pair_index, file_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"pareto_selection_{file_pair_index}_{file_index}_output.log")
+
+    def get_error_analysis_selection_error_log_path(self, file_pair_index, file_index):
+        logs_dir = os.path.join(self.project_base_dir, 'Error_Analysis_Scripts/Logs/logs')
+        self.ensure_directory_exists(logs_dir)
+        return os.path.join(logs_dir, f"pareto_selection_{file_pair_index}_{file_index}_error.log")
+
 
 if __name__ == "__main__":
     config_path = "../Jobs/sample.json"  # Adjust the path as necessary
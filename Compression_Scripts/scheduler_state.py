@@ -0,0 +1,115 @@
+import re
+import shlex
+import time
+import logging
+import subprocess
+
+# Job states that can still satisfy an afterok/afterany dependency, B is a PBS Pro array with subjobs started
+ACTIVE_JOB_STATES = ('Q', 'H', 'R', 'B')
+
+# Job IDs per qstat call, keeps the command line well below the argument size limit
+QUERY_BATCH_SIZE = 1000
+
+
+def parse_qstat_full(output):
+    # Map the job IDs of `qstat -f` output to their job_state, IDs without the server suffix like submit_job's.
+    # Array elements keep their index, e.g. 123[4].
+    states = {}
+    job_id = None
+    for line in output.splitlines():
+        match = re.match(r'^Job Id:\s*(\S+)', line)
+        if match:
+            job_id = match.group(1).split('.')[0]
+            continue
+        match = re.match(r'^\s+job_state\s*=\s*(\S+)', line)
+        if match and job_id is not None:
+            states[job_id] = match.group(1)
+    return states
+
+
+def parse_qstat_unknown(output):
+    # Job IDs qstat's error output reports as gone, Torque and PBS Pro print "Unknown Job Id 123.server",
+    # PBS Pro "123.server Job has finished" for jobs it only keeps in its history. Other lines are real errors.
+    unknown = set()
+    errors = []
+    for line in output.splitlines():
+        match = (re.search(r'Unknown Job Id(?: Error)?\s+(\S+)', line)
+                 or re.search(r'^qstat:\s+(\S+)\s+Job has finished', line))
+        if match:
+            unknown.add(match.group(1).split('.')[0])
+        elif line.strip():
+            errors.append(line.strip())
+    return unknown, errors
+
+
+class SchedulerState:
+    """States of our scheduler jobs, fetched for every tracked job in one qstat call and cached for ttl seconds.
+
+    Jobs qstat reports as unknown have finished, their state stays None and they aren't queried again. A qstat
+    call that fails for any other reason raises rather than leaving every job looking finished.
+    Jobs submitted through this client count as queued until the next refresh, so fresh dependencies need
+    no query at all.
+    """
+
+    def __init__(self, ttl=30, query_command='qstat -f'):
+        self.ttl = ttl
+        self.query_command = query_command
+        self.states = {}
+        self.finished = set()
+        self.fetched_at = None
+
+    def track(self, job_ids):
+        # Jobs to include in every refresh, typically all the IDs of the dependency linker
+        for job_id in job_ids:
+            if str(job_id) not in self.states:
+                self.states[str(job_id)] = None
+                # Their state is unknown until the next refresh
+                self.fetched_at = None
+
+    def record_submission(self, job_id):
+        if job_id:
+            self.states[str(job_id)] = 'Q'
+
+    def is_stale(self):
+        return self.fetched_at is None or time.monotonic() - self.fetched_at > self.ttl
+
+    def refresh(self):
+        job_ids = sorted(job_id for job_id in self.states if job_id not in self.finished)
+        states = {}
+        finished = set()
+        for start in range(0, len(job_ids), QUERY_BATCH_SIZE):
+            batch = job_ids[start:start + QUERY_BATCH_SIZE]
+            # Finished jobs make qstat exit non-zero, the states of the others are still printed
+            result = subprocess.run(f"{self.query_command} {' '.join(shlex.quote(job_id) for job_id in batch)}", shell=True,
+                                    capture_output=True, text=True)
+            unknown, errors = parse_qstat_unknown(result.stderr)
+            if result.returncode != 0 and errors:
+                # Nothing is updated, a busy or unreachable server says nothing about our jobs
+                raise RuntimeError(f"{self.query_command} failed with status {result.returncode}: {' '.join(errors)}")
+            states.update(parse_qstat_full(result.stdout))
+            finished.update(unknown)
+        for job_id in job_ids:
+            if job_id in states:
+                self.states[job_id] = states[job_id]
+            elif job_id in finished:
+                self.states[job_id] = None
+                self.finished.add(job_id)
+        self.fetched_at = time.monotonic()
+        logging.info(f"Fetched the scheduler state of {len(job_ids)} jobs, {len(states)} still known")
+
+    def get_state(self, job_id):
+        self.track([job_id])
+        if self.is_stale():
+            self.refresh()
+        return self.states[str(job_id)]
+
+    def is_active(self, job_id):
+        return self.get_state(job_id) in ACTIVE_JOB_STATES
+
+    def active_jobs(self, job_ids):
+        # The job IDs still worth depending on, in their original order
+        job_ids = [str(job_id) for job_id in job_ids]
+        self.track(job_ids)
+        if job_ids and self.is_stale():
+            self.refresh()
+        return [job_id for job_id in job_ids if self.states[job_id] in ACTIVE_JOB_STATES]
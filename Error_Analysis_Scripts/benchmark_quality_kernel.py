@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
+import fastq_metrics
+
+
+def quality_buffers(size, seed=0):
+    # Phred 2 to 41 as in Illumina reads, the decompressed copy off by up to +-3 at a fifth of the positions
+    rng = np.random.default_rng(seed)
+    original = rng.integers(35, 75, size=size, dtype=np.uint8)
+    noise = rng.integers(-3, 4, size=size) * (rng.random(size) < 0.2)
+    decompressed = np.clip(original.astype(np.int16) + noise, 33, 126).astype(np.uint8)
+    return original, decompressed
+
+
+def python_reference(original, decompressed):
+    difference = original.astype(np.int64) - decompressed.astype(np.int64)
+    return int((difference * difference).sum())
+
+
+def benchmark_kernel(original, decompressed, kernel, repeats):
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = fastq_metrics.squared_difference_sum(original, decompressed, kernel)
+        best = min(best, time.perf_counter() - start_time)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the quality comparison kernels")
+    parser.add_argument('--size', type=int, default=256 * 1024 * 1024, help="Quality scores per buffer")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per kernel, the fastest one is reported")
+    args = parser.parse_args()
+
+    original, decompressed = quality_buffers(args.size)
+    expected = python_reference(original, decompressed)
+    print(f"Dispatched kernel: {fastq_metrics.quality_kernel()}")
+
+    for kernel in fastq_metrics.available_quality_kernels():
+        result, seconds = benchmark_kernel(original, decompressed, kernel, args.repeats)
+        status = "ok" if result == expected else f"MISMATCH, expected {expected}"
+        print(f"{kernel:>8}: {args.size / seconds / 1e9:.2f} GB/s, {seconds:.4f} seconds, sum {result} {status}")
+
+
+if __name__ == "__main__":
+    main()
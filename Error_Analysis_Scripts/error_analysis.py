@@ -10,32 +10,55 @@ sys.path.append('../')
 sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
 import fastq_metrics
 from Compression_Scripts.path_generator import PathGenerator
-from Compression_Scripts.dependency_linker import DependencyLinker
+from Compression_Scripts.dependency_linker import create_dependency_linker
+from Compression_Scripts.scheduler_state import SchedulerState
+from Compression_Scripts.executors import create_executor
+from Compression_Scripts.fastq_profile import get_cached_profile, redundant_job_indices
 
 
-def check_job_status_depend(job_id):
-    check_command = f"qstat -f {job_id}"
+def parse_metric(value):
+    # Empty or unparsable CSV fields, e.g. from a failed job, count as missing
     try:
-        result = subprocess.run(check_command, check=True, shell=True, capture_output=True, text=True)
-        output = result.stdout
-        if "job_state = R" in output:
-            return True  # Running or other states
-        elif "job_state = H" in output:
-            return True
-        elif "job_state = Q" in output:
-            return True
-        else:
-            return False
-    except subprocess.CalledProcessError as e:
-        return False
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def near_pareto_front(configurations, tolerance=0.0):
+    """Keys of the configurations that may lie on the (highest ratio, lowest MSE) Pareto front.
+
+    configurations maps a key to (ratio, mse_low, mse_high), the MSE bounds being a quick-look confidence interval.
+    A configuration is only dropped when another one beats it by the relative tolerance in ratio and, beyond both
+    confidence intervals, in MSE. Configurations with a missing value are always kept.
+    """
+    complete = {key: values for key, values in configurations.items()
+                if values is not None and None not in values}
+    selected = [key for key in configurations if key not in complete]
+    for key, (ratio, mse_low, _) in complete.items():
+        dominated = any(other_ratio >= ratio * (1 + tolerance) and other_mse_high * (1 + tolerance) < mse_low
+                        for other_key, (other_ratio, _, other_mse_high) in complete.items() if other_key != key)
+        if not dominated:
+            selected.append(key)
+    return selected
 
 
 class ErrorAnalysis:
-    def __init__(self, config_name, template_path):
+    def __init__(self, config_name, template_path, selection_template_path=None, scheduler_state=None,
+                 executor=None, run_id=None):
+        self.config_name = config_name
         self.config = self.load_config(config_name)
         self.path_generator = PathGenerator(config_name)
-        self.dependency_linker = DependencyLinker()
+        self.dependency_linker = create_dependency_linker(self.config, config_name, run_id)
+        self.scheduler_state = scheduler_state or SchedulerState(self.config.get('scheduler_state_ttl', 30))
+        self.scheduler_state.track(self.dependency_linker.get_all_job_ids())
+        # Submits to PBS or runs the scripts locally, see executors.py
+        self.executor = executor or create_executor(self.config, self.scheduler_state)
         self.template_path = template_path
+        self.selection_template_path = selection_template_path or os.path.join(os.path.dirname(template_path),
+                                                                               'pareto_selection.sh')
+        # Lossy configurations are first estimated from a sample, exact analysis follows near the Pareto front
+        self.quick_look = self.config.get('quick_look', False)
+        self.redundant_jobs = {}
 
     def load_config(self, config_path):
         try:
@@ -48,7 +71,7 @@ class ErrorAnalysis:
 
     def create_error_analysis_metrics_csv(self, file_pair_index, file_index):
         metrics_path = self.path_generator.get_error_analysis_metric_path(file_pair_index, file_index)
-        header = ['job_id', 'Compressor_Name', 'MSE_v3', 'PSNR_v3']
+        header = ['job_id', 'Compressor_Name', 'MSE_v3', 'PSNR_v3', 'MAE', 'Max_Error', 'PSNR_Peak', 'Lossless_Exact']
         # Ensure the directory exists
         os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
         with open(metrics_path, 'w', newline='') as csvfile:
@@ -56,15 +79,83 @@ class ErrorAnalysis:
             writer.writerow(header)
         logging.info(f"Created CSV file for Error Analysis metrics: {metrics_path}")
 
+    def create_quick_look_metrics_csv(self, file_pair_index, file_index):
+        metrics_path = self.path_generator.get_error_analysis_quick_look_metric_path(file_pair_index, file_index)
+        header = ['job_id', 'Compressor_Name', 'MSE', 'MSE_Low', 'MSE_High', 'PSNR', 'PSNR_Low', 'PSNR_High',
+                  'Samples']
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+        with open(metrics_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(header)
+        logging.info(f"Created CSV file for quick-look metrics: {metrics_path}")
+
+    def uses_binary_streams(self, job_index):
+        # SZ3's quality streams are compared directly, unless streaming mode never wrote the decompressed one
+        return self.config['jobs'][job_index]['name'].upper() == 'SZ3' and not self.config.get('streaming', False)
+
+    def uses_quick_look(self, job_index):
+        # Lossless jobs are verified exactly and reordered reads can't be sampled by byte offset
+        job = self.config['jobs'][job_index]
+        return (self.quick_look and not job.get('lossless', False) and not job.get('reorders_reads', False)
+                and not self.path_generator.uses_stream_error_analysis(job_index))
+
+    def is_redundant(self, job_index, file_pair_index, file_index):
+        # Jobs the compression phase skipped after profiling the input
+        if not self.config.get('profile', False):
+            return False
+        if (file_pair_index, file_index) not in self.redundant_jobs:
+            profile = get_cached_profile(self.path_generator, file_pair_index, file_index)
+            self.redundant_jobs[(file_pair_index, file_index)] = redundant_job_indices(self.config, profile)
+        return job_index in self.redundant_jobs[(file_pair_index, file_index)]
+
+    def get_dependencies(self, job_index, file_pair_index, file_index):
+        prev_job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
+        if self.uses_binary_streams(job_index):
+            # The binary streams are ready once SZ3 has run, the FASTQ reconstruction isn't awaited
+            prev_job_name = f"compression_{file_pair_index}_{job_index}_{file_index}"
+        return self.dependency_linker.get_dependencies(prev_job_name)
+
+    def get_dependency_line(self, dependencies, condition="afterok"):
+        active_dependencies = self.executor.active_jobs(dependencies)
+        return f"#PBS -W depend={condition}:{':'.join(active_dependencies)}\n" if active_dependencies else ""
+
     def create_error_analysis_script(self, job_name, job_index, file_pair_index, file_index,
-                                     dependencies=[]):
-        original_file = self.path_generator.get_input_file_path(0, file_pair_index, file_index)
-        decompressed_file = self.path_generator.get_decompressed_output_path(job_index, file_pair_index, file_index)
-        metrics_csv_path = self.path_generator.get_error_analysis_metric_path(file_pair_index, file_index)
+                                     dependencies=[], quick_look=False):
+        binary_streams = self.uses_binary_streams(job_index)
+        if binary_streams:
+            original_file = self.path_generator.get_quality_scores_path(job_index, file_pair_index, file_index)
+            decompressed_file = self.path_generator.get_decompressed_quality_path(job_index, file_pair_index,
+                                                                                  file_index)
+        else:
+            original_file = self.path_generator.get_input_file_path(0, file_pair_index, file_index)
+            decompressed_file = self.path_generator.get_decompressed_output_path(job_index, file_pair_index,
+                                                                                 file_index)
+        quality_dtype = self.config.get('quality_dtype', 'float32')
+        if quick_look:
+            metrics_csv_path = self.path_generator.get_error_analysis_quick_look_metric_path(file_pair_index,
+                                                                                             file_index)
+        else:
+            metrics_csv_path = self.path_generator.get_error_analysis_metric_path(file_pair_index, file_index)
         compressor_name = self.path_generator.get_compressor_name(job_index, file_pair_index, file_index)
         build_cpp_path = self.path_generator.get_build_cpp_path()
-        output_log = self.path_generator.get_error_analysis_output_log_path(job_index, file_pair_index, file_index)
-        error_log = self.path_generator.get_error_analysis_error_log_path(job_index, file_pair_index, file_index)
+        histogram_path = self.path_generator.get_error_analysis_histogram_path(job_index, file_pair_index, file_index)
+        position_error_path = self.path_generator.get_error_analysis_position_error_path(job_index, file_pair_index,
+                                                                                         file_index)
+        verification_path = self.path_generator.get_error_analysis_verification_path(job_index, file_pair_index,
+                                                                                     file_index)
+        # Lossless jobs are checked record by record instead of only scoring the quality values
+        lossless = self.config['jobs'][job_index].get('lossless', False) and not binary_streams
+        # Records of compressors that reorder reads are matched by read ID rather than by position
+        reorders_reads = self.config['jobs'][job_index].get('reorders_reads', False)
+        if quick_look:
+            output_log = self.path_generator.get_error_analysis_quick_look_output_log_path(job_index, file_pair_index,
+                                                                                           file_index)
+            error_log = self.path_generator.get_error_analysis_quick_look_error_log_path(job_index, file_pair_index,
+                                                                                         file_index)
+        else:
+            output_log = self.path_generator.get_error_analysis_output_log_path(job_index, file_pair_index,
+                                                                                file_index)
+            error_log = self.path_generator.get_error_analysis_error_log_path(job_index, file_pair_index, file_index)
 
         nodes = self.config.get('nodes', 1)  # Default to 1 node if not specified
         ppn = self.config.get('ppn', 8)  # Default to 8 processor per node if not specified
@@ -76,12 +167,7 @@ class ErrorAnalysis:
         with open(self.template_path) as f:
             template = Template(f.read())
 
-        active_dependencies = []
-        for dep in dependencies:
-            job_status = check_job_status_depend(dep)
-            if job_status:
-                active_dependencies.append(dep)
-        dependency_line = f"#PBS -W depend=afterok:{':'.join(active_dependencies)}\n" if active_dependencies else ""
+        dependency_line = self.get_dependency_line(dependencies)
 
         job_script_content = template.render(
             job_name=job_name,
@@ -99,47 +185,112 @@ class ErrorAnalysis:
             error_log=error_log,
             threads=nodes * ppn,
             build_cpp_path=build_cpp_path,
+            scripts_path=os.path.dirname(os.path.abspath(__file__)),
+            histogram_path=histogram_path,
+            position_error_path=position_error_path,
+            verification_path=verification_path,
+            lossless=lossless,
+            reorders_reads=reorders_reads,
+            binary_streams=binary_streams,
+            quality_dtype=quality_dtype,
+            quick_look=quick_look,
+            samples=self.config.get('quick_look_samples', 10000),
+            confidence=self.config.get('quick_look_confidence', 0.95),
             dependency_line=dependency_line
         )
 
-        job_script_path = self.path_generator.get_error_analysis_script_path(job_index, file_pair_index, file_index)
+        if quick_look:
+            job_script_path = self.path_generator.get_error_analysis_quick_look_script_path(job_index, file_pair_index,
+                                                                                            file_index)
+        else:
+            job_script_path = self.path_generator.get_error_analysis_script_path(job_index, file_pair_index,
+                                                                                 file_index)
+        with open(job_script_path, 'w') as f:
+            f.write(job_script_content)
+
+        logging.info(f"Created job script: {job_script_path}")
+        return job_script_path
+
+    def create_selection_script(self, file_pair_index, file_index, dependencies):
+        with open(self.selection_template_path) as f:
+            template = Template(f.read())
+
+        # The selection runs once every quick look has finished, failed ones included
+        job_script_content = template.render(
+            job_name=f"pareto_selection_{file_pair_index}_{file_index}",
+            walltime=self.config.get('walltime', "24:00:00"),
+            conda_path=self.config.get('conda_path', ''),
+            email=self.config.get('email', "default@gamil.com"),
+            node_size=self.config.get('node_size', 'normal'),
+            output_log=self.path_generator.get_error_analysis_selection_output_log_path(file_pair_index, file_index),
+            error_log=self.path_generator.get_error_analysis_selection_error_log_path(file_pair_index, file_index),
+            project_path=self.path_generator.project_base_dir,
+            scripts_path=os.path.dirname(os.path.abspath(__file__)),
+            config_path=os.path.abspath(self.config_name),
+            template_path=os.path.abspath(self.template_path),
+            selection_template_path=os.path.abspath(self.selection_template_path),
+            # The selection runs in a later process, it must look up this run's jobs
+            run_id=self.dependency_linker.run_id,
+            file_pair_index=file_pair_index,
+            file_index=file_index,
+            dependency_line=self.get_dependency_line(dependencies, condition="afterany")
+        )
+
+        job_script_path = self.path_generator.get_error_analysis_selection_script_path(file_pair_index, file_index)
         with open(job_script_path, 'w') as f:
             f.write(job_script_content)
 
         logging.info(f"Created job script: {job_script_path}")
         return job_script_path
 
+    def read_metric_column(self, metrics_path, column, key_column):
+        # Last value per job, reruns append rows to the same CSV
+        values = {}
+        if os.path.exists(metrics_path):
+            with open(metrics_path, newline='') as csvfile:
+                for row in csv.DictReader(csvfile):
+                    values[row[key_column]] = parse_metric(row.get(column))
+        return values
+
+    def submit_pareto_front_analysis(self, file_pair_index, file_index):
+        compression_metrics = self.path_generator.get_compression_metric_path(file_pair_index, file_index)
+        quick_look_metrics = self.path_generator.get_error_analysis_quick_look_metric_path(file_pair_index, file_index)
+        # The compression metrics are keyed by job_id_compression, see JobGenerator.create_compression_metrics_csv
+        ratios = self.read_metric_column(compression_metrics, 'Ratio', 'job_id_compression')
+        mse_low = self.read_metric_column(quick_look_metrics, 'MSE_Low', 'job_id')
+        mse_high = self.read_metric_column(quick_look_metrics, 'MSE_High', 'job_id')
+
+        configurations = {}
+        for job_index in range(len(self.config['jobs'])):
+            if self.uses_quick_look(job_index) and not self.is_redundant(job_index, file_pair_index, file_index):
+                quick_look_name = f"quick_look_{file_pair_index}_{job_index}_{file_index}"
+                configurations[job_index] = (ratios.get(f"compression_{file_pair_index}_{job_index}_{file_index}"),
+                                             mse_low.get(quick_look_name), mse_high.get(quick_look_name))
+
+        selected = near_pareto_front(configurations, self.config.get('pareto_tolerance', 0.0))
+        for job_index in sorted(configurations):
+            if job_index not in selected:
+                logging.info(f"Skipping exact error analysis of job {job_index}, dominated in the quick look")
+                continue
+            job_name = f"error_analysis_{file_pair_index}_{job_index}_{file_index}"
+            dependencies = self.get_dependencies(job_index, file_pair_index, file_index)
+            script_path = self.create_error_analysis_script(job_name, job_index, file_pair_index, file_index,
+                                                            dependencies)
+            self.submit_job(script_path)
+        return selected
+
     def submit_job(self, job_script_path):
-        submit_command = f"qsub {job_script_path}"
         try:
-            result = subprocess.run(submit_command, check=True, shell=True, capture_output=True, text=True)
-            job_id = result.stdout.strip().split('.')[0]  # Get the job ID from the output
+            job_id = self.executor.submit(job_script_path)
             logging.info(f"Job submitted: {job_script_path} with job ID: {job_id}")
             return job_id
         except subprocess.CalledProcessError as e:
             logging.error(f"Failed to submit job: {job_script_path}, Error: {e}")
             return None
 
-    def run_error_analysis(self):
-        # Step 1: Create CSV files for each input file
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for file_index in range(len(file_pair)):
-                self.create_error_analysis_metrics_csv(file_pair_index, file_index)
-
-        # Step 2: Generate and submit job scripts for error analysis
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for job_index in range(len(self.config['jobs'])):
-                for file_index in range(len(file_pair)):
-                    job_name = f"error_analysis_{file_pair_index}_{job_index}_{file_index}"
-                    prev_job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-                    dependencies = self.dependency_linker.get_dependencies(prev_job_name)
-                    script_path = self.create_error_analysis_script(job_name, job_index,
-                                                                    file_pair_index, file_index, dependencies)
-                    self.submit_job(script_path)
-
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    config_name = "../Jobs/bench.json"
-    error_analysis = ErrorAnalysis(config_name)
-    error_analysis.run_error_analysis()
+    # The error analysis alone, depending on the compression jobs of the configuration's last run
+    from workflow import run_seqbench
+    run_seqbench("../Jobs/bench.json", ['Analysis'])
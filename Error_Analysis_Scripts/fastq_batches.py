@@ -0,0 +1,32 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
+import fastq_metrics
+
+HEADER, BASES, SEPARATOR, QUALITY = range(4)
+
+
+def fastq_batches(fastq_file, batch_records=65536):
+    # Batches of records as NumPy arrays, see fastq_metrics.FastqBatchReader
+    return fastq_metrics.FastqBatchReader(fastq_file, batch_records)
+
+
+def field_bytes(batch, field):
+    """Concatenate one field of every record in a batch into a single uint8 array, without newlines."""
+    starts = batch['offsets'][:, field]
+    lengths = batch['lengths'][:, field]
+    # Each byte's index is its line start plus its position within the line
+    line_starts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return batch['data'][line_starts + np.arange(lengths.sum())]
+
+
+def field_matrix(batch, field):
+    """One field of every record as a (records, length) uint8 array, for reads of a fixed length."""
+    lengths = batch['lengths'][:, field]
+    if len(lengths) and (lengths != lengths[0]).any():
+        raise ValueError("The records of the batch have fields of different lengths")
+    width = int(lengths[0]) if len(lengths) else 0
+    return batch['data'][batch['offsets'][:, field, None] + np.arange(width)]
@@ -1,16 +1,30 @@
+#include <algorithm>
+#include <cerrno>
+#include <cstdint>
+#include <cstring>
+#include <exception>
 #include <iostream>
 #include <fstream>
 #include <vector>
 #include <cmath>
+#include <cstdio>
 #include <string>
 #include <thread>
 #include <mutex>
+#include <random>
+#include <unordered_map>
 #include <utility>
 #include <stdexcept>
+#include <memory>
+#include "fastq_fields.h"
+#include "fastq_io.h"
+#include "quality_kernel.h"
+#include <unistd.h>
 
 // Original functions
 std::vector<int> read_quality_scores(const std::string& filename) {
-    std::ifstream file(filename);
+    std::unique_ptr<std::istream> input = open_input_stream(filename);
+    std::istream& file = *input;
     std::vector<int> quality_scores;
     std::string line;
     int line_count = 0;
@@ -24,7 +38,6 @@ std::vector<int> read_quality_scores(const std::string& filename) {
         }
     }
 
-    file.close();
     return quality_scores;
 }
 
@@ -47,12 +60,11 @@ std::pair<double, double> calculate_mse_psnr(const std::vector<int>& original, c
 
 // v2 function
 std::pair<double, double> calculate_mse_psnr_v2(const std::string& original_filename, const std::string& decompressed_filename) {
-    std::ifstream original_file(original_filename);
-    std::ifstream decompressed_file(decompressed_filename);
-
-    if (!original_file.is_open() || !decompressed_file.is_open()) {
-        throw std::runtime_error("Failed to open one or both files");
-    }
+    // Plain, gzip and BGZF files are all read as streams
+    std::unique_ptr<std::istream> original_input = open_input_stream(original_filename);
+    std::unique_ptr<std::istream> decompressed_input = open_input_stream(decompressed_filename);
+    std::istream& original_file = *original_input;
+    std::istream& decompressed_file = *decompressed_input;
 
     std::string original_line, decompressed_line;
     int line_count = 0;
@@ -66,33 +78,27 @@ std::pair<double, double> calculate_mse_psnr_v2(const std::string& original_file
             if (original_line.length() != decompressed_line.length()) {
                 throw std::invalid_argument("The two files must have the same number of quality scores per record");
             }
-            for (size_t i = 0; i < original_line.length(); ++i) {
-                int original_score = static_cast<int>(original_line[i]) - 33;
-                int decompressed_score = static_cast<int>(decompressed_line[i]) - 33;
-                mse += std::pow(original_score - decompressed_score, 2);
-                score_count++;
-            }
+            // The vectorized kernel subtracts the characters directly, the +33 offsets cancel
+            mse += static_cast<double>(squared_difference_sum(original_line.data(), decompressed_line.data(),
+                                                              original_line.length()));
+            score_count += original_line.length();
         }
     }
 
     mse /= score_count;
     double psnr = mse == 0 ? std::numeric_limits<double>::infinity() : 10 * std::log10((max_i * max_i) / mse);
 
-    original_file.close();
-    decompressed_file.close();
-
     return {mse, psnr};
 }
 
 // Helper function for processing chunks
 void process_chunk(const std::string& original_filename, const std::string& decompressed_filename, size_t start_line, size_t end_line,
                    double& mse, size_t& score_count, std::mutex& mtx) {
-    std::ifstream original_file(original_filename);
-    std::ifstream decompressed_file(decompressed_filename);
-
-    if (!original_file.is_open() || !decompressed_file.is_open()) {
-        throw std::runtime_error("Failed to open one or both files");
-    }
+    // Plain, gzip and BGZF files are all read as streams
+    std::unique_ptr<std::istream> original_input = open_input_stream(original_filename);
+    std::unique_ptr<std::istream> decompressed_input = open_input_stream(decompressed_filename);
+    std::istream& original_file = *original_input;
+    std::istream& decompressed_file = *decompressed_input;
 
     std::string original_line, decompressed_line;
     size_t line_number = 0;
@@ -108,13 +114,10 @@ void process_chunk(const std::string& original_filename, const std::string& deco
             if (original_line.length() != decompressed_line.length()) {
                 throw std::invalid_argument("The two files must have the same number of quality scores per record");
             }
-            // Process each character in the quality score line
-            for (size_t i = 0; i < original_line.length(); ++i) {
-                int original_score = static_cast<int>(original_line[i]) - 33; // Convert ASCII to quality score
-                int decompressed_score = static_cast<int>(decompressed_line[i]) - 33; // Convert ASCII to quality score
-                local_mse += std::pow(original_score - decompressed_score, 2);
-                local_score_count++;
-            }
+            // Process the quality score line with the vectorized kernel
+            local_mse += static_cast<double>(squared_difference_sum(original_line.data(), decompressed_line.data(),
+                                                                    original_line.length()));
+            local_score_count += original_line.length();
         }
     }
 
@@ -126,11 +129,8 @@ void process_chunk(const std::string& original_filename, const std::string& deco
 
 // v3 function with multithreading support and correct chunk processing
 std::pair<double, double> calculate_mse_psnr_v3(const std::string& original_filename, const std::string& decompressed_filename, int threads) {
-    std::ifstream original_file(original_filename);
-
-    if (!original_file.is_open()) {
-        throw std::runtime_error("Failed to open the original file");
-    }
+    std::unique_ptr<std::istream> original_input = open_input_stream(original_filename);
+    std::istream& original_file = *original_input;
 
     size_t total_lines = 0;
     std::string line;
@@ -171,3 +171,1156 @@ std::pair<double, double> calculate_mse_psnr_v3(const std::string& original_file
 
     return {mse, psnr};
 }
+
+// v4 helpers, both files are memory mapped and split into record-aligned ranges
+
+// The four lines of a FASTQ record inside a mapped file, without their newlines
+struct RecordLines {
+    const char* begin[4];
+    const char* end[4];
+};
+
+const char* next_line(const char* pos, const char* end) {
+    const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+    return newline == nullptr ? end : newline + 1;
+}
+
+// Reads the record at pos into record and returns the start of the next one, or nullptr at the end of the range
+const char* read_record(const char* pos, const char* end, RecordLines& record) {
+    if (pos >= end) {
+        return nullptr;
+    }
+    for (int i = 0; i < 4; ++i) {
+        if (pos >= end) {
+            throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+        }
+        const char* newline = static_cast<const char*>(std::memchr(pos, '\n', end - pos));
+        record.begin[i] = pos;
+        record.end[i] = newline == nullptr ? end : newline;
+        pos = newline == nullptr ? end : newline + 1;
+    }
+    return pos;
+}
+
+std::uint64_t count_lines(const char* begin, const char* end) {
+    std::uint64_t lines = static_cast<std::uint64_t>(std::count(begin, end, '\n'));
+    if (begin < end && end[-1] != '\n') {
+        lines++;
+    }
+    return lines;
+}
+
+// Record starts splitting a mapped file into parts of similar byte size
+std::vector<const char*> split_at_records(const MappedFile& file, int parts) {
+    std::vector<const char*> bounds{file.begin()};
+    for (int i = 1; i < parts; ++i) {
+        const char* pos = file.begin() + file.size() / parts * i;
+        bounds.push_back(std::max(find_record_start(file.begin(), pos, file.end()), bounds.back()));
+    }
+    bounds.push_back(file.end());
+    return bounds;
+}
+
+// Runs task(0) .. task(threads - 1) on their own threads and rethrows the first failure
+template <typename Task>
+void run_threads(int threads, Task task) {
+    std::vector<std::thread> thread_pool;
+    std::vector<std::exception_ptr> errors(threads);
+    for (int i = 0; i < threads; ++i) {
+        thread_pool.emplace_back([&, i]() {
+            try {
+                task(i);
+            } catch (...) {
+                errors[i] = std::current_exception();
+            }
+        });
+    }
+    for (auto& t : thread_pool) {
+        t.join();
+    }
+    for (auto& error : errors) {
+        if (error) {
+            std::rethrow_exception(error);
+        }
+    }
+}
+
+bool is_mappable(const std::string& filename) {
+    return is_regular_file(filename) && !is_gzip_file(filename);
+}
+
+// Both files split into one range per thread at record starts, with the line number each range starts at
+struct RecordRanges {
+    std::vector<const char*> original_bounds;
+    std::vector<const char*> decompressed_bounds;
+    // Entry i is the first line of range i, the last entry is the file's line count
+    std::vector<std::uint64_t> original_lines;
+    std::vector<std::uint64_t> decompressed_lines;
+
+    int ranges() const { return static_cast<int>(original_bounds.size()) - 1; }
+    std::uint64_t original_total() const { return original_lines.back(); }
+    std::uint64_t decompressed_total() const { return decompressed_lines.back(); }
+};
+
+RecordRanges split_record_ranges(const MappedFile& original, const MappedFile& decompressed, int threads) {
+    threads = std::max(threads, 1);
+    RecordRanges ranges;
+    ranges.original_bounds = split_at_records(original, threads);
+    ranges.decompressed_bounds = split_at_records(decompressed, threads);
+    ranges.original_lines.assign(threads + 1, 0);
+    ranges.decompressed_lines.assign(threads + 1, 0);
+    run_threads(threads, [&](int i) {
+        ranges.original_lines[i + 1] = count_lines(ranges.original_bounds[i], ranges.original_bounds[i + 1]);
+        ranges.decompressed_lines[i + 1] = count_lines(ranges.decompressed_bounds[i], ranges.decompressed_bounds[i + 1]);
+    });
+    for (int i = 0; i < threads; ++i) {
+        ranges.original_lines[i + 1] += ranges.original_lines[i];
+        ranges.decompressed_lines[i + 1] += ranges.decompressed_lines[i];
+    }
+    return ranges;
+}
+
+// Calls visit(partial, record, original_record, decompressed_record) for the first `lines` lines worth of record
+// pairs, record being the index of the pair. The original file's ranges are the units of work, each thread finds
+// its first record in the decompressed file from the range line counts, so the two files may differ in header
+// and base lengths. Each thread fills its own Partial, which the caller merges.
+template <typename Partial, typename Visit>
+std::vector<Partial> reduce_record_pairs(const MappedFile& original, const MappedFile& decompressed,
+                                         const RecordRanges& ranges, std::uint64_t lines, Visit visit) {
+    const std::vector<std::uint64_t>& decompressed_lines = ranges.decompressed_lines;
+    std::vector<Partial> partials(ranges.ranges());
+    run_threads(ranges.ranges(), [&](int i) {
+        // Skip from the start of the decompressed range holding this range's first line
+        std::uint64_t first_line = std::min(ranges.original_lines[i], lines);
+        std::uint64_t last_line = std::min(ranges.original_lines[i + 1], lines);
+        int j = static_cast<int>(std::upper_bound(decompressed_lines.begin(), decompressed_lines.end() - 1,
+                                                  first_line) - decompressed_lines.begin()) - 1;
+        const char* decompressed_pos = ranges.decompressed_bounds[j];
+        for (std::uint64_t line = decompressed_lines[j]; line < first_line; ++line) {
+            decompressed_pos = next_line(decompressed_pos, decompressed.end());
+        }
+
+        Partial partial;
+        RecordLines original_record, decompressed_record;
+        const char* original_pos = ranges.original_bounds[i];
+        for (std::uint64_t line = first_line; line < last_line; line += 4) {
+            original_pos = read_record(original_pos, ranges.original_bounds[i + 1], original_record);
+            decompressed_pos = read_record(decompressed_pos, decompressed.end(), decompressed_record);
+            visit(partial, line / 4, original_record, decompressed_record);
+        }
+        partials[i] = partial;
+    });
+    return partials;
+}
+
+// Visits every record pair of two files that must hold the same number of whole records
+template <typename Partial, typename Visit>
+std::vector<Partial> reduce_record_pairs(const MappedFile& original, const MappedFile& decompressed, int threads,
+                                         Visit visit) {
+    RecordRanges ranges = split_record_ranges(original, decompressed, threads);
+    if (ranges.original_total() % 4 != 0 || ranges.decompressed_total() % 4 != 0) {
+        throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+    }
+    if (ranges.original_total() != ranges.decompressed_total()) {
+        throw std::invalid_argument("The two files must have the same number of records");
+    }
+    return reduce_record_pairs<Partial>(original, decompressed, ranges, ranges.original_total(), visit);
+}
+
+struct SquaredErrorSum {
+    std::uint64_t squared_error = 0;
+    std::uint64_t score_count = 0;
+};
+
+// v4 function, a single pass over memory-mapped files with per-thread sums
+std::pair<double, double> calculate_mse_psnr_v4(const std::string& original_filename, const std::string& decompressed_filename, int threads) {
+    // Compressed or piped files can't be mapped and are read as a single stream
+    if (!is_mappable(original_filename) || !is_mappable(decompressed_filename)) {
+        return calculate_mse_psnr_v2(original_filename, decompressed_filename);
+    }
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+
+    std::vector<SquaredErrorSum> partials = reduce_record_pairs<SquaredErrorSum>(
+            original, decompressed, threads,
+            [](SquaredErrorSum& sum, std::uint64_t, const RecordLines& original_record, const RecordLines& decompressed_record) {
+                const char* original_line = original_record.begin[3];
+                const char* decompressed_line = decompressed_record.begin[3];
+                std::size_t length = original_record.end[3] - original_line;
+                if (length != static_cast<std::size_t>(decompressed_record.end[3] - decompressed_line)) {
+                    throw std::invalid_argument("The two files must have the same number of quality scores per record");
+                }
+                sum.squared_error += squared_difference_sum(original_line, decompressed_line, length);
+                sum.score_count += length;
+            });
+
+    std::uint64_t squared_error = 0;
+    std::uint64_t score_count = 0;
+    for (const SquaredErrorSum& partial : partials) {
+        squared_error += partial.squared_error;
+        score_count += partial.score_count;
+    }
+
+    double mse = static_cast<double>(squared_error) / score_count;
+    double max_i = 40.0;
+    double psnr = mse == 0 ? std::numeric_limits<double>::infinity() : 10 * std::log10((max_i * max_i) / mse);
+
+    return {mse, psnr};
+}
+
+// Phred values 0 to 93, written as the characters '!' to '~'
+const int phred_values = 94;
+
+// Counts of (original, decompressed) phred value pairs plus error sums per read position.
+// Every error metric can be derived from it without another pass over the files.
+struct QualityHistogram {
+    std::vector<std::uint64_t> joint = std::vector<std::uint64_t>(phred_values * phred_values, 0);
+    std::vector<std::uint64_t> position_count;
+    std::vector<std::uint64_t> position_squared_error;
+    std::vector<std::uint64_t> position_absolute_error;
+
+    // Counts phred pairs of a stream without record structure, the position sums are left alone
+    void add_scores(const char* original, const char* decompressed, std::size_t length) {
+        for (std::size_t i = 0; i < length; ++i) {
+            unsigned original_score = static_cast<unsigned char>(original[i]) - 33u;
+            unsigned decompressed_score = static_cast<unsigned char>(decompressed[i]) - 33u;
+            if (original_score >= phred_values || decompressed_score >= phred_values) {
+                throw std::invalid_argument("Quality characters must lie between '!' and '~'");
+            }
+            joint[original_score * phred_values + decompressed_score]++;
+        }
+    }
+
+    void add(const char* original, const char* decompressed, std::size_t length) {
+        if (position_count.size() < length) {
+            position_count.resize(length, 0);
+            position_squared_error.resize(length, 0);
+            position_absolute_error.resize(length, 0);
+        }
+        for (std::size_t i = 0; i < length; ++i) {
+            unsigned original_score = static_cast<unsigned char>(original[i]) - 33u;
+            unsigned decompressed_score = static_cast<unsigned char>(decompressed[i]) - 33u;
+            if (original_score >= phred_values || decompressed_score >= phred_values) {
+                throw std::invalid_argument("Quality characters must lie between '!' and '~'");
+            }
+            joint[original_score * phred_values + decompressed_score]++;
+            int difference = static_cast<int>(original_score) - static_cast<int>(decompressed_score);
+            position_count[i]++;
+            position_squared_error[i] += static_cast<std::uint64_t>(difference * difference);
+            position_absolute_error[i] += static_cast<std::uint64_t>(std::abs(difference));
+        }
+    }
+
+    void merge(const QualityHistogram& other) {
+        for (std::size_t i = 0; i < joint.size(); ++i) {
+            joint[i] += other.joint[i];
+        }
+        if (position_count.size() < other.position_count.size()) {
+            position_count.resize(other.position_count.size(), 0);
+            position_squared_error.resize(other.position_count.size(), 0);
+            position_absolute_error.resize(other.position_count.size(), 0);
+        }
+        for (std::size_t i = 0; i < other.position_count.size(); ++i) {
+            position_count[i] += other.position_count[i];
+            position_squared_error[i] += other.position_squared_error[i];
+            position_absolute_error[i] += other.position_absolute_error[i];
+        }
+    }
+};
+
+// Length of a quality line without the '\r' of a CRLF file
+std::size_t quality_length(const char* begin, const char* end) {
+    return end > begin && end[-1] == '\r' ? end - begin - 1 : end - begin;
+}
+
+void add_quality_lines(QualityHistogram& histogram, const char* original, std::size_t original_length,
+                       const char* decompressed, std::size_t decompressed_length) {
+    if (original_length != decompressed_length) {
+        throw std::invalid_argument("The two files must have the same number of quality scores per record");
+    }
+    histogram.add(original, decompressed, original_length);
+}
+
+// Builds the joint histogram in one pass, gzip and piped inputs are read as streams on one thread
+QualityHistogram calculate_quality_histogram(const std::string& original_filename, const std::string& decompressed_filename, int threads) {
+    QualityHistogram histogram;
+    if (!is_mappable(original_filename) || !is_mappable(decompressed_filename)) {
+        std::unique_ptr<std::istream> original_input = open_input_stream(original_filename);
+        std::unique_ptr<std::istream> decompressed_input = open_input_stream(decompressed_filename);
+        std::string original_line, decompressed_line;
+        int line_count = 0;
+        while (std::getline(*original_input, original_line) && std::getline(*decompressed_input, decompressed_line)) {
+            line_count++;
+            if (line_count % 4 == 0) {
+                add_quality_lines(histogram, original_line.data(),
+                                  quality_length(original_line.data(), original_line.data() + original_line.size()),
+                                  decompressed_line.data(),
+                                  quality_length(decompressed_line.data(), decompressed_line.data() + decompressed_line.size()));
+            }
+        }
+        return histogram;
+    }
+
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+    std::vector<QualityHistogram> partials = reduce_record_pairs<QualityHistogram>(
+            original, decompressed, threads,
+            [](QualityHistogram& partial, std::uint64_t, const RecordLines& original_record, const RecordLines& decompressed_record) {
+                add_quality_lines(partial, original_record.begin[3],
+                                  quality_length(original_record.begin[3], original_record.end[3]),
+                                  decompressed_record.begin[3],
+                                  quality_length(decompressed_record.begin[3], decompressed_record.end[3]));
+            });
+    for (const QualityHistogram& partial : partials) {
+        histogram.merge(partial);
+    }
+    return histogram;
+}
+
+// Incremental histogram of a decompressed FASTQ that arrives in pieces, such as a decompressor's output teed
+// into a pipe. Each complete decompressed record is paired with the next record of the original file, which
+// is read as a stream, so neither file has to be complete on disk.
+class QualityStreamAnalysis {
+public:
+    explicit QualityStreamAnalysis(const std::string& original_filename)
+        : original_(open_input_stream(original_filename)) {}
+
+    // Feeds the next bytes of the decompressed stream, records may be split anywhere
+    void update(const char* data, std::size_t length) {
+        pending_.append(data, length);
+        std::size_t pos = 0;
+        while (true) {
+            std::size_t newline = pending_.find('\n', pos);
+            if (newline == std::string::npos) {
+                break;
+            }
+            add_line(pending_.data() + pos, pending_.data() + newline);
+            pos = newline + 1;
+        }
+        pending_.erase(0, pos);
+    }
+
+    // Reads the decompressed stream from a file descriptor, a pipe or stdin, until its end
+    void read_fd(int fd) {
+        std::vector<char> buffer(1 << 20);
+        while (true) {
+            ssize_t count = ::read(fd, buffer.data(), buffer.size());
+            if (count < 0 && errno == EINTR) {
+                continue;
+            }
+            if (count < 0) {
+                throw std::runtime_error("Failed to read the decompressed stream: " + std::string(std::strerror(errno)));
+            }
+            if (count == 0) {
+                break;
+            }
+            update(buffer.data(), static_cast<std::size_t>(count));
+        }
+    }
+
+    // Checks that both files ended on the same whole record, once the stream is exhausted
+    void finish() {
+        if (!pending_.empty()) {
+            // The last line had no newline
+            add_line(pending_.data(), pending_.data() + pending_.size());
+            pending_.clear();
+        }
+        if (line_ != 0) {
+            throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+        }
+        std::string line;
+        if (std::getline(*original_, line)) {
+            throw std::invalid_argument("The two files must have the same number of records");
+        }
+    }
+
+    const QualityHistogram& histogram() const { return histogram_; }
+    std::uint64_t records() const { return records_; }
+
+private:
+    void add_line(const char* begin, const char* end) {
+        if (++line_ < 4) {
+            return;
+        }
+        line_ = 0;
+        for (int i = 0; i < 4; ++i) {
+            if (!std::getline(*original_, original_line_)) {
+                throw std::invalid_argument("The two files must have the same number of records");
+            }
+        }
+        const char* original_begin = original_line_.data();
+        add_quality_lines(histogram_, original_begin, quality_length(original_begin, original_begin + original_line_.size()),
+                          begin, quality_length(begin, end));
+        records_++;
+    }
+
+    std::unique_ptr<std::istream> original_;
+    // Decompressed bytes after the last complete line
+    std::string pending_;
+    std::string original_line_;
+    // Lines of the current decompressed record seen so far
+    int line_ = 0;
+    std::uint64_t records_ = 0;
+    QualityHistogram histogram_;
+};
+
+// Record fields in file order, the '+' separator line included
+const int record_fields = 4;
+
+struct RecordDifference {
+    std::uint64_t record;
+    // Bit i set when field i differs
+    unsigned fields;
+};
+
+// Outcome of a lossless round trip check
+struct LosslessReport {
+    bool exact = true;
+    std::uint64_t original_records = 0;
+    std::uint64_t decompressed_records = 0;
+    // Number of records whose header, bases, separator or quality line differs
+    std::uint64_t field_differences[record_fields] = {0, 0, 0, 0};
+    // The first differing records in file order
+    std::vector<RecordDifference> first_differences;
+};
+
+void compare_record(LosslessReport& report, std::uint64_t record, const RecordLines& original_record,
+                    const RecordLines& decompressed_record, std::size_t max_differences) {
+    unsigned fields = 0;
+    for (int i = 0; i < record_fields; ++i) {
+        std::size_t length = original_record.end[i] - original_record.begin[i];
+        if (length != static_cast<std::size_t>(decompressed_record.end[i] - decompressed_record.begin[i]) ||
+            std::memcmp(original_record.begin[i], decompressed_record.begin[i], length) != 0) {
+            fields |= 1u << i;
+            report.field_differences[i]++;
+        }
+    }
+    if (fields != 0) {
+        report.exact = false;
+        if (report.first_differences.size() < max_differences) {
+            report.first_differences.push_back({record, fields});
+        }
+    }
+}
+
+// True if the two mapped files hold the same bytes, compared in one block per thread
+bool identical_bytes(const MappedFile& original, const MappedFile& decompressed, int threads) {
+    if (original.size() != decompressed.size()) {
+        return false;
+    }
+    threads = std::max(threads, 1);
+    std::vector<char> equal(threads, 1);
+    run_threads(threads, [&](int i) {
+        std::size_t begin = original.size() / threads * i;
+        std::size_t end = i + 1 == threads ? original.size() : original.size() / threads * (i + 1);
+        equal[i] = std::memcmp(original.begin() + begin, decompressed.begin() + begin, end - begin) == 0;
+    });
+    return std::all_of(equal.begin(), equal.end(), [](char block_equal) { return block_equal != 0; });
+}
+
+// Checks that decompressed reproduces original record for record. Identical files are confirmed by a parallel
+// byte comparison, otherwise every record pair is compared field by field to find what differs.
+LosslessReport verify_lossless(const std::string& original_filename, const std::string& decompressed_filename,
+                               int threads, std::size_t max_differences = 10) {
+    LosslessReport report;
+    if (!is_mappable(original_filename) || !is_mappable(decompressed_filename)) {
+        // Compressed or piped files are compared as streams on one thread
+        std::unique_ptr<std::istream> original_input = open_input_stream(original_filename);
+        std::unique_ptr<std::istream> decompressed_input = open_input_stream(decompressed_filename);
+        std::string original_lines[record_fields], decompressed_lines[record_fields];
+        RecordLines original_record, decompressed_record;
+        while (true) {
+            int original_read = 0, decompressed_read = 0;
+            while (original_read < record_fields && std::getline(*original_input, original_lines[original_read])) {
+                original_read++;
+            }
+            while (decompressed_read < record_fields &&
+                   std::getline(*decompressed_input, decompressed_lines[decompressed_read])) {
+                decompressed_read++;
+            }
+            report.original_records += original_read == record_fields;
+            report.decompressed_records += decompressed_read == record_fields;
+            if (original_read < record_fields || decompressed_read < record_fields) {
+                break;
+            }
+            for (int i = 0; i < record_fields; ++i) {
+                original_record.begin[i] = original_lines[i].data();
+                original_record.end[i] = original_lines[i].data() + original_lines[i].size();
+                decompressed_record.begin[i] = decompressed_lines[i].data();
+                decompressed_record.end[i] = decompressed_lines[i].data() + decompressed_lines[i].size();
+            }
+            compare_record(report, report.original_records - 1, original_record, decompressed_record, max_differences);
+        }
+        // Count whatever records remain in the longer file
+        std::string line;
+        std::uint64_t original_tail = 0, decompressed_tail = 0;
+        while (std::getline(*original_input, line)) {
+            original_tail++;
+        }
+        while (std::getline(*decompressed_input, line)) {
+            decompressed_tail++;
+        }
+        report.original_records += original_tail / record_fields;
+        report.decompressed_records += decompressed_tail / record_fields;
+        report.exact = report.exact && report.original_records == report.decompressed_records &&
+                       original_tail == decompressed_tail;
+        return report;
+    }
+
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+    RecordRanges ranges = split_record_ranges(original, decompressed, threads);
+    report.original_records = ranges.original_total() / record_fields;
+    report.decompressed_records = ranges.decompressed_total() / record_fields;
+    if (identical_bytes(original, decompressed, threads)) {
+        return report;
+    }
+
+    // Records both files have are compared, any further records of the longer file count as a difference
+    std::uint64_t common_records = std::min(report.original_records, report.decompressed_records);
+    std::vector<LosslessReport> partials = reduce_record_pairs<LosslessReport>(
+            original, decompressed, ranges, common_records * record_fields,
+            [max_differences](LosslessReport& partial, std::uint64_t record, const RecordLines& original_record,
+                              const RecordLines& decompressed_record) {
+                compare_record(partial, record, original_record, decompressed_record, max_differences);
+            });
+    // The records are what has to round trip, so a missing final newline alone still counts as exact
+    report.exact = ranges.original_total() == ranges.decompressed_total() &&
+                   ranges.original_total() % record_fields == 0;
+    for (const LosslessReport& partial : partials) {
+        report.exact = report.exact && partial.exact;
+        for (int i = 0; i < record_fields; ++i) {
+            report.field_differences[i] += partial.field_differences[i];
+        }
+        for (const RecordDifference& difference : partial.first_differences) {
+            if (report.first_differences.size() < max_differences) {
+                report.first_differences.push_back(difference);
+            }
+        }
+    }
+    return report;
+}
+
+// Order-insensitive join, for compressors that reorder reads the records of both files are matched by read ID
+
+// Quality line of a record and the read ID it is joined on
+struct JoinEntry {
+    const char* id;
+    std::size_t id_length;
+    const char* quality;
+    std::size_t quality_length;
+};
+
+// The read ID is the header up to the first space or tab, without the leading '@'
+JoinEntry join_entry(const RecordLines& record) {
+    const char* id = record.begin[0] < record.end[0] && *record.begin[0] == '@' ? record.begin[0] + 1 : record.begin[0];
+    const char* id_end = id;
+    while (id_end < record.end[0] && *id_end != ' ' && *id_end != '\t' && *id_end != '\r') {
+        ++id_end;
+    }
+    return {id, static_cast<std::size_t>(id_end - id), record.begin[3], quality_length(record.begin[3], record.end[3])};
+}
+
+// FNV-1a, picks the partition and the hash map bucket of a read ID
+std::uint64_t hash_id(const char* id, std::size_t length) {
+    std::uint64_t hash = 14695981039346656037ull;
+    for (std::size_t i = 0; i < length; ++i) {
+        hash = (hash ^ static_cast<unsigned char>(id[i])) * 1099511628211ull;
+    }
+    return hash;
+}
+
+struct JoinKey {
+    const char* id;
+    std::size_t length;
+
+    bool operator==(const JoinKey& other) const {
+        return length == other.length && std::memcmp(id, other.id, length) == 0;
+    }
+};
+
+struct JoinKeyHash {
+    std::size_t operator()(const JoinKey& key) const {
+        return static_cast<std::size_t>(hash_id(key.id, key.length));
+    }
+};
+
+// The records of one file, bucketed by read ID hash. Records of a mapped file that fits the memory budget are
+// kept as pointers into the mapping, otherwise they are spilled to one file per partition and writer thread.
+class JoinPartitions {
+public:
+    JoinPartitions(int partitions, int writers, const std::string& spill_prefix, std::size_t spill_buffer_bytes)
+            : partitions_(partitions), writers_(writers), spill_prefix_(spill_prefix),
+              spill_buffer_bytes_(spill_buffer_bytes),
+              entries_(spill_prefix.empty() ? writers * partitions : 0),
+              pending_(spill_prefix.empty() ? 0 : writers * partitions),
+              pending_bytes_(writers, 0) {
+        // Spill files are appended to, so leftovers of an interrupted run are cleared first
+        for (int partition = 0; !spill_prefix_.empty() && partition < partitions_; ++partition) {
+            for (int writer = 0; writer < writers_; ++writer) {
+                spill_files_.push_back(spill_path(partition, writer));
+                std::remove(spill_files_.back().c_str());
+            }
+        }
+    }
+
+    ~JoinPartitions() {
+        for (const std::string& path : spill_files_) {
+            std::remove(path.c_str());
+        }
+    }
+
+    JoinPartitions(const JoinPartitions&) = delete;
+    JoinPartitions& operator=(const JoinPartitions&) = delete;
+
+    int partitions() const { return partitions_; }
+
+    // Each writer thread only touches its own buffers
+    void add(int writer, const JoinEntry& entry) {
+        int partition = static_cast<int>(hash_id(entry.id, entry.id_length) % partitions_);
+        if (spill_prefix_.empty()) {
+            entries_[writer * partitions_ + partition].push_back(entry);
+            return;
+        }
+        std::string& pending = pending_[writer * partitions_ + partition];
+        std::uint64_t lengths[2] = {entry.id_length, entry.quality_length};
+        pending.append(reinterpret_cast<const char*>(lengths), sizeof(lengths));
+        pending.append(entry.id, entry.id_length);
+        pending.append(entry.quality, entry.quality_length);
+        pending_bytes_[writer] += sizeof(lengths) + entry.id_length + entry.quality_length;
+        if (pending_bytes_[writer] >= spill_buffer_bytes_) {
+            flush(writer);
+        }
+    }
+
+    void flush(int writer) {
+        if (spill_prefix_.empty()) {
+            return;
+        }
+        for (int partition = 0; partition < partitions_; ++partition) {
+            std::string& pending = pending_[writer * partitions_ + partition];
+            if (pending.empty()) {
+                continue;
+            }
+            std::ofstream file(spill_path(partition, writer), std::ios::binary | std::ios::app);
+            file.write(pending.data(), pending.size());
+            if (!file) {
+                throw std::runtime_error("Unable to write join spill file: " + spill_path(partition, writer));
+            }
+            pending.clear();
+        }
+        pending_bytes_[writer] = 0;
+    }
+
+    // Collects the entries of a partition, spilled records are read into buffer and point into it
+    void load(int partition, std::string& buffer, std::vector<JoinEntry>& entries) const {
+        entries.clear();
+        if (spill_prefix_.empty()) {
+            for (int writer = 0; writer < writers_; ++writer) {
+                const std::vector<JoinEntry>& part = entries_[writer * partitions_ + partition];
+                entries.insert(entries.end(), part.begin(), part.end());
+            }
+            return;
+        }
+        buffer.clear();
+        for (int writer = 0; writer < writers_; ++writer) {
+            std::ifstream file(spill_path(partition, writer), std::ios::binary | std::ios::ate);
+            if (!file.is_open()) {
+                continue;
+            }
+            std::size_t size = static_cast<std::size_t>(file.tellg());
+            std::size_t offset = buffer.size();
+            buffer.resize(offset + size);
+            file.seekg(0);
+            file.read(&buffer[offset], size);
+        }
+        for (std::size_t pos = 0; pos < buffer.size();) {
+            std::uint64_t lengths[2];
+            std::memcpy(lengths, buffer.data() + pos, sizeof(lengths));
+            pos += sizeof(lengths);
+            entries.push_back({buffer.data() + pos, static_cast<std::size_t>(lengths[0]),
+                               buffer.data() + pos + lengths[0], static_cast<std::size_t>(lengths[1])});
+            pos += lengths[0] + lengths[1];
+        }
+    }
+
+private:
+    std::string spill_path(int partition, int writer) const {
+        return spill_prefix_ + "." + std::to_string(partition) + "." + std::to_string(writer);
+    }
+
+    int partitions_;
+    int writers_;
+    std::string spill_prefix_;
+    std::size_t spill_buffer_bytes_;
+    std::vector<std::vector<JoinEntry>> entries_;
+    std::vector<std::string> pending_;
+    std::vector<std::size_t> pending_bytes_;
+    std::vector<std::string> spill_files_;
+};
+
+const std::uint64_t max_join_partitions = 4096;
+
+// Splits the records of a file into partitions, a mapped file by one writer per thread, a stream by one writer
+void partition_records(const std::string& filename, const MappedFile* mapped, int threads, JoinPartitions& partitions) {
+    if (mapped == nullptr) {
+        std::unique_ptr<std::istream> input = open_input_stream(filename);
+        std::string lines[4];
+        RecordLines record;
+        while (std::getline(*input, lines[0])) {
+            for (int i = 1; i < 4; ++i) {
+                if (!std::getline(*input, lines[i])) {
+                    throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+                }
+            }
+            for (int i = 0; i < 4; ++i) {
+                record.begin[i] = lines[i].data();
+                record.end[i] = lines[i].data() + lines[i].size();
+            }
+            partitions.add(0, join_entry(record));
+        }
+        partitions.flush(0);
+        return;
+    }
+
+    std::vector<const char*> bounds = split_at_records(*mapped, threads);
+    run_threads(threads, [&](int i) {
+        RecordLines record;
+        const char* pos = bounds[i];
+        while ((pos = read_record(pos, bounds[i + 1], record)) != nullptr) {
+            partitions.add(i, join_entry(record));
+        }
+        partitions.flush(i);
+    });
+}
+
+// Same metrics as calculate_quality_histogram with records matched by read ID instead of by position. Both files
+// are hash partitioned on the read ID, then each thread joins whole partitions. When the files don't fit
+// memory_budget the partitions are spilled next to spill_prefix and joined a few at a time.
+QualityHistogram calculate_quality_histogram_by_id(const std::string& original_filename,
+                                                   const std::string& decompressed_filename, int threads,
+                                                   std::uint64_t memory_budget, std::string spill_prefix) {
+    threads = std::max(threads, 1);
+    if (spill_prefix.empty()) {
+        spill_prefix = decompressed_filename + ".join";
+    }
+    std::unique_ptr<MappedFile> original_mapped;
+    std::unique_ptr<MappedFile> decompressed_mapped;
+    if (is_mappable(original_filename)) {
+        original_mapped.reset(new MappedFile(original_filename));
+    }
+    if (is_mappable(decompressed_filename)) {
+        decompressed_mapped.reset(new MappedFile(decompressed_filename));
+    }
+
+    // Partitions are sized so the ones joined at the same time hold about half the budget
+    std::uint64_t input_bytes = input_size_hint(original_filename) + input_size_hint(decompressed_filename);
+    bool spill = input_bytes > memory_budget || !original_mapped || !decompressed_mapped;
+    std::uint64_t partition_bytes = std::max<std::uint64_t>(memory_budget / 2 / threads, 1);
+    // Each flush appends to every partition's file, so very small budgets are not followed below max_join_partitions
+    int partitions = static_cast<int>(std::max<std::uint64_t>(
+            threads, std::min<std::uint64_t>(spill ? input_bytes / partition_bytes + 1 : 0, max_join_partitions)));
+    std::size_t spill_buffer_bytes = static_cast<std::size_t>(std::max<std::uint64_t>(memory_budget / 4 / threads, 1));
+
+    int original_writers = original_mapped ? threads : 1;
+    int decompressed_writers = decompressed_mapped ? threads : 1;
+    JoinPartitions original_partitions(partitions, original_writers,
+                                       spill || !original_mapped ? spill_prefix + ".original" : "", spill_buffer_bytes);
+    JoinPartitions decompressed_partitions(partitions, decompressed_writers,
+                                           spill || !decompressed_mapped ? spill_prefix + ".decompressed" : "",
+                                           spill_buffer_bytes);
+    partition_records(original_filename, original_mapped.get(), original_writers, original_partitions);
+    partition_records(decompressed_filename, decompressed_mapped.get(), decompressed_writers, decompressed_partitions);
+
+    std::vector<QualityHistogram> partials(threads);
+    run_threads(threads, [&](int i) {
+        std::string original_buffer, decompressed_buffer;
+        std::vector<JoinEntry> original_entries, decompressed_entries;
+        std::unordered_map<JoinKey, const JoinEntry*, JoinKeyHash> by_id;
+        for (int partition = i; partition < partitions; partition += threads) {
+            original_partitions.load(partition, original_buffer, original_entries);
+            decompressed_partitions.load(partition, decompressed_buffer, decompressed_entries);
+            if (original_entries.size() != decompressed_entries.size()) {
+                throw std::invalid_argument("The two files must have the same read IDs");
+            }
+            by_id.clear();
+            by_id.reserve(original_entries.size());
+            for (const JoinEntry& entry : original_entries) {
+                if (!by_id.emplace(JoinKey{entry.id, entry.id_length}, &entry).second) {
+                    throw std::invalid_argument("Duplicate read ID in the original file: " +
+                                                std::string(entry.id, entry.id_length));
+                }
+            }
+            for (const JoinEntry& entry : decompressed_entries) {
+                auto match = by_id.find(JoinKey{entry.id, entry.id_length});
+                if (match == by_id.end()) {
+                    throw std::invalid_argument("Read ID missing from the original file: " +
+                                                std::string(entry.id, entry.id_length));
+                }
+                add_quality_lines(partials[i], match->second->quality, match->second->quality_length,
+                                  entry.quality, entry.quality_length);
+                // Each original record pairs with one decompressed record
+                by_id.erase(match);
+            }
+        }
+    });
+
+    QualityHistogram histogram;
+    for (const QualityHistogram& partial : partials) {
+        histogram.merge(partial);
+    }
+    return histogram;
+}
+
+// Binary quality streams, the splitter's _quality_scores.bin against the compressor's decompressed stream
+
+// Scores converted per block, small enough to stay in cache between the conversion and the count
+const std::size_t score_block = 64 * 1024;
+
+// The split wrote every phred score exactly, so the original stream converts back without rounding or clamping
+template <typename T>
+void original_scores_as(const char* data, std::size_t count, char* out) {
+    for (std::size_t i = 0; i < count; ++i) {
+        T score;
+        std::memcpy(&score, data + i * sizeof(T), sizeof(T));
+        int phred = static_cast<int>(score);
+        out[i] = static_cast<char>(phred < 0 || phred >= phred_values ? 0 : phred + 33);
+    }
+}
+
+void original_scores(const char* data, std::size_t count, QualityType type, char* out) {
+    switch (type) {
+        case QualityType::UInt8: original_scores_as<std::uint8_t>(data, count, out); break;
+        case QualityType::Int8: original_scores_as<std::int8_t>(data, count, out); break;
+        case QualityType::Int16: original_scores_as<std::int16_t>(data, count, out); break;
+        case QualityType::Int32: original_scores_as<std::int32_t>(data, count, out); break;
+        case QualityType::Float32: original_scores_as<float>(data, count, out); break;
+    }
+}
+
+// Histogram of count scores of two streams. The decompressed scores go through the reconstructor's rounding and
+// clamping, so the result matches comparing the reconstructed FASTQ with the original one.
+QualityHistogram quality_histogram_from_scores(const char* original, const char* decompressed, std::size_t count,
+                                               QualityType type, int threads) {
+    threads = std::max(threads, 1);
+    std::size_t element_size = quality_type_size(type);
+    std::vector<QualityHistogram> partials(threads);
+    run_threads(threads, [&](int i) {
+        std::size_t begin = count / threads * i;
+        std::size_t end = i + 1 == threads ? count : count / threads * (i + 1);
+        std::vector<char> original_block(score_block), decompressed_block(score_block);
+        for (std::size_t pos = begin; pos < end; pos += score_block) {
+            std::size_t length = std::min(score_block, end - pos);
+            original_scores(original + pos * element_size, length, type, original_block.data());
+            decode_quality_scores(decompressed + pos * element_size, length, type, decompressed_block.data());
+            partials[i].add_scores(original_block.data(), decompressed_block.data(), length);
+        }
+    });
+
+    QualityHistogram histogram;
+    for (const QualityHistogram& partial : partials) {
+        histogram.merge(partial);
+    }
+    return histogram;
+}
+
+// Memory maps both binary quality streams, no FASTQ has to be reconstructed or parsed
+QualityHistogram calculate_quality_histogram_binary(const std::string& original_filename,
+                                                    const std::string& decompressed_filename,
+                                                    const std::string& quality_dtype, int threads) {
+    QualityType type = parse_quality_type(quality_dtype);
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+    if (original.size() != decompressed.size() || original.size() % quality_type_size(type) != 0) {
+        throw std::invalid_argument("The two files must have the same number of quality scores");
+    }
+    return quality_histogram_from_scores(original.begin(), decompressed.begin(), original.size() / quality_type_size(type),
+                                         type, threads);
+}
+
+// Sampling estimates, a quick look at the error from a few thousand records instead of whole files
+
+struct QualityEstimate {
+    double mse = 0;
+    double mse_low = 0;
+    double mse_high = 0;
+    double psnr = 0;
+    double psnr_low = 0;
+    double psnr_high = 0;
+    std::uint64_t samples = 0;
+    std::uint64_t sampled_scores = 0;
+};
+
+// One sampled unit, its squared error and score count already divided by the unit's selection weight
+struct WeightedSample {
+    double squared_error = 0;
+    double score_count = 0;
+    std::uint64_t scores = 0;
+};
+
+// Two-sided standard normal quantile, found by bisection on erfc
+double normal_quantile(double confidence) {
+    if (!(confidence > 0 && confidence < 1)) {
+        throw std::invalid_argument("The confidence level must lie between 0 and 1");
+    }
+    double tail = (1 - confidence) / 2;
+    double low = 0, high = 40;
+    for (int i = 0; i < 100; ++i) {
+        double z = (low + high) / 2;
+        (0.5 * std::erfc(z / std::sqrt(2.0)) > tail ? low : high) = z;
+    }
+    return (low + high) / 2;
+}
+
+double psnr_of(double mse) {
+    double max_i = 40.0;
+    return mse <= 0 ? std::numeric_limits<double>::infinity() : 10 * std::log10((max_i * max_i) / mse);
+}
+
+// Ratio estimate of the MSE with a delta method confidence interval. Units are drawn with replacement and
+// probabilities proportional to their weights, so sum(squared_error) / sum(score_count) stays unbiased
+// for the file's MSE as the number of samples grows.
+QualityEstimate estimate_from_samples(const std::vector<WeightedSample>& samples, double confidence) {
+    QualityEstimate estimate;
+    double squared_error = 0, score_count = 0;
+    for (const WeightedSample& sample : samples) {
+        squared_error += sample.squared_error;
+        score_count += sample.score_count;
+        estimate.sampled_scores += sample.scores;
+    }
+    if (score_count == 0) {
+        throw std::invalid_argument("The sampled records hold no quality scores");
+    }
+    std::size_t n = samples.size();
+    estimate.samples = n;
+    estimate.mse = squared_error / score_count;
+
+    double half_width = 0;
+    if (n > 1) {
+        double residuals = 0;
+        for (const WeightedSample& sample : samples) {
+            double residual = sample.squared_error - estimate.mse * sample.score_count;
+            residuals += residual * residual;
+        }
+        double mean_count = score_count / n;
+        double variance = residuals / (n - 1) / n / (mean_count * mean_count);
+        half_width = normal_quantile(confidence) * std::sqrt(variance);
+    }
+    estimate.mse_low = std::max(estimate.mse - half_width, 0.0);
+    estimate.mse_high = estimate.mse + half_width;
+    // PSNR falls as the MSE rises, so the bounds swap
+    estimate.psnr = psnr_of(estimate.mse);
+    estimate.psnr_low = psnr_of(estimate.mse_high);
+    estimate.psnr_high = psnr_of(estimate.mse_low);
+    return estimate;
+}
+
+// Draws the sample positions up front from a single generator, so the estimate doesn't depend on the thread count
+std::vector<std::uint64_t> sample_positions(std::uint64_t range, std::size_t samples, std::uint64_t seed) {
+    std::mt19937_64 generator(seed);
+    std::uniform_int_distribution<std::uint64_t> position(0, range - 1);
+    std::vector<std::uint64_t> positions(samples);
+    for (std::uint64_t& pos : positions) {
+        pos = position(generator);
+    }
+    return positions;
+}
+
+// Start of the record holding pos. find_record_start only looks forward, so it searches from ever further back.
+const char* record_containing(const char* begin, const char* pos, const char* end) {
+    std::size_t window = 4096;
+    const char* start = end;
+    while (true) {
+        const char* from = static_cast<std::size_t>(pos - begin) > window ? pos - window : begin;
+        start = find_record_start(begin, from, end);
+        if (start <= pos) {
+            break;
+        }
+        if (from == begin) {
+            throw std::invalid_argument("The file must start with a FASTQ record");
+        }
+        window *= 2;
+    }
+    RecordLines record;
+    for (const char* next = read_record(start, end, record); next != nullptr && next <= pos;
+         next = read_record(start, end, record)) {
+        start = next;
+    }
+    return start;
+}
+
+// Samples records uniformly by byte offset, each record is picked with probability proportional to its length
+// and weighted back by it. The decompressed record is looked up at the same offset, which holds whenever the
+// compressor kept headers, bases and quality lengths, as SZ3's reconstruction and quality binning do.
+QualityEstimate estimate_mse_psnr(const std::string& original_filename, const std::string& decompressed_filename,
+                                  std::size_t samples, double confidence, std::uint64_t seed, int threads) {
+    if (!is_mappable(original_filename) || !is_mappable(decompressed_filename)) {
+        throw std::invalid_argument("Sampling needs plain files that can be memory mapped");
+    }
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+    if (original.size() != decompressed.size()) {
+        throw std::invalid_argument("Sampling needs the decompressed records at the same byte offsets as the original ones");
+    }
+    if (original.size() == 0 || samples == 0) {
+        throw std::invalid_argument("Sampling needs a non-empty file and at least one sample");
+    }
+
+    threads = std::max(threads, 1);
+    std::vector<std::uint64_t> offsets = sample_positions(original.size(), samples, seed);
+    std::vector<WeightedSample> weighted(samples);
+    run_threads(threads, [&](int t) {
+        RecordLines original_record, decompressed_record;
+        for (std::size_t i = samples / threads * t; i < (t + 1 == threads ? samples : samples / threads * (t + 1)); ++i) {
+            const char* start = record_containing(original.begin(), original.begin() + offsets[i], original.end());
+            const char* next = read_record(start, original.end(), original_record);
+            read_record(decompressed.begin() + (start - original.begin()), decompressed.end(), decompressed_record);
+            std::size_t header_length = original_record.end[0] - original_record.begin[0];
+            std::size_t length = quality_length(original_record.begin[3], original_record.end[3]);
+            if (static_cast<std::size_t>(decompressed_record.end[0] - decompressed_record.begin[0]) != header_length ||
+                std::memcmp(original_record.begin[0], decompressed_record.begin[0], header_length) != 0 ||
+                quality_length(decompressed_record.begin[3], decompressed_record.end[3]) != length) {
+                throw std::invalid_argument("Sampling needs the decompressed records at the same byte offsets as the original ones");
+            }
+            std::uint64_t squared_error = squared_difference_sum(original_record.begin[3], decompressed_record.begin[3], length);
+            double record_bytes = static_cast<double>(next - start);
+            weighted[i].squared_error = squared_error / record_bytes;
+            weighted[i].score_count = length / record_bytes;
+            weighted[i].scores = length;
+        }
+    });
+    return estimate_from_samples(weighted, confidence);
+}
+
+// Scores per sampled block of the binary streams
+const std::size_t estimate_block = 1024;
+
+// Samples whole blocks of the binary quality streams, every block equally likely
+QualityEstimate estimate_mse_psnr_binary(const std::string& original_filename, const std::string& decompressed_filename,
+                                         const std::string& quality_dtype, std::size_t samples, double confidence,
+                                         std::uint64_t seed, int threads) {
+    QualityType type = parse_quality_type(quality_dtype);
+    MappedFile original(original_filename);
+    MappedFile decompressed(decompressed_filename);
+    std::size_t element_size = quality_type_size(type);
+    if (original.size() != decompressed.size() || original.size() % element_size != 0) {
+        throw std::invalid_argument("The two files must have the same number of quality scores");
+    }
+    std::uint64_t count = original.size() / element_size;
+    if (count == 0 || samples == 0) {
+        throw std::invalid_argument("Sampling needs a non-empty file and at least one sample");
+    }
+
+    threads = std::max(threads, 1);
+    std::vector<std::uint64_t> blocks = sample_positions((count + estimate_block - 1) / estimate_block, samples, seed);
+    std::vector<WeightedSample> weighted(samples);
+    run_threads(threads, [&](int t) {
+        char original_block[estimate_block], decompressed_block[estimate_block];
+        for (std::size_t i = samples / threads * t; i < (t + 1 == threads ? samples : samples / threads * (t + 1)); ++i) {
+            std::uint64_t pos = blocks[i] * estimate_block;
+            std::size_t length = static_cast<std::size_t>(std::min<std::uint64_t>(estimate_block, count - pos));
+            original_scores(original.begin() + pos * element_size, length, type, original_block);
+            decode_quality_scores(decompressed.begin() + pos * element_size, length, type, decompressed_block);
+            weighted[i].squared_error = static_cast<double>(squared_difference_sum(original_block, decompressed_block, length));
+            weighted[i].score_count = static_cast<double>(length);
+            weighted[i].scores = length;
+        }
+    });
+    return estimate_from_samples(weighted, confidence);
+}
+
+// Record batches for vectorized analysis in Python, the bytes stay in the mapping
+
+// Records of a batch as line offsets into its bytes, which owner keeps alive
+struct FastqBatch {
+    const char* data = nullptr;
+    std::size_t size = 0;
+    std::uint64_t first_record = 0;
+    // Four entries per record, the start of each line relative to data and its length without the newline
+    std::vector<std::int64_t> offsets;
+    std::vector<std::int64_t> lengths;
+    std::shared_ptr<const void> owner;
+
+    std::size_t records() const { return offsets.size() / 4; }
+};
+
+// Splits a file into batches of whole records. Plain files are memory mapped and the batches point into the
+// mapping, gzip and piped files are read as streams into one buffer per batch.
+class FastqBatchReader {
+public:
+    FastqBatchReader(const std::string& filename, std::size_t batch_records)
+        : batch_records_(std::max<std::size_t>(batch_records, 1)) {
+        if (is_mappable(filename)) {
+            mapped_ = std::make_shared<MappedFile>(filename);
+            pos_ = mapped_->begin();
+        } else {
+            stream_ = open_input_stream(filename);
+        }
+    }
+
+    // Fills batch with the next records, false once the file is exhausted
+    bool next(FastqBatch& batch) {
+        batch = FastqBatch();
+        batch.first_record = records_;
+        if (mapped_) {
+            next_mapped(batch);
+        } else {
+            next_stream(batch);
+        }
+        records_ += batch.records();
+        return batch.records() > 0;
+    }
+
+private:
+    void add_line(FastqBatch& batch, const char* begin, const char* end) {
+        batch.offsets.push_back(begin - batch.data);
+        // A CRLF file's '\r' isn't part of the field
+        batch.lengths.push_back(end > begin && end[-1] == '\r' ? end - begin - 1 : end - begin);
+    }
+
+    void next_mapped(FastqBatch& batch) {
+        batch.data = pos_;
+        batch.owner = mapped_;
+        RecordLines record;
+        for (std::size_t i = 0; i < batch_records_; ++i) {
+            const char* next = read_record(pos_, mapped_->end(), record);
+            if (next == nullptr) {
+                break;
+            }
+            for (int line = 0; line < 4; ++line) {
+                add_line(batch, record.begin[line], record.end[line]);
+            }
+            pos_ = next;
+        }
+        batch.size = pos_ - batch.data;
+    }
+
+    void next_stream(FastqBatch& batch) {
+        std::shared_ptr<std::string> buffer = std::make_shared<std::string>();
+        std::vector<std::size_t> line_ends;
+        std::string line;
+        for (std::size_t i = 0; i < batch_records_ * 4 && std::getline(*stream_, line); ++i) {
+            buffer->append(line);
+            line_ends.push_back(buffer->size());
+            buffer->push_back('\n');
+        }
+        if (line_ends.size() % 4 != 0) {
+            throw std::invalid_argument("The total number of lines in the file must be a multiple of 4");
+        }
+        // Offsets are taken once the buffer has stopped growing
+        batch.data = buffer->data();
+        batch.size = buffer->size();
+        batch.owner = buffer;
+        std::size_t line_begin = 0;
+        for (std::size_t line_end : line_ends) {
+            add_line(batch, batch.data + line_begin, batch.data + line_end);
+            line_begin = line_end + 1;
+        }
+    }
+
+    std::size_t batch_records_;
+    std::uint64_t records_ = 0;
+    std::shared_ptr<MappedFile> mapped_;
+    const char* pos_ = nullptr;
+    std::unique_ptr<std::istream> stream_;
+};
@@ -1,13 +1,179 @@
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 #include <pybind11/stl.h>
 #include "fastq_metrics.cpp"
 
 namespace py = pybind11;
 
+// Copies the histogram into NumPy arrays, the joint counts indexed [original phred, decompressed phred]
+py::dict quality_histogram_to_dict(const QualityHistogram& histogram) {
+    py::array_t<std::uint64_t> joint({phred_values, phred_values});
+    std::copy(histogram.joint.begin(), histogram.joint.end(), joint.mutable_data());
+    py::dict result;
+    result["joint"] = joint;
+    result["position_count"] = py::array_t<std::uint64_t>(histogram.position_count.size(), histogram.position_count.data());
+    result["position_squared_error"] = py::array_t<std::uint64_t>(histogram.position_squared_error.size(), histogram.position_squared_error.data());
+    result["position_absolute_error"] = py::array_t<std::uint64_t>(histogram.position_absolute_error.size(), histogram.position_absolute_error.data());
+    return result;
+}
+
+py::dict lossless_report_to_dict(const LosslessReport& report) {
+    const char* field_names[record_fields] = {"header", "bases", "separator", "quality"};
+    py::dict field_differences;
+    for (int i = 0; i < record_fields; ++i) {
+        field_differences[field_names[i]] = report.field_differences[i];
+    }
+    py::list first_differences;
+    for (const RecordDifference& difference : report.first_differences) {
+        py::list fields;
+        for (int i = 0; i < record_fields; ++i) {
+            if (difference.fields & (1u << i)) {
+                fields.append(field_names[i]);
+            }
+        }
+        py::dict entry;
+        entry["record"] = difference.record;
+        entry["fields"] = fields;
+        first_differences.append(entry);
+    }
+    py::dict result;
+    result["exact"] = report.exact;
+    result["original_records"] = report.original_records;
+    result["decompressed_records"] = report.decompressed_records;
+    result["field_differences"] = field_differences;
+    result["first_differences"] = first_differences;
+    return result;
+}
+
+py::dict calculate_quality_histogram_by_id_dict(const std::string& original_filename, const std::string& decompressed_filename, int threads, std::uint64_t memory_budget, const std::string& spill_prefix) {
+    return quality_histogram_to_dict(calculate_quality_histogram_by_id(original_filename, decompressed_filename, threads, memory_budget, spill_prefix));
+}
+
+py::dict quality_estimate_to_dict(const QualityEstimate& estimate) {
+    py::dict result;
+    result["mse"] = estimate.mse;
+    result["mse_low"] = estimate.mse_low;
+    result["mse_high"] = estimate.mse_high;
+    result["psnr"] = estimate.psnr;
+    result["psnr_low"] = estimate.psnr_low;
+    result["psnr_high"] = estimate.psnr_high;
+    result["samples"] = estimate.samples;
+    result["sampled_scores"] = estimate.sampled_scores;
+    return result;
+}
+
+// Squared difference sum of two byte buffers with a named kernel, used by the microbenchmark
+std::uint64_t squared_difference_sum_buffers(const py::buffer& original, const py::buffer& decompressed, const std::string& kernel) {
+    py::buffer_info original_info = original.request();
+    py::buffer_info decompressed_info = decompressed.request();
+    std::size_t length = static_cast<std::size_t>(original_info.size * original_info.itemsize);
+    if (length != static_cast<std::size_t>(decompressed_info.size * decompressed_info.itemsize)) {
+        throw std::invalid_argument("The two buffers must have the same length");
+    }
+    SquaredDifferenceKernel function = quality_kernel(kernel);
+    py::gil_scoped_release release;
+    return function(static_cast<const char*>(original_info.ptr), static_cast<const char*>(decompressed_info.ptr), length);
+}
+
+// A batch as NumPy arrays. data is a read-only view of the batch's bytes, the capsule keeps the mapping or
+// buffer behind it alive for as long as the array is referenced.
+py::dict fastq_batch_to_dict(const FastqBatch& batch) {
+    py::capsule owner(new std::shared_ptr<const void>(batch.owner), [](void* owner) {
+        delete static_cast<std::shared_ptr<const void>*>(owner);
+    });
+    py::array_t<std::uint8_t> data(batch.size, reinterpret_cast<const std::uint8_t*>(batch.data), owner);
+    data.attr("flags").attr("writeable") = false;
+    py::ssize_t records = static_cast<py::ssize_t>(batch.records());
+    py::array_t<std::int64_t> offsets({records, static_cast<py::ssize_t>(4)});
+    py::array_t<std::int64_t> lengths({records, static_cast<py::ssize_t>(4)});
+    std::copy(batch.offsets.begin(), batch.offsets.end(), offsets.mutable_data());
+    std::copy(batch.lengths.begin(), batch.lengths.end(), lengths.mutable_data());
+    py::dict result;
+    result["data"] = data;
+    result["offsets"] = offsets;
+    result["lengths"] = lengths;
+    result["first_record"] = batch.first_record;
+    result["records"] = batch.records();
+    return result;
+}
+
+// Quality stream type of a NumPy array, the arrays are read in place without a copy
+QualityType array_quality_type(const py::array& scores) {
+    if (!(scores.flags() & py::array::c_style)) {
+        throw std::invalid_argument("Quality score arrays must be C-contiguous");
+    }
+    if (scores.dtype().is(py::dtype::of<std::uint8_t>())) return QualityType::UInt8;
+    if (scores.dtype().is(py::dtype::of<std::int8_t>())) return QualityType::Int8;
+    if (scores.dtype().is(py::dtype::of<std::int16_t>())) return QualityType::Int16;
+    if (scores.dtype().is(py::dtype::of<std::int32_t>())) return QualityType::Int32;
+    if (scores.dtype().is(py::dtype::of<float>())) return QualityType::Float32;
+    throw std::invalid_argument("Unsupported quality score array type: " + std::string(py::str(scores.dtype())));
+}
+
+py::dict calculate_quality_histogram_arrays(const py::array& original, const py::array& decompressed, int threads) {
+    QualityType type = array_quality_type(original);
+    if (array_quality_type(decompressed) != type) {
+        throw std::invalid_argument("The two quality score arrays must have the same type");
+    }
+    if (original.size() != decompressed.size()) {
+        throw std::invalid_argument("The two files must have the same number of quality scores");
+    }
+    return quality_histogram_to_dict(quality_histogram_from_scores(static_cast<const char*>(original.data()), static_cast<const char*>(decompressed.data()), original.size(), type, threads));
+}
+
 PYBIND11_MODULE(fastq_metrics, m
 ) {
 m.def("read_quality_scores", &read_quality_scores, "Read quality scores from a FastQ file");
 m.def("calculate_mse_psnr", &calculate_mse_psnr, "Calculate Mean Squared Error (MSE) and Peak Signal-to-Noise Ratio (PSNR)");
 m.def("calculate_mse_psnr_v2", &calculate_mse_psnr_v2, "Calculate MSE and PSNR directly from files without loading all quality scores into memory");
 m.def("calculate_mse_psnr_v3", &calculate_mse_psnr_v3, "Calculate MSE and PSNR directly from files without loading all quality scores into memory, with multithreading support", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("threads"));
+m.def("calculate_mse_psnr_v4", &calculate_mse_psnr_v4, "Calculate MSE and PSNR in a single pass over memory-mapped files, split at record boundaries across threads", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("threads"));
+m.def("calculate_quality_histogram", [](const std::string& original_filename, const std::string& decompressed_filename, int threads) {
+    return quality_histogram_to_dict(calculate_quality_histogram(original_filename, decompressed_filename, threads));
+}, "Count (original, decompressed) phred pairs into a 94x94 joint histogram plus per-position error sums in one pass", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("threads"));
+m.def("verify_lossless", [](const std::string& original_filename, const std::string& decompressed_filename, int threads, std::size_t max_differences) {
+    return lossless_report_to_dict(verify_lossless(original_filename, decompressed_filename, threads, max_differences));
+}, "Check that a lossless round trip reproduced every record, reporting which fields differ and the first differing records", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("threads"), py::arg("max_differences") = 10);
+m.def("calculate_quality_histogram_by_id", &calculate_quality_histogram_by_id_dict, "Build the joint quality histogram with records matched by read ID, for compressors that reorder reads; partitions are spilled to disk beyond memory_budget bytes", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("threads"), py::arg("memory_budget") = static_cast<std::uint64_t>(4) * 1024 * 1024 * 1024, py::arg("spill_prefix") = "");
+m.def("calculate_quality_histogram_binary", [](const std::string& original_filename, const std::string& decompressed_filename, const std::string& quality_dtype, int threads) {
+    return quality_histogram_to_dict(calculate_quality_histogram_binary(original_filename, decompressed_filename, quality_dtype, threads));
+}, "Build the joint quality histogram from the split's binary quality stream and the compressor's decompressed stream, both memory-mapped", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("quality_dtype") = "float32", py::arg("threads") = 1);
+m.def("calculate_quality_histogram_arrays", &calculate_quality_histogram_arrays, "Build the joint quality histogram from two NumPy quality score arrays without copying them", py::arg("original"), py::arg("decompressed"), py::arg("threads") = 1);
+m.def("estimate_mse_psnr", [](const std::string& original_filename, const std::string& decompressed_filename, std::size_t samples, double confidence, std::uint64_t seed, int threads) {
+    return quality_estimate_to_dict(estimate_mse_psnr(original_filename, decompressed_filename, samples, confidence, seed, threads));
+}, "Estimate MSE and PSNR with a confidence interval from records sampled uniformly by byte offset", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("samples") = 10000, py::arg("confidence") = 0.95, py::arg("seed") = 0, py::arg("threads") = 1);
+m.def("estimate_mse_psnr_binary", [](const std::string& original_filename, const std::string& decompressed_filename, const std::string& quality_dtype, std::size_t samples, double confidence, std::uint64_t seed, int threads) {
+    return quality_estimate_to_dict(estimate_mse_psnr_binary(original_filename, decompressed_filename, quality_dtype, samples, confidence, seed, threads));
+}, "Estimate MSE and PSNR with a confidence interval from blocks sampled uniformly from two binary quality streams", py::arg("original_filename"), py::arg("decompressed_filename"), py::arg("quality_dtype") = "float32", py::arg("samples") = 10000, py::arg("confidence") = 0.95, py::arg("seed") = 0, py::arg("threads") = 1);
+m.def("squared_difference_sum", &squared_difference_sum_buffers, "Sum of squared byte differences of two equally long buffers, with the dispatched kernel or a named one", py::arg("original"), py::arg("decompressed"), py::arg("kernel") = "auto");
+m.def("quality_kernel", &quality_kernel_name, "Name of the quality comparison kernel picked for this CPU");
+m.def("available_quality_kernels", &available_quality_kernels, "Names of the quality comparison kernels this CPU can run, widest first");
+py::class_<QualityStreamAnalysis>(m, "QualityStreamAnalysis", "Joint quality histogram of a decompressed FASTQ fed in pieces, paired with the original file read as a stream")
+    .def(py::init<const std::string&>(), py::arg("original_filename"))
+    .def("update", [](QualityStreamAnalysis& analysis, const py::buffer& data) {
+        py::buffer_info info = data.request();
+        py::gil_scoped_release release;
+        analysis.update(static_cast<const char*>(info.ptr), static_cast<std::size_t>(info.size * info.itemsize));
+    }, "Feed the next bytes of the decompressed stream", py::arg("data"))
+    .def("read_fd", &QualityStreamAnalysis::read_fd, "Read the decompressed stream from a file descriptor until its end", py::arg("fd"), py::call_guard<py::gil_scoped_release>())
+    .def("finish", &QualityStreamAnalysis::finish, "Check that both files ended on the same whole record")
+    .def("histogram", [](const QualityStreamAnalysis& analysis) {
+        return quality_histogram_to_dict(analysis.histogram());
+    }, "The histogram of the records seen so far, in the layout of calculate_quality_histogram")
+    .def_property_readonly("records", &QualityStreamAnalysis::records);
+py::class_<FastqBatchReader>(m, "FastqBatchReader", "Iterate over a FASTQ file in batches of records, each a dict of NumPy arrays: data, a read-only uint8 view of the batch's bytes, and offsets and lengths, (records, 4) arrays locating the header, bases, separator and quality line of every record in data")
+    .def(py::init<const std::string&, std::size_t>(), py::arg("filename"), py::arg("batch_records") = 65536)
+    .def("__iter__", [](FastqBatchReader& reader) -> FastqBatchReader& { return reader; })
+    .def("__next__", [](FastqBatchReader& reader) {
+        FastqBatch batch;
+        bool more;
+        {
+            py::gil_scoped_release release;
+            more = reader.next(batch);
+        }
+        if (!more) {
+            throw py::stop_iteration();
+        }
+        return fastq_batch_to_dict(batch);
+    });
 }
@@ -0,0 +1,46 @@
+import numpy as np
+
+
+def save_quality_histogram(histogram, joint_path, position_error_path):
+    # Joint counts indexed [original phred, decompressed phred]
+    np.save(joint_path, histogram['joint'])
+    # One row per read position: score count, squared error sum, absolute error sum
+    np.save(position_error_path, np.stack([histogram['position_count'],
+                                           histogram['position_squared_error'],
+                                           histogram['position_absolute_error']], axis=1))
+
+
+def histogram_metrics(joint, max_i=40.0):
+    """Derive the error metrics of a (original, decompressed) joint phred histogram.
+
+    PSNR keeps the fixed max_i of the earlier versions, PSNR_Peak uses the highest original phred value present.
+    """
+    joint = np.asarray(joint, dtype=np.float64)
+    phred = np.arange(joint.shape[0])
+    difference = phred[:, None] - phred[None, :]
+    score_count = joint.sum()
+    if score_count == 0:
+        raise ValueError("The histogram holds no quality scores")
+
+    mse = (joint * difference ** 2).sum() / score_count
+    mae = (joint * np.abs(difference)).sum() / score_count
+    max_error = int(np.abs(difference)[joint > 0].max())
+    peak = float(phred[joint.sum(axis=1) > 0].max())
+
+    def psnr(max_value):
+        return float('inf') if mse == 0 else float(10 * np.log10(max_value ** 2 / mse))
+
+    return {
+        'mse': float(mse),
+        'psnr': psnr(max_i),
+        'mae': float(mae),
+        'max_error': max_error,
+        'psnr_peak': psnr(peak)
+    }
+
+
+def position_metrics(position_error):
+    # Per read position MSE and MAE from the saved position error sums
+    position_error = np.asarray(position_error, dtype=np.float64)
+    count = np.maximum(position_error[:, 0], 1)
+    return position_error[:, 1] / count, position_error[:, 2] / count
@@ -0,0 +1,124 @@
+#include "quality_kernel.h"
+
+#include <stdexcept>
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define SEQBENCH_X86_DISPATCH 1
+#include <immintrin.h>
+#endif
+
+std::uint64_t squared_difference_sum_scalar(const char* original, const char* decompressed, std::size_t length) {
+    const unsigned char* a = reinterpret_cast<const unsigned char*>(original);
+    const unsigned char* b = reinterpret_cast<const unsigned char*>(decompressed);
+    std::uint64_t sum = 0;
+    for (std::size_t i = 0; i < length; ++i) {
+        int difference = static_cast<int>(a[i]) - static_cast<int>(b[i]);
+        sum += static_cast<std::uint64_t>(difference * difference);
+    }
+    return sum;
+}
+
+#ifdef SEQBENCH_X86_DISPATCH
+
+// Each 32-bit lane gains at most 2 * 2 * 255^2 per vector, so the lanes are widened to 64 bits every
+// lane_flush vectors, well before they could overflow
+static const std::size_t lane_flush = 4096;
+
+__attribute__((target("sse2")))
+static std::uint64_t squared_difference_sum_sse2(const char* original, const char* decompressed, std::size_t length) {
+    const __m128i zero = _mm_setzero_si128();
+    __m128i sums = zero;
+    std::size_t i = 0;
+    while (i + 16 <= length) {
+        __m128i lanes = zero;
+        for (std::size_t n = 0; n < lane_flush && i + 16 <= length; ++n, i += 16) {
+            __m128i a = _mm_loadu_si128(reinterpret_cast<const __m128i*>(original + i));
+            __m128i b = _mm_loadu_si128(reinterpret_cast<const __m128i*>(decompressed + i));
+            // |a - b| from the two saturating differences, one of which is zero
+            __m128i difference = _mm_or_si128(_mm_subs_epu8(a, b), _mm_subs_epu8(b, a));
+            __m128i low = _mm_unpacklo_epi8(difference, zero);
+            __m128i high = _mm_unpackhi_epi8(difference, zero);
+            lanes = _mm_add_epi32(lanes, _mm_add_epi32(_mm_madd_epi16(low, low), _mm_madd_epi16(high, high)));
+        }
+        sums = _mm_add_epi64(sums, _mm_unpacklo_epi32(lanes, zero));
+        sums = _mm_add_epi64(sums, _mm_unpackhi_epi32(lanes, zero));
+    }
+    std::uint64_t parts[2];
+    _mm_storeu_si128(reinterpret_cast<__m128i*>(parts), sums);
+    return parts[0] + parts[1] + squared_difference_sum_scalar(original + i, decompressed + i, length - i);
+}
+
+__attribute__((target("avx2")))
+static std::uint64_t squared_difference_sum_avx2(const char* original, const char* decompressed, std::size_t length) {
+    const __m256i zero = _mm256_setzero_si256();
+    __m256i sums = zero;
+    std::size_t i = 0;
+    while (i + 32 <= length) {
+        __m256i lanes = zero;
+        for (std::size_t n = 0; n < lane_flush && i + 32 <= length; ++n, i += 32) {
+            __m256i a = _mm256_loadu_si256(reinterpret_cast<const __m256i*>(original + i));
+            __m256i b = _mm256_loadu_si256(reinterpret_cast<const __m256i*>(decompressed + i));
+            __m256i difference = _mm256_or_si256(_mm256_subs_epu8(a, b), _mm256_subs_epu8(b, a));
+            // The unpacks work within 128-bit halves, which doesn't matter for a sum
+            __m256i low = _mm256_unpacklo_epi8(difference, zero);
+            __m256i high = _mm256_unpackhi_epi8(difference, zero);
+            lanes = _mm256_add_epi32(lanes, _mm256_add_epi32(_mm256_madd_epi16(low, low), _mm256_madd_epi16(high, high)));
+        }
+        sums = _mm256_add_epi64(sums, _mm256_unpacklo_epi32(lanes, zero));
+        sums = _mm256_add_epi64(sums, _mm256_unpackhi_epi32(lanes, zero));
+    }
+    std::uint64_t parts[4];
+    _mm256_storeu_si256(reinterpret_cast<__m256i*>(parts), sums);
+    return parts[0] + parts[1] + parts[2] + parts[3] +
+           squared_difference_sum_sse2(original + i, decompressed + i, length - i);
+}
+
+#endif
+
+std::vector<std::string> available_quality_kernels() {
+    std::vector<std::string> kernels;
+#ifdef SEQBENCH_X86_DISPATCH
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx2")) {
+        kernels.push_back("avx2");
+    }
+    if (__builtin_cpu_supports("sse2")) {
+        kernels.push_back("sse2");
+    }
+#endif
+    kernels.push_back("scalar");
+    return kernels;
+}
+
+SquaredDifferenceKernel quality_kernel(const std::string& name) {
+    if (name == "auto") {
+        return quality_kernel(quality_kernel_name());
+    }
+    std::vector<std::string> kernels = available_quality_kernels();
+    bool available = false;
+    for (const std::string& kernel : kernels) {
+        available = available || kernel == name;
+    }
+    if (!available) {
+        throw std::invalid_argument("Quality kernel '" + name + "' is not available on this CPU");
+    }
+#ifdef SEQBENCH_X86_DISPATCH
+    if (name == "avx2") {
+        return squared_difference_sum_avx2;
+    }
+    if (name == "sse2") {
+        return squared_difference_sum_sse2;
+    }
+#endif
+    return squared_difference_sum_scalar;
+}
+
+const char* quality_kernel_name() {
+    static const std::string name = available_quality_kernels().front();
+    return name.c_str();
+}
+
+std::uint64_t squared_difference_sum(const char* original, const char* decompressed, std::size_t length) {
+    static const SquaredDifferenceKernel kernel = quality_kernel(quality_kernel_name());
+    return kernel(original, decompressed, length);
+}
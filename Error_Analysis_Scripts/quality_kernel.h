@@ -0,0 +1,28 @@
+#ifndef SEQBENCH_QUALITY_KERNEL_H
+#define SEQBENCH_QUALITY_KERNEL_H
+
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+// Sum of the squared differences of two quality lines of the same length. The characters are compared as
+// unsigned bytes, the +33 phred offsets cancel so they are never converted.
+typedef std::uint64_t (*SquaredDifferenceKernel)(const char* original, const char* decompressed, std::size_t length);
+
+std::uint64_t squared_difference_sum_scalar(const char* original, const char* decompressed, std::size_t length);
+
+// Dispatches to the widest kernel the CPU supports, picked once on first use
+std::uint64_t squared_difference_sum(const char* original, const char* decompressed, std::size_t length);
+
+// Name of the kernel squared_difference_sum dispatches to, "avx2", "sse2" or "scalar"
+const char* quality_kernel_name();
+
+// Names of the kernels this CPU can run, widest first
+std::vector<std::string> available_quality_kernels();
+
+// Kernel by name, "auto" being the dispatched one. Throws std::invalid_argument for kernels the CPU can't run.
+SquaredDifferenceKernel quality_kernel(const std::string& name);
+
+
+#endif //SEQBENCH_QUALITY_KERNEL_H
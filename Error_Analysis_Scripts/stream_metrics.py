@@ -0,0 +1,30 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
+import fastq_metrics
+from quality_histogram import save_quality_histogram, histogram_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Error metrics of a decompressed FASTQ read from stdin, "
+                                                 "paired record by record with the original file")
+    parser.add_argument('original_file')
+    parser.add_argument('histogram_path')
+    parser.add_argument('position_error_path')
+    args = parser.parse_args()
+
+    analysis = fastq_metrics.QualityStreamAnalysis(args.original_file)
+    analysis.read_fd(sys.stdin.fileno())
+    analysis.finish()
+
+    histogram = analysis.histogram()
+    save_quality_histogram(histogram, args.histogram_path, args.position_error_path)
+    metrics = histogram_metrics(histogram['joint'])
+    # The fields of the error analysis CSV after job_id and Compressor_Name, lossless checks aren't streamed
+    print(f"{metrics['mse']},{metrics['psnr']},{metrics['mae']},{metrics['max_error']},{metrics['psnr_peak']},")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'build'))
 import fastq_metrics
+from quality_histogram import histogram_metrics
 
 
 def main():
@@ -11,6 +12,8 @@ def main():
     decompressed_file = ""
     threads = 8
 
+    print(f"Quality kernel: {fastq_metrics.quality_kernel()}")
+
     # Test original version
     original_quality_scores = fastq_metrics.read_quality_scores(original_file)
     decompressed_quality_scores = fastq_metrics.read_quality_scores(decompressed_file)
@@ -35,6 +38,60 @@ def main():
 
     print(f"v3 Multithreaded Version - MSE: {mse_v3}, PSNR: {psnr_v3}, Time: {end_time - start_time} seconds")
 
+    # Test v4 memory-mapped version
+    start_time = time.time()
+    mse_v4, psnr_v4 = fastq_metrics.calculate_mse_psnr_v4(original_file, decompressed_file, threads)
+    end_time = time.time()
+
+    print(f"v4 Memory-Mapped Version - MSE: {mse_v4}, PSNR: {psnr_v4}, Time: {end_time - start_time} seconds")
+
+    # Test the joint histogram, all metrics come from the one pass
+    start_time = time.time()
+    histogram = fastq_metrics.calculate_quality_histogram(original_file, decompressed_file, threads)
+    metrics = histogram_metrics(histogram['joint'])
+    end_time = time.time()
+
+    print(f"Histogram Version - {metrics}, Time: {end_time - start_time} seconds")
+
+    # Test the lossless verification
+    start_time = time.time()
+    report = fastq_metrics.verify_lossless(original_file, decompressed_file, threads)
+    end_time = time.time()
+
+    print(f"Lossless Verification - Exact: {report['exact']}, Field differences: {report['field_differences']}, "
+          f"Time: {end_time - start_time} seconds")
+
+    # Test the sampled quick-look estimate, the exact MSE should usually lie inside its interval
+    start_time = time.time()
+    estimate = fastq_metrics.estimate_mse_psnr(original_file, decompressed_file, 10000, 0.95, threads=threads)
+    end_time = time.time()
+
+    print(f"Sampled Estimate - MSE: {estimate['mse']} [{estimate['mse_low']}, {estimate['mse_high']}], "
+          f"PSNR: {estimate['psnr']}, Time: {end_time - start_time} seconds")
+
+    # Test the streaming analysis, the decompressed file fed in pieces as a decompressor would write it
+    start_time = time.time()
+    analysis = fastq_metrics.QualityStreamAnalysis(original_file)
+    with open(decompressed_file, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            analysis.update(chunk)
+    analysis.finish()
+    metrics = histogram_metrics(analysis.histogram()['joint'])
+    end_time = time.time()
+
+    print(f"Streaming Version - {metrics}, Records: {analysis.records}, Time: {end_time - start_time} seconds")
+
+    # Test the record batches, quality bytes gathered without a Python loop over lines
+    start_time = time.time()
+    records = 0
+    scores = 0
+    for batch in fastq_metrics.FastqBatchReader(original_file):
+        records += batch['records']
+        scores += int(batch['lengths'][:, 3].sum())
+    end_time = time.time()
+
+    print(f"Record Batches - Records: {records}, Quality scores: {scores}, Time: {end_time - start_time} seconds")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
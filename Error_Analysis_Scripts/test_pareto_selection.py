@@ -0,0 +1,71 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Compression_Scripts'))
+from job_generator import JobGenerator
+from error_analysis import ErrorAnalysis
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts_Template')
+
+
+class RecordingExecutor:
+    # Stands in for qsub, keeps the submitted scripts
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job_script_path):
+        self.submitted.append(os.path.basename(job_script_path))
+        return str(len(self.submitted))
+
+    def active_jobs(self, job_ids):
+        return []
+
+
+def append_row(metrics_path, row):
+    with open(metrics_path, 'a', newline='') as csvfile:
+        csv.writer(csvfile).writerow(row)
+
+
+def test_submit_pareto_front_analysis():
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, f"pareto_selection_test_{os.getpid()}.fastq")
+        open(input_file, 'w').close()
+        config_path = os.path.join(tmp, 'pareto.json')
+        with open(config_path, 'w') as f:
+            json.dump({'input_file': [[input_file]], 'quick_look': True,
+                       'dependency_file': os.path.join(tmp, 'job_dependencies.json'),
+                       'jobs': [{'name': 'fqzcomp', 'options': [f"-Q {quality}", '-d']} for quality in (3, 2, 1)]},
+                      f)
+
+        executor = RecordingExecutor()
+        error_analysis = ErrorAnalysis(config_path, os.path.join(TEMPLATE_DIR, 'error_analysis.sh'),
+                                       executor=executor)
+        # The CSVs as the compression and quick-look jobs write them, headers included
+        JobGenerator.create_compression_metrics_csv(error_analysis, 0, 0)
+        error_analysis.create_quick_look_metrics_csv(0, 0)
+        compression_metrics = error_analysis.path_generator.get_compression_metric_path(0, 0)
+        quick_look_metrics = error_analysis.path_generator.get_error_analysis_quick_look_metric_path(0, 0)
+        try:
+            # Job 1 has a lower ratio and a higher MSE than job 0, job 2 trades MSE for ratio
+            for job_index, ratio, mse_low, mse_high in ((0, 4.0, 1.0, 2.0), (1, 2.0, 5.0, 6.0),
+                                                        (2, 8.0, 10.0, 12.0)):
+                append_row(compression_metrics, [f"compression_0_{job_index}_0", 'fqzcomp', 1, 1, 1, 1, ratio])
+                append_row(quick_look_metrics, [f"quick_look_0_{job_index}_0", 'fqzcomp', (mse_low + mse_high) / 2,
+                                                mse_low, mse_high, 30, 29, 31, 100])
+
+            selected = error_analysis.submit_pareto_front_analysis(0, 0)
+        finally:
+            os.remove(compression_metrics)
+            os.remove(quick_look_metrics)
+
+        assert sorted(selected) == [0, 2]
+        assert executor.submitted == ['error_analysis_0_0_0.sh', 'error_analysis_0_2_0.sh']
+
+
+if __name__ == "__main__":
+    test_submit_pareto_front_analysis()
+    print("Pareto selection test passed")
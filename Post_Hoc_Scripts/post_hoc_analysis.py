@@ -8,35 +8,29 @@ import sys
 
 sys.path.append('../')
 from Compression_Scripts.path_generator import PathGenerator
-from Compression_Scripts.dependency_linker import DependencyLinker
-
-
-def check_job_status_depend(job_id):
-    check_command = f"qstat -f {job_id}"
-    try:
-        result = subprocess.run(check_command, check=True, shell=True, capture_output=True, text=True)
-        output = result.stdout
-        if "job_state = R" in output:
-            return True  # Running or other states
-        elif "job_state = H" in output:
-            return True
-        elif "job_state = Q" in output:
-            return True
-        else:
-            return False
-    except subprocess.CalledProcessError as e:
-        return False
+from Compression_Scripts.dependency_linker import create_dependency_linker
+from Compression_Scripts.scheduler_state import SchedulerState
+from Compression_Scripts.executors import create_executor
+from Compression_Scripts.fastq_profile import get_cached_profile, redundant_job_indices
 
 
 class PostHocAnalysis:
     def __init__(self, config_name,
                  template_path,
-                 job_template_path):
+                 job_template_path,
+                 scheduler_state=None,
+                 executor=None,
+                 run_id=None):
         self.config = self.load_config(config_name)
         self.path_generator = PathGenerator(config_name)
-        self.dependency_linker = DependencyLinker()
+        self.dependency_linker = create_dependency_linker(self.config, config_name, run_id)
+        self.scheduler_state = scheduler_state or SchedulerState(self.config.get('scheduler_state_ttl', 30))
+        self.scheduler_state.track(self.dependency_linker.get_all_job_ids())
+        # Submits to PBS or runs the scripts locally, see executors.py
+        self.executor = executor or create_executor(self.config, self.scheduler_state)
         self.template_path = template_path
         self.job_template_path = job_template_path
+        self.redundant_jobs = {}
 
     def load_config(self, config_path):
         try:
@@ -47,6 +41,15 @@ class PostHocAnalysis:
         except json.JSONDecodeError:
             raise Exception(f"Error decoding JSON from the configuration file: {config_path}")
 
+    def is_redundant(self, job_index, file_pair_index, file_index):
+        # Jobs the compression phase skipped after profiling the input
+        if not self.config.get('profile', False):
+            return False
+        if (file_pair_index, file_index) not in self.redundant_jobs:
+            profile = get_cached_profile(self.path_generator, file_pair_index, file_index)
+            self.redundant_jobs[(file_pair_index, file_index)] = redundant_job_indices(self.config, profile)
+        return job_index in self.redundant_jobs[(file_pair_index, file_index)]
+
     def create_post_hoc_metrics_csv(self, file_pair_index, file_index):
         metrics_path = self.path_generator.get_post_hoc_metric_path(file_pair_index, file_index)
         header = ['job_id', 'Compressor_Name', 'True_Positives(TP)', 'False_Positives(FP)', 'False_Negatives(FN)',
@@ -147,11 +150,7 @@ class PostHocAnalysis:
         with open(self.job_template_path) as f:
             template = Template(f.read())
 
-        active_dependencies = []
-        for dep in dependencies:
-            job_status = check_job_status_depend(dep)
-            if job_status:
-                active_dependencies.append(dep)
+        active_dependencies = self.executor.active_jobs(dependencies)
 
         dependency_line = f"#PBS -W depend=afterok:{':'.join(active_dependencies)}\n" if active_dependencies else ""
 
@@ -188,53 +187,17 @@ class PostHocAnalysis:
         return job_script_path
 
     def submit_job(self, job_script_path):
-        submit_command = f"qsub {job_script_path}"
         try:
-            result = subprocess.run(submit_command, check=True, shell=True, capture_output=True, text=True)
-            job_id = result.stdout.strip().split('.')[0]  # Get the job ID from the output
+            job_id = self.executor.submit(job_script_path)
             logging.info(f"Job submitted: {job_script_path} with job ID: {job_id}")
             return job_id
         except subprocess.CalledProcessError as e:
             logging.error(f"Failed to submit job: {job_script_path}, Error: {e}")
             return None
 
-    def run_posthoc_analysis(self, job_name="truth_vcf", dependencies=None):
-
-        # Step 1: Create CSV files for each input pair
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            self.create_post_hoc_metrics_csv(file_pair_index, 0)
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-
-                script_path = self.create_original_files_vcf_script(job_name, file_pair_index,
-                                                                    file_index=0)
-                job_id = self.submit_job(script_path)
-                if job_id:
-                    for job_index in range(len(self.config['jobs'])):
-                        for file_index in range(len(file_pair)):
-                            job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
-                            self.dependency_linker.append_job_id(job_name, job_id)
-
-        for file_pair_index, file_pair in enumerate(self.config['input_file']):
-            for job_index in range(len(self.config['jobs'])):
-                job_name = f"post_hoc_{file_pair_index}_{job_index}_{0}"
-                prev_job_name_2 = f"job_{file_pair_index}_{job_index}_{1}"
-                prev_job_name = f"job_{file_pair_index}_{job_index}_{0}"
-                dependencies = list(
-                    set(self.dependency_linker.get_dependencies(
-                        prev_job_name) + self.dependency_linker.get_dependencies(
-                        prev_job_name_2)))
-                lossy_script_path = self.create_decompressed_files_vcf_script(job_name, job_index,
-                                                                              file_pair_index, 0,
-                                                                              dependencies)
-                self.submit_job(lossy_script_path)
-
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    config_name = "../Jobs/sample.json"
-    truth_vcf_template = '../Scripts_Template/truth_vcf.sh'
-    post_hoc_template = '../Scripts_Template/post_hoc.sh'
-    post_hoc_analysis = PostHocAnalysis(config_name, truth_vcf_template, post_hoc_template)
-    job_name = "truth_vcf"
-    # print(post_hoc_analysis.check_job_status(71595))
-    post_hoc_analysis.run_posthoc_analysis()
+    # The post-hoc analysis alone, depending on the compression jobs of the configuration's last run
+    from workflow import run_seqbench
+    run_seqbench("../Jobs/sample.json", ['Post-Hoc'])
@@ -13,8 +13,11 @@
 cd $PBS_O_WORKDIR
 
 source {{ conda_path }} compression
-
-BINARY_LENGTH=$(($(stat -c %s "{{ binary_input_file }}") / 4))
+{% if split_script %}
+# Streaming mode splits the FASTQ here rather than in a separately queued job
+bash {{ split_script }}
+{% endif %}
+BINARY_LENGTH=$(($(stat -c %s "{{ binary_input_file }}") / {{ quality_dtype_size }}))
 
 get_time() {
     echo $(date +%s.%N)
@@ -29,17 +32,17 @@ START_TIME=$(get_time)
 END_TIME=$(get_time)
 COMPRESSION_DURATION=$(echo "$END_TIME - $START_TIME" | bc)
 
-INPUT_SIZE_BYTES=$(stat -c %s "{{ input_path }}")
+# Ratios are taken against the uncompressed FASTQ, a .gz input's size was measured once when generating the jobs
+{% if input_size %}INPUT_SIZE_BYTES={{ input_size }}{% else %}INPUT_SIZE_BYTES=$(stat -c %s "{{ input_path }}"){% endif %}
 OUTPUT_SIZE_BYTES=$(stat -c %s "{{ compressed_output_path }}")
 INPUT_SIZE_MB=$(echo "scale=6; $INPUT_SIZE_BYTES / 1048576" | bc)
 OUTPUT_SIZE_MB=$(echo "scale=6; $OUTPUT_SIZE_BYTES / 1048576" | bc)
 
 # Conditionally calculate the ratio for SZ3 compressor
 if [ "{{ compressor }}" = "SZ3" ]; then
-    # Load the compressed sizes from the JSON file
-    compressed_bases_id_size=$(python -c "import json; data=json.load(open('./field_size.json')); print(data['{{ input_path }}']['compressed_bases_id_size'])")
-    compressed_bases_size=$(python -c "import json; data=json.load(open('./field_size.json')); print(data['{{ input_path }}']['compressed_bases_size'])")
-    TOTAL_COMPRESSED_SIZE_MB=$(echo "scale=6; ($compressed_bases_id_size + $compressed_bases_size) / 1048576 + $OUTPUT_SIZE_MB" | bc)
+    # Load the compressed field sizes written by the split job
+    compressed_fields_size=$(python -c "import json; data=json.load(open('{{ field_size_path }}')); print(data['compressed_bases_id_size'] + data['compressed_bases_size'] + data['compressed_quality_id_size'])")
+    TOTAL_COMPRESSED_SIZE_MB=$(echo "scale=6; $compressed_fields_size / 1048576 + $OUTPUT_SIZE_MB" | bc)
     RATIO=$(echo "scale=6; $INPUT_SIZE_MB / $TOTAL_COMPRESSED_SIZE_MB" | bc)
 elif [ "{{ compressor }}" = "BFQZIP" ]; then
     fq_dna_size=$(stat -c %s "{{ compressed_output_path }}.fq.dna.7z")
@@ -57,11 +60,49 @@ COMPRESSION_THROUGHPUT=$(echo "scale=6; $INPUT_SIZE_MB / $COMPRESSION_DURATION"
 sleep 3
 
 # Run decompression and capture metrics
+{% if reconstruct_script %}
+# Streaming mode decompresses into a FIFO read by the reconstruction, so the decompressed
+# quality stream never reaches the disk and the time covers rebuilding the FASTQ
+rm -f "{{ decompressed_quality_path }}"
+mkfifo "{{ decompressed_quality_path }}"
+bash {{ reconstruct_script }} &
+RECONSTRUCT_PID=$!
+
+START_TIME=$(get_time)
+
+# Opening the FIFO read-write releases the reader if the decompressor failed before opening it
+{{ decompression_command }} || : 1<>"{{ decompressed_quality_path }}"
+wait $RECONSTRUCT_PID
+
+END_TIME=$(get_time)
+rm -f "{{ decompressed_quality_path }}"
+{% elif stream_metrics_script %}
+# The decompressor writes into a FIFO. tee copies the stream to the decompressed FASTQ for the post-hoc
+# alignment while the error metrics are computed from the same bytes, so no error analysis job rereads it.
+# The decompression time includes the metrics, which keep pace with the decompressor.
+rm -f "{{ decompressed_output_path }}" "{{ decompressed_output_path }}.part"
+mkfifo "{{ decompressed_output_path }}"
+METRICS_FILE=$(mktemp)
+tee "{{ decompressed_output_path }}.part" < "{{ decompressed_output_path }}" | python3 {{ stream_metrics_script }} "{{ original_file }}" "{{ histogram_path }}" "{{ position_error_path }}" > "$METRICS_FILE" &
+
+START_TIME=$(get_time)
+
+# Opening the FIFO read-write releases tee if the decompressor failed before opening it
+{{ decompression_command }} || : 1<>"{{ decompressed_output_path }}"
+wait
+
+END_TIME=$(get_time)
+rm -f "{{ decompressed_output_path }}"
+mv "{{ decompressed_output_path }}.part" "{{ decompressed_output_path }}"
+echo "{{ error_analysis_job_name }},{{ compressor_name }},$(cat "$METRICS_FILE")" >> "{{ error_analysis_csv_path }}"
+rm -f "$METRICS_FILE"
+{% else %}
 START_TIME=$(get_time)
 
 {{ decompression_command }}
 
 END_TIME=$(get_time)
+{% endif %}
 DECOMPRESSION_DURATION=$(echo "$END_TIME - $START_TIME" | bc)
 DECOMPRESSION_THROUGHPUT=$(echo "scale=6; $INPUT_SIZE_MB / $DECOMPRESSION_DURATION" | bc)
 
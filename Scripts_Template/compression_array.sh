@@ -0,0 +1,40 @@
+#!/bin/sh
+#PBS -l walltime={{ walltime }}
+#PBS -N {{ job_name }}
+#PBS -q {{ node_size }}
+#PBS -l nodes={{ nodes }}:ppn={{ ppn }}
+#PBS -M {{ email }}
+#PBS -o {{ output_log }}
+#PBS -e {{ error_log }}
+{% if last_index > 0 %}{% if scheduler == 'pbspro' %}#PBS -J 0-{{ last_index }}{% else %}#PBS -t 0-{{ last_index }}{% endif %}{% endif %}
+
+{{ dependency_line }}
+
+# Change to directory where 'qsub' was called
+cd $PBS_O_WORKDIR
+
+# Torque numbers the elements in PBS_ARRAYID, PBS Pro in PBS_ARRAY_INDEX, a single element isn't an array
+ARRAY_INDEX=${PBS_ARRAYID:-${PBS_ARRAY_INDEX:-0}}
+
+# Each element's compression script is copied in at submission, a later run rewriting the job scripts
+# can't change what a queued element runs
+ELEMENT_SCRIPT=$(mktemp)
+case "$ARRAY_INDEX" in
+{% for element in elements %}    {{ loop.index0 }})
+        OUTPUT_LOG="{{ element.output_log }}"
+        ERROR_LOG="{{ element.error_log }}"
+        cat > "$ELEMENT_SCRIPT" <<'SEQBENCH_ARRAY_ELEMENT'
+{{ element.script }}
+SEQBENCH_ARRAY_ELEMENT
+        ;;
+{% endfor %}    *)
+        echo "No array element $ARRAY_INDEX" >&2
+        rm -f "$ELEMENT_SCRIPT"
+        exit 1
+        ;;
+esac
+
+bash "$ELEMENT_SCRIPT" > "$OUTPUT_LOG" 2> "$ERROR_LOG"
+ELEMENT_STATUS=$?
+rm -f "$ELEMENT_SCRIPT"
+exit $ELEMENT_STATUS
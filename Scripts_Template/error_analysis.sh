@@ -15,22 +15,61 @@ cd $PBS_O_WORKDIR
 source {{ conda_path }} compression
 
 # Run error analysis using the fastq_metrics API
-mse_psnr_output=$(python3 -c "
+metrics_output=$(python3 -c "
 import sys
 sys.path.append('{{ build_cpp_path }}')
+sys.path.append('{{ scripts_path }}')
 import fastq_metrics
+from quality_histogram import save_quality_histogram, histogram_metrics
 original_file = '{{ original_file }}'
 decompressed_file = '{{ decompressed_file }}'
 threads = {{ threads }}
-mse_v3, psnr_v3 = fastq_metrics.calculate_mse_psnr_v3(original_file, decompressed_file, threads)
-print(f'{mse_v3},{psnr_v3}')
+{% if quick_look %}
+# Quick look, MSE and PSNR estimated from sampled records with a confidence interval. Inputs that can't be
+# sampled leave the fields empty, the Pareto selection then queues their exact analysis.
+try:
+{% if binary_streams %}
+    estimate = fastq_metrics.estimate_mse_psnr_binary(original_file, decompressed_file, '{{ quality_dtype }}', {{ samples }}, {{ confidence }}, threads=threads)
+{% else %}
+    estimate = fastq_metrics.estimate_mse_psnr(original_file, decompressed_file, {{ samples }}, {{ confidence }}, threads=threads)
+{% endif %}
+except ValueError as error:
+    print(error, file=sys.stderr)
+    print(',,,,,,')
+    sys.exit(0)
+print(f\"{estimate['mse']},{estimate['mse_low']},{estimate['mse_high']},{estimate['psnr']},{estimate['psnr_low']},{estimate['psnr_high']},{estimate['samples']}\")
+{% else %}
+{% if lossless %}
+import json
+# A lossless job only has to reproduce every record, the quality metrics are trivial when it does
+report = fastq_metrics.verify_lossless(original_file, decompressed_file, threads)
+with open('{{ verification_path }}', 'w') as report_file:
+    json.dump(report, report_file, indent=4)
+if report['exact']:
+    print('0.0,inf,0.0,0,inf,True')
+    sys.exit(0)
+if report['original_records'] != report['decompressed_records']:
+    # Records were lost or added, the quality values can't be paired up
+    print(',,,,,False')
+    sys.exit(0)
+{% endif %}
+# One pass builds the joint phred histogram, every metric is derived from it
+{% if binary_streams %}
+# SZ3's binary quality streams are compared directly, without waiting for or parsing the reconstructed FASTQ
+histogram = fastq_metrics.calculate_quality_histogram_binary(original_file, decompressed_file, '{{ quality_dtype }}', threads)
+{% elif reorders_reads %}
+# Reordered reads are joined on their read IDs, partitions spill to disk when the files don't fit in memory
+histogram = fastq_metrics.calculate_quality_histogram_by_id(original_file, decompressed_file, threads)
+{% else %}
+histogram = fastq_metrics.calculate_quality_histogram(original_file, decompressed_file, threads)
+{% endif %}
+save_quality_histogram(histogram, '{{ histogram_path }}', '{{ position_error_path }}')
+metrics = histogram_metrics(histogram['joint'])
+print(f\"{metrics['mse']},{metrics['psnr']},{metrics['mae']},{metrics['max_error']},{metrics['psnr_peak']},{{ 'False' if lossless else '' }}\")
+{% endif %}
 ")
 
-# Extract MSE and PSNR values
-mse_v3=$(echo $mse_psnr_output | cut -d',' -f1)
-psnr_v3=$(echo $mse_psnr_output | cut -d',' -f2)
-
 # Write the results to the CSV file
-echo "{{ job_name }},{{ compressor_name }},$mse_v3,$psnr_v3" >> "{{ metrics_csv_path }}"
+echo "{{ job_name }},{{ compressor_name }},$metrics_output" >> "{{ metrics_csv_path }}"
 
 conda deactivate
@@ -14,9 +14,9 @@ cd $PBS_O_WORKDIR
 
 source {{ conda_path }} compression
 
-# Start reconstruction
+# Start reconstruction, blocks listed in the field index are decoded in parallel
 python -c "import sys
 sys.path.append('{{ get_build_pre_processing_cpp_path }}')
-import fastq_reconstructor; fastq_reconstructor.fastq_reconstructor('{{ output_bases_id_path }}', '{{ output_bases_path }}', '{{ output_quality_id_path }}', '{{ output_quality_path }}', '{{ output_path }}')"
+import fastq_reconstructor; fastq_reconstructor.fastq_reconstructor('{{ output_bases_id_path }}', '{{ output_bases_path }}', '{{ output_quality_id_path }}', '{{ output_quality_path }}', '{{ output_path }}', quality_dtype='{{ quality_dtype }}', base_encoding='{{ base_encoding }}', header_encoding='{{ header_encoding }}', separator_encoding='{{ separator_encoding }}', threads={{ threads }}, index_path='{{ field_index_path }}')"
 
 conda deactivate
@@ -15,48 +15,21 @@ source {{ conda_path }} compression
 
 python -c "import sys
 import json
-import os
 sys.path.append('{{ get_build_pre_processing_cpp_path }}')
 import fastq_processor
 
-# Process the FASTQ file
-fastq_processor.process_fastq('{{ input_path }}', '{{ output_bases_id_path }}', '{{ output_bases_path }}', '{{ output_quality_id_path }}', '{{ output_quality_path }}')
+# Split the FASTQ file, the non-quality fields are compressed by the splitter's threads as they are written
+# The field index records where each block starts so the reconstruction can decode blocks in parallel
+field_sizes = fastq_processor.process_fastq('{{ input_path }}', '{{ output_bases_id_path }}', '{{ output_bases_path }}', '{{ output_quality_id_path }}', '{{ output_quality_path }}', buffer_size={{ buffer_size }}, threads={{ threads }}, quality_dtype='{{ quality_dtype }}', base_encoding='{{ base_encoding }}', field_compression='{{ field_compression }}', compression_level={{ compression_level }}, header_encoding='{{ header_encoding }}', separator_encoding='{{ separator_encoding }}', index_path='{{ field_index_path }}')
 
-# Compress the output files
-os.system(f'gzip -9 -f -k {{ output_bases_id_path }}')
-os.system(f'gzip -9 -f -k {{ output_bases_path }}')
-
-# Get the compressed file sizes
-compressed_bases_id_size = os.path.getsize('{{ output_bases_id_path }}.gz')
-compressed_bases_size = os.path.getsize('{{ output_bases_path }}.gz')
-
-# Prepare the size data to be written to the JSON file
+# Each input gets its own size file, read by the SZ3 compression job for the ratio
 size_data = {
-    '{{ input_path }}': {
-        'compressed_bases_id_size': compressed_bases_id_size,
-        'compressed_bases_size': compressed_bases_size
-    }
+    'compressed_bases_id_size': field_sizes['base_identifiers'],
+    'compressed_bases_size': field_sizes['dna_bases'],
+    'compressed_quality_id_size': field_sizes['quality_identifiers']
 }
-
-# Path to the JSON file
-json_file_path = './field_size.json'
-
-# Read existing data from the JSON file, if it exists and is valid
-try:
-    if os.path.exists(json_file_path):
-        with open(json_file_path, 'r') as json_file:
-            existing_data = json.load(json_file)
-    else:
-        existing_data = {}
-except (json.JSONDecodeError, FileNotFoundError):
-    existing_data = {}
-
-# Update the existing data with the new size data
-existing_data.update(size_data)
-
-# Write the updated data back to the JSON file
-with open(json_file_path, 'w') as json_file:
-    json.dump(existing_data, json_file, indent=4)
+with open('{{ field_size_path }}', 'w') as json_file:
+    json.dump(size_data, json_file, indent=4)
 "
 
 conda deactivate
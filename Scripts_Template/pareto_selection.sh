@@ -0,0 +1,33 @@
+#!/bin/sh
+#PBS -l walltime={{ walltime }}
+#PBS -N {{ job_name }}
+#PBS -q {{ node_size }}
+#PBS -l nodes=1:ppn=1
+#PBS -M {{ email }}
+#PBS -o {{ output_log }}
+#PBS -e {{ error_log }}
+
+{{ dependency_line }}
+
+# Change to the working directory
+cd $PBS_O_WORKDIR
+
+source {{ conda_path }} compression
+
+# Queue the exact error analysis of the configurations on or near the quick-look Pareto front
+python3 -c "
+import sys
+sys.path.append('{{ project_path }}')
+sys.path.append('{{ scripts_path }}')
+from error_analysis import ErrorAnalysis
+error_analysis = ErrorAnalysis('{{ config_path }}', '{{ template_path }}', '{{ selection_template_path }}',
+                               run_id='{{ run_id }}')
+error_analysis.submit_pareto_front_analysis({{ file_pair_index }}, {{ file_index }})
+# With the local executor the selected analyses run in this job
+error_analysis.executor.wait()
+"
+# A failed selection must fail the job, not be hidden behind conda deactivate
+SELECTION_STATUS=$?
+
+conda deactivate
+exit $SELECTION_STATUS
@@ -1,27 +1,14 @@
-import sys
-import os
+import argparse
 
-sys.path.append('./')
-sys.path.append('./Compression_Scripts')
-sys.path.append('./Post_Hoc_Scripts')
-from Compression_Scripts.job_generator import JobGenerator
-from Post_Hoc_Scripts.post_hoc_analysis import PostHocAnalysis
-from Error_Analysis_Scripts.error_analysis import ErrorAnalysis
+from workflow import run_seqbench
 
 
 if __name__ == '__main__':
-    pwd = os.getcwd()
-    config = pwd + '/Jobs/sample.json'
-    fastq_split_template = pwd + '/Scripts_Template/fastq_split.sh'
-    fastq_reconstruct_template = pwd + '/Scripts_Template/fastq_reconstruct.sh'
-    compression_template = pwd + '/Scripts_Template/compression.sh'
-    error_analysis_template = pwd + '/Scripts_Template/error_analysis.sh'
-    truth_vcf_template = pwd + '/Scripts_Template/truth_vcf.sh'
-    post_hoc_template = pwd + '/Scripts_Template/post_hoc.sh'
-
-    jb = JobGenerator(config, compression_template, fastq_split_template, fastq_reconstruct_template)
-    jb.generate_and_submit_jobs()
-    ea = ErrorAnalysis(config, error_analysis_template)
-    ea.run_error_analysis()
-    pa = PostHocAnalysis(config,  truth_vcf_template, post_hoc_template)
-    pa.run_posthoc_analysis()
+    parser = argparse.ArgumentParser(description='Submit the SeqBench jobs of a configuration.')
+    parser.add_argument('config', nargs='?', default='Jobs/sample.json', help='Configuration file')
+    parser.add_argument('--run-id', help='Run whose recorded jobs to build on, by default a new run unless '
+                                         'Compression is left out of the workflow, then the last one')
+    args = parser.parse_args()
+
+    # The stages only render their job scripts, the workflow submits the whole task graph in one pass
+    run_seqbench(args.config, run_id=args.run_id)
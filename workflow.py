@@ -0,0 +1,424 @@
+import os
+import sys
+import json
+import heapq
+import logging
+import subprocess
+
+# Relative run time of each kind of task, the critical path is the heaviest chain of tasks down the graph
+DEFAULT_TASK_COSTS = {
+    'split': 1.0,
+    'compression': 4.0,
+    'reconstruct': 1.0,
+    'quick_look': 0.1,
+    'selection': 0.1,
+    'error_analysis': 1.0,
+    'truth_vcf': 8.0,
+    'post_hoc': 8.0,
+}
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(PROJECT_DIR, 'Scripts_Template')
+
+# Edge types, an afterok task needs its upstream task's outputs while an afterany one only waits for it to end
+AFTEROK = 'afterok'
+AFTERANY = 'afterany'
+
+
+class Task:
+    """A job of the workflow.
+
+    render(dependencies) writes the task's job script, depending on the given job IDs, and returns its path.
+    The job ID is recorded in the dependency linker under each of the names in register. Tasks with the same
+    array_key that become ready together with the same dependencies are submitted as one job array.
+    Recorded tasks stand for jobs an earlier invocation of the run submitted, they are never submitted again.
+    """
+
+    def __init__(self, name, kind, render, cost=1.0, register=(), array_key=None, persist_before=False,
+                 metadata=None):
+        self.name = name
+        self.kind = kind
+        self.render = render
+        self.cost = cost
+        self.register = list(register) or [name]
+        self.array_key = array_key
+        # Tasks whose jobs read the dependency file themselves, it is written before they are submitted
+        self.persist_before = persist_before
+        self.metadata = metadata or {}
+        self.upstream = []
+        self.downstream = []
+        self.job_id = None
+        self.recorded_job_ids = []
+        self.state = 'pending'
+
+
+class Workflow:
+    """An in-memory task graph submitted in one pass, in critical-path order.
+
+    A task is submitted once every upstream task has a job ID, the scheduler then holds it until their jobs
+    end. Job IDs are kept in memory and written to the dependency file every persist_every submissions.
+    """
+
+    def __init__(self, executor, dependency_linker, array_submitter=None, persist_every=100):
+        self.executor = executor
+        self.dependency_linker = dependency_linker
+        self.array_submitter = array_submitter
+        self.persist_every = persist_every
+        self.tasks = {}
+
+    def add_task(self, task):
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task: {task.name}")
+        self.tasks[task.name] = task
+        return task
+
+    def add_recorded_task(self, name, kind, job_ids):
+        # Downstream tasks depend on the IDs the dependency linker holds for the job, none means it is long done
+        task = self.add_task(Task(name, kind, None, cost=0.0))
+        task.recorded_job_ids = list(job_ids)
+        task.state = 'recorded'
+        return task
+
+    def add_edge(self, upstream, downstream, condition=AFTEROK):
+        if upstream is None or downstream is None:
+            return
+        if condition not in (AFTEROK, AFTERANY):
+            raise ValueError(f"Unknown edge type: {condition}")
+        upstream.downstream.append(downstream)
+        downstream.upstream.append((upstream, condition))
+
+    def topological_order(self):
+        pending = {task.name: len(task.upstream) for task in self.tasks.values()}
+        order = [task for task in self.tasks.values() if not task.upstream]
+        for task in order:
+            for downstream in task.downstream:
+                pending[downstream.name] -= 1
+                if pending[downstream.name] == 0:
+                    order.append(downstream)
+        if len(order) != len(self.tasks):
+            raise ValueError("The workflow has a dependency cycle")
+        return order
+
+    def critical_path_lengths(self):
+        # The cost of the heaviest chain from each task to the end of the workflow
+        lengths = {}
+        for task in reversed(self.topological_order()):
+            lengths[task.name] = task.cost + max((lengths[downstream.name] for downstream in task.downstream),
+                                                 default=0.0)
+        return lengths
+
+    def dependency_ids(self, task):
+        job_ids = set()
+        for upstream, _ in task.upstream:
+            job_ids.update(upstream.recorded_job_ids if upstream.state == 'recorded' else [upstream.job_id])
+        return sorted(job_id for job_id in job_ids if job_id)
+
+    def is_blocked(self, task):
+        # An afterok task can't run without the outputs of an upstream task that was never submitted
+        return any(condition == AFTEROK and upstream.job_id is None and upstream.state != 'recorded'
+                   for upstream, condition in task.upstream)
+
+    def submit(self, tasks, dependencies):
+        script_paths = [task.render(dependencies) for task in tasks]
+        if len(tasks) > 1:
+            job_ids = self.array_submitter(tasks, script_paths, dependencies)
+        else:
+            try:
+                job_ids = [self.executor.submit(script_paths[0])]
+                logging.info(f"Job submitted: {script_paths[0]} with job ID: {job_ids[0]}")
+            except subprocess.CalledProcessError as e:
+                logging.error(f"Failed to submit job: {script_paths[0]}, Error: {e}")
+                job_ids = [None]
+        for task, job_id in zip(tasks, job_ids):
+            task.job_id = job_id
+            task.state = 'submitted' if job_id else 'failed'
+            if job_id:
+                for name in task.register:
+                    self.dependency_linker.add_job_id(name, job_id)
+
+    def run(self):
+        lengths = self.critical_path_lengths()
+        pending = {task.name: len(task.upstream) for task in self.tasks.values()}
+        order = {name: index for index, name in enumerate(self.tasks)}
+        ready = [(-lengths[task.name], order[task.name], task.name) for task in self.tasks.values() if not task.upstream]
+        heapq.heapify(ready)
+        submissions = 0
+
+        with self.dependency_linker.deferred_saves():
+            while ready:
+                _, _, name = heapq.heappop(ready)
+                task = self.tasks[name]
+                group = [task]
+                dependencies = self.dependency_ids(task)
+                if task.state == 'recorded':
+                    group = []
+                elif self.is_blocked(task):
+                    task.state = 'skipped'
+                    group = []
+                    logging.warning(f"Skipping {task.name}, an upstream task was not submitted")
+                elif task.array_key is not None and self.array_submitter:
+                    group += [self.tasks[entry[2]] for entry in sorted(ready)
+                              if self.tasks[entry[2]].array_key == task.array_key
+                              and not self.is_blocked(self.tasks[entry[2]])
+                              and self.dependency_ids(self.tasks[entry[2]]) == dependencies]
+                    names = {member.name for member in group}
+                    ready = [entry for entry in ready if entry[2] not in names]
+                    heapq.heapify(ready)
+
+                if group:
+                    if task.persist_before or submissions // self.persist_every != (
+                            submissions + len(group)) // self.persist_every:
+                        self.dependency_linker.save_dependencies()
+                    self.submit(group, dependencies)
+                    submissions += len(group)
+
+                for member in group or [task]:
+                    for downstream in member.downstream:
+                        pending[downstream.name] -= 1
+                        if pending[downstream.name] == 0:
+                            heapq.heappush(ready, (-lengths[downstream.name], order[downstream.name],
+                                                   downstream.name))
+
+        states = {}
+        for task in self.tasks.values():
+            states[task.state] = states.get(task.state, 0) + 1
+        logging.info(f"Workflow of {len(self.tasks)} tasks: {states}")
+        return states
+
+
+def build_seqbench_workflow(job_generator, error_analysis=None, post_hoc_analysis=None, compression=True):
+    """Build the split, compression, reconstruction, error analysis, truth VCF and post-hoc tasks of a
+    configuration, the same jobs main.py's three stages used to submit one stage after the other.
+
+    Without compression the split, compression and reconstruction jobs aren't submitted again, the analysis
+    tasks depend on the job IDs the dependency linker's run recorded for them instead.
+    """
+    config = job_generator.config
+    path_generator = job_generator.path_generator
+    costs = dict(DEFAULT_TASK_COSTS, **config.get('task_costs', {}))
+    workflow = Workflow(job_generator.executor, job_generator.dependency_linker,
+                        array_submitter=submit_task_array(job_generator) if job_generator.job_arrays else None,
+                        persist_every=config.get('persist_every', 100))
+
+    if job_generator.profiling:
+        job_generator.profile_inputs()
+
+    # Tasks producing each (file_pair_index, job_index, file_index)'s compressed streams and decompressed FASTQ
+    compression_tasks = {}
+    decompressed_tasks = {}
+    for file_pair_index, file_pair in enumerate(config['input_file']):
+        for file_index in range(len(file_pair)):
+            if not compression:
+                add_recorded_compression_tasks(workflow, job_generator, file_pair_index, file_index,
+                                               compression_tasks, decompressed_tasks)
+                continue
+            job_generator.create_compression_metrics_csv(file_pair_index, file_index)
+            sz3_jobs = [job_index for job_index, job in enumerate(config['jobs'])
+                        if job['name'].upper() == 'SZ3'
+                        and not job_generator.is_redundant(job_index, file_pair_index, file_index)]
+            split_task = None
+            if sz3_jobs:
+                split_script = job_generator.create_pre_processing_script(file_pair_index, file_index)
+                if not job_generator.streaming:
+                    split_task = workflow.add_task(Task(
+                        f"pre_processing_{file_pair_index}_{file_index}", 'split',
+                        lambda dependencies, path=split_script: path, costs['split']))
+
+            streaming_split_task = None
+            for job_index in range(len(config['jobs'])):
+                if job_generator.is_redundant(job_index, file_pair_index, file_index):
+                    continue
+                key = (file_pair_index, job_index, file_index)
+                job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
+                is_sz3 = job_index in sz3_jobs
+                split_script = ''
+                if is_sz3 and job_generator.streaming and streaming_split_task is None:
+                    # The input's first SZ3 job splits it, any further SZ3 jobs reuse the fields it wrote
+                    split_script = path_generator.get_pre_processing_script_path(0, file_pair_index, file_index)
+
+                def render_compression(dependencies, key=key, job_name=job_name, split_script=split_script,
+                                       reconstruct=is_sz3 and job_generator.streaming):
+                    file_pair_index, job_index, file_index = key
+                    reconstruct_script = ''
+                    if reconstruct:
+                        reconstruct_script = job_generator.create_reconstruct_script(job_index, file_pair_index,
+                                                                                     file_index)
+                    return job_generator.create_job_script(
+                        job_name, job_generator.all_commands[file_pair_index][job_index][file_index], job_index,
+                        file_pair_index, file_index, dependencies=dependencies, split_script=split_script,
+                        reconstruct_script=reconstruct_script)
+
+                register = [job_name] + ([f"compression_{file_pair_index}_{job_index}_{file_index}"] if is_sz3
+                                         else [])
+                task = workflow.add_task(Task(
+                    f"compression_{file_pair_index}_{job_index}_{file_index}", 'compression', render_compression,
+                    costs['compression'], register=register,
+                    array_key=('compression',) + job_generator.get_nodes_ppn(file_pair_index, file_index),
+                    metadata={'job_name': job_name, 'job_index': job_index, 'file_pair_index': file_pair_index,
+                              'file_index': file_index, 'is_sz3': is_sz3}))
+                workflow.add_edge(split_task if is_sz3 else None, task)
+                if is_sz3 and job_generator.streaming:
+                    workflow.add_edge(streaming_split_task, task)
+                    streaming_split_task = streaming_split_task or task
+                compression_tasks[key] = task
+                decompressed_tasks[key] = task
+
+                if is_sz3 and not job_generator.streaming:
+                    def render_reconstruct(dependencies, key=key):
+                        file_pair_index, job_index, file_index = key
+                        return job_generator.create_reconstruct_script(
+                            job_index, file_pair_index, file_index, job_generator.get_dependency_line(dependencies))
+
+                    reconstruct_task = workflow.add_task(Task(
+                        f"fastq_reconstruct_{file_pair_index}_{job_index}_{file_index}", 'reconstruct',
+                        render_reconstruct, costs['reconstruct'], register=[job_name]))
+                    workflow.add_edge(task, reconstruct_task)
+                    decompressed_tasks[key] = reconstruct_task
+
+    if error_analysis is not None:
+        add_error_analysis_tasks(workflow, error_analysis, costs, compression_tasks, decompressed_tasks)
+    if post_hoc_analysis is not None:
+        add_post_hoc_tasks(workflow, post_hoc_analysis, costs, decompressed_tasks)
+    return workflow
+
+
+def add_recorded_compression_tasks(workflow, job_generator, file_pair_index, file_index, compression_tasks,
+                                   decompressed_tasks):
+    linker = job_generator.dependency_linker
+    for job_index, job in enumerate(job_generator.config['jobs']):
+        if job_generator.is_redundant(job_index, file_pair_index, file_index):
+            continue
+        key = (file_pair_index, job_index, file_index)
+        job_name = f"job_{file_pair_index}_{job_index}_{file_index}"
+        compression_name = f"compression_{file_pair_index}_{job_index}_{file_index}"
+        is_sz3 = job['name'].upper() == 'SZ3'
+        # Only SZ3 records its compression job on its own, job_ holds the job that wrote the decompressed FASTQ
+        compression_tasks[key] = workflow.add_recorded_task(
+            compression_name, 'compression', linker.get_dependencies(compression_name if is_sz3 else job_name))
+        decompressed_tasks[key] = compression_tasks[key]
+        if is_sz3 and not job_generator.streaming:
+            decompressed_tasks[key] = workflow.add_recorded_task(
+                f"fastq_reconstruct_{file_pair_index}_{job_index}_{file_index}", 'reconstruct',
+                linker.get_dependencies(job_name))
+
+
+def add_error_analysis_tasks(workflow, error_analysis, costs, compression_tasks, decompressed_tasks):
+    config = error_analysis.config
+    for file_pair_index, file_pair in enumerate(config['input_file']):
+        for file_index in range(len(file_pair)):
+            error_analysis.create_error_analysis_metrics_csv(file_pair_index, file_index)
+            quick_look_tasks = []
+            for job_index in range(len(config['jobs'])):
+                key = (file_pair_index, job_index, file_index)
+                if key not in compression_tasks or error_analysis.path_generator.uses_stream_error_analysis(job_index):
+                    # Skipped as redundant, or scored inside the compression job
+                    continue
+                quick_look = error_analysis.uses_quick_look(job_index)
+                prefix = 'quick_look' if quick_look else 'error_analysis'
+                job_name = f"{prefix}_{file_pair_index}_{job_index}_{file_index}"
+
+                def render(dependencies, key=key, job_name=job_name, quick_look=quick_look):
+                    file_pair_index, job_index, file_index = key
+                    return error_analysis.create_error_analysis_script(job_name, job_index, file_pair_index,
+                                                                       file_index, dependencies,
+                                                                       quick_look=quick_look)
+
+                task = workflow.add_task(Task(job_name, prefix, render, costs[prefix]))
+                # SZ3's binary streams are compared once compressed, the others need the decompressed FASTQ
+                upstream = compression_tasks if error_analysis.uses_binary_streams(job_index) else decompressed_tasks
+                workflow.add_edge(upstream[key], task)
+                if quick_look:
+                    quick_look_tasks.append(task)
+
+            if quick_look_tasks:
+                error_analysis.create_quick_look_metrics_csv(file_pair_index, file_index)
+
+                def render_selection(dependencies, file_pair_index=file_pair_index, file_index=file_index):
+                    return error_analysis.create_selection_script(file_pair_index, file_index, dependencies)
+
+                # The selection job looks up the jobs it depends on in the dependency file
+                selection_task = workflow.add_task(Task(
+                    f"pareto_selection_{file_pair_index}_{file_index}", 'selection', render_selection,
+                    costs['selection'], persist_before=True))
+                for task in quick_look_tasks:
+                    workflow.add_edge(task, selection_task, AFTERANY)
+
+
+def add_post_hoc_tasks(workflow, post_hoc_analysis, costs, decompressed_tasks):
+    config = post_hoc_analysis.config
+    for file_pair_index, file_pair in enumerate(config['input_file']):
+        post_hoc_analysis.create_post_hoc_metrics_csv(file_pair_index, 0)
+        truth_script = post_hoc_analysis.create_original_files_vcf_script('truth_vcf', file_pair_index, file_index=0)
+        truth_task = workflow.add_task(Task(f"truth_vcf_{file_pair_index}", 'truth_vcf',
+                                            lambda dependencies, path=truth_script: path, costs['truth_vcf']))
+        for job_index in range(len(config['jobs'])):
+            if (file_pair_index, job_index, 0) not in decompressed_tasks:
+                continue
+            job_name = f"post_hoc_{file_pair_index}_{job_index}_0"
+
+            def render(dependencies, job_name=job_name, job_index=job_index, file_pair_index=file_pair_index):
+                return post_hoc_analysis.create_decompressed_files_vcf_script(job_name, job_index, file_pair_index,
+                                                                              0, dependencies)
+
+            task = workflow.add_task(Task(job_name, 'post_hoc', render, costs['post_hoc']))
+            workflow.add_edge(truth_task, task)
+            for file_index in range(len(file_pair)):
+                workflow.add_edge(decompressed_tasks.get((file_pair_index, job_index, file_index)), task)
+
+
+def submit_task_array(job_generator):
+    # Compression tasks ready together are submitted through the job generator's array support
+    def submit(tasks, script_paths, dependencies):
+        elements = [dict(task.metadata, script_path=script_path) for task, script_path in zip(tasks, script_paths)]
+        nodes, ppn = tasks[0].array_key[1:]
+        return job_generator.submit_job_array(elements, job_generator.executor.active_jobs(dependencies), nodes,
+                                              ppn)
+    return submit
+
+
+def run_seqbench(config_path, stages=None, run_id=None):
+    """Submit the task graph of a configuration's stages, by default its "workflow" list, and wait for the local
+    executor's jobs. Without Compression the analysis depends on the jobs of run_id, by default the last run of
+    the configuration. Returns the IDs of failed local jobs."""
+    sys.path.append(PROJECT_DIR)
+    sys.path.append(os.path.join(PROJECT_DIR, 'Compression_Scripts'))
+    from Compression_Scripts.job_generator import JobGenerator
+    from Compression_Scripts.scheduler_state import SchedulerState
+    from Compression_Scripts.executors import create_executor
+    from Compression_Scripts.dependency_linker import DEFAULT_DEPENDENCY_FILE, default_run_id, latest_run_id
+    from Error_Analysis_Scripts.error_analysis import ErrorAnalysis
+    from Post_Hoc_Scripts.post_hoc_analysis import PostHocAnalysis
+
+    config_path = os.path.abspath(config_path)
+    with open(config_path) as f:
+        config = json.load(f)
+    stages = stages or config.get('workflow', ['Compression', 'Analysis', 'Post-Hoc'])
+    compression = 'Compression' in stages
+    run_id = run_id or config.get('run_id')
+    if not compression and not run_id:
+        # Rerunning the analysis waits on the compression jobs of the configuration's last run
+        run_id = latest_run_id(config_path, config.get('dependency_file', DEFAULT_DEPENDENCY_FILE))
+        if not run_id:
+            logging.warning(f"No run of {config_path} recorded, the analysis jobs won't wait on any compression job")
+    # Named explicitly, the stages import the dependency linker module under different names
+    run_id = run_id or default_run_id(config_path)
+
+    # The stages share one scheduler-state cache and one executor, so the local one sees the dependencies
+    # between stages
+    scheduler_state = SchedulerState(config.get('scheduler_state_ttl', 30))
+    executor = create_executor(config, scheduler_state)
+    job_generator = JobGenerator(config_path, os.path.join(TEMPLATE_DIR, 'compression.sh'),
+                                 os.path.join(TEMPLATE_DIR, 'fastq_split.sh'),
+                                 os.path.join(TEMPLATE_DIR, 'fastq_reconstruct.sh'),
+                                 scheduler_state=scheduler_state, executor=executor, run_id=run_id)
+    error_analysis = None
+    if 'Analysis' in stages:
+        error_analysis = ErrorAnalysis(config_path, os.path.join(TEMPLATE_DIR, 'error_analysis.sh'),
+                                       scheduler_state=scheduler_state, executor=executor, run_id=run_id)
+    post_hoc_analysis = None
+    if 'Post-Hoc' in stages:
+        post_hoc_analysis = PostHocAnalysis(config_path, os.path.join(TEMPLATE_DIR, 'truth_vcf.sh'),
+                                            os.path.join(TEMPLATE_DIR, 'post_hoc.sh'),
+                                            scheduler_state=scheduler_state, executor=executor, run_id=run_id)
+    build_seqbench_workflow(job_generator, error_analysis, post_hoc_analysis, compression=compression).run()
+    return executor.wait()